@@ -18,6 +18,7 @@ import csv
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import matplotlib.pyplot as plt
 from matplotlib.pyplot import figure
+from freeloaderbridge import GuiBridge, PlotScheduler
 
 # Set the maximum number of open figures
 plt.rcParams["figure.max_open_warning"] = 5000  # or any other suitable value
@@ -63,8 +64,12 @@ class Freeloader:
         self.interrupt_flag = False
         self.measurements = []
         self.graph_frame = None  # Define the graph_frame attribute
+        self.weight_axes = None  # Axes, line and canvas of the weight plot, built on first use
+        self.weight_line = None
+        self.weight_canvas = None
         self.window = tk.Tk()
         self.window.title("Weight Measurements")
+        self.bridge = GuiBridge(self.window)  # How the measurement thread reaches the window
         self.dxl_id = DXL_ID
 
         self.portHandler = PortHandler(DEVICENAME)
@@ -110,42 +115,43 @@ class Freeloader:
 
 
     def plot_weight_measurements(self):
-     # Extract the timestamps and weights from the measurements list
-     timestamps, weights, _ = zip(*self.measurements)
-
-     # Clear the previous graph
-     if self.graph_frame is not None:
-        self.graph_frame.destroy()
+     """
+     Redraw the weight plot with every measurement so far. Runs on the Tk
+     thread; the frame, figure and canvas are built once and only the line
+     data changes after that.
+     """
+     if not self.measurements:
+        return
 
-     # Create a new graph frame
-     self.graph_frame = tk.Frame(window)
-     self.graph_frame.grid(row=5, column=0, columnspan=4, padx=10, pady=10)
+     # Extract the timestamps and weights from the measurements list
+     timestamps, weights, _ = zip(*list(self.measurements))
+
+     # Create the graph frame and figure the first time through
+     if self.weight_canvas is None:
+        self.graph_frame = tk.Frame(window)
+        self.graph_frame.grid(row=5, column=0, columnspan=4, padx=10, pady=10)
+
+        fig, ax = plt.subplots()
+        self.weight_line, = ax.plot([], [])
+        ax.set_title("Tensile Load as a Function of Time")
+        ax.set_xlabel("Time")
+        ax.set_ylabel("Tensile Load (LB)")
+        ax.tick_params(axis='x', rotation=45)
+        fig.tight_layout()
+        self.weight_axes = ax
+
+        # Convert the matplotlib figure to a Tkinter-compatible canvas
+        self.weight_canvas = FigureCanvasTkAgg(fig, master=self.graph_frame)
+        self.weight_canvas.get_tk_widget().grid(row=0, column=0)
 
      # Convert the timestamps to datetime objects
      timestamps = [datetime.strptime(ts, "%Y-%m-%d %H:%M:%S") for ts in timestamps]
 
-     # Clear the previous graph
-     plt.clf()
-
-     # Plot the weights over time
-     fig, ax = plt.subplots()
-     ax.plot(timestamps, weights)
-     ax.set_title("Tensile Load as a Function of Time")
-     ax.set_xlabel("Time")
-     ax.set_ylabel("Tensile Load (LB)")
-     ax.tick_params(axis='x', rotation=45)
-     fig.tight_layout()
-
-     # Convert the matplotlib figure to a Tkinter-compatible canvas
-     canvas = FigureCanvasTkAgg(fig, master=self.graph_frame)
-     canvas.draw()
-
-     # Update the embedded graph in the window
-     graph_widget = canvas.get_tk_widget()
-     graph_widget.grid(row=0, column=0)
-
-     # Close the figure after drawing it
-     plt.close(fig)
+     # Update the line in place and rescale to fit it
+     self.weight_line.set_data(timestamps, weights)
+     self.weight_axes.relim()
+     self.weight_axes.autoscale_view()
+     self.weight_canvas.draw_idle()
 
     def disconnect_dynamixel(self):
         """ 
@@ -345,9 +351,6 @@ class Freeloader:
             # Append the measurement to the measurements list
             self.measurements.append((timestamp, weight, dxl_present_position))
 
-            # Call the plot_weight_measurements method to update the plot
-            self.plot_weight_measurements()
-
             # Print weight
             print("Weight: {} LB".format(weight))
 
@@ -357,8 +360,8 @@ class Freeloader:
                 self.set_torque(TORQUE_DISABLE)
                 print("Torque disabled.")
 
-                # Show a warning message box
-                messagebox.showwarning("Warning", "Torque limit exceeded!")
+                # Show a warning message box from the Tk thread
+                self.bridge.call(messagebox.showwarning, "Warning", "Torque limit exceeded!")
 
             # Check if sample break detected
             if previous_weight is not None and weight > 0.50 and weight < (previous_weight * 0.1):
@@ -478,11 +481,14 @@ class Freeloader:
         Method to update the plot with the latest measurements.
         This method should be called periodically to refresh the plot.
         """
+        if not self.measurements:
+            return
+
         # Clear the figure
         plt.clf()
 
         # Extract timestamps and weights from measurements
-        timestamps, weights = zip(*self.measurements)
+        timestamps, weights, _ = zip(*list(self.measurements))
 
         # Plot the measurements
         plt.plot(timestamps, weights)
@@ -493,19 +499,13 @@ class Freeloader:
     def run_gui(self):
         """ 
         Method to run the graphical user interface.
-        This method will start the main GUI loop and update the plot periodically.
+        This method will start the main GUI loop and update the plot periodically,
+        as often as the time each update takes allows.
         """
-        while True:
-            # Update the plot
-            self.update_plot()
-
-            # Update the GUI
-            self.window.update_idletasks()
-            self.window.update()
-
-            # Wait for a short period of time between updates
-            time.sleep(0.1)
-
+        self.plot_scheduler = PlotScheduler(self.window, self.update_plot,
+                                            sample_count=lambda: len(self.measurements))
+        self.bridge.start()
+        self.plot_scheduler.start()
         self.window.mainloop()
 
 
@@ -542,6 +542,9 @@ if __name__ == '__main__':
         window = tk.Tk()
         window.title("Freeloader")
 
+        # The measurement thread updates this window only through the bridge
+        freeloader.bridge = GuiBridge(window)
+
         def start_measurement():
             # Disable the start button and enable the stop button
             start_button.config(state=tk.DISABLED)
@@ -646,7 +649,13 @@ if __name__ == '__main__':
         lot_entry = tk.Entry(window)
         lot_entry.grid(row=2, column=5, padx=10, pady=10)
 
+        # Redraw the plot from the Tk thread as often as its draw time allows
+        plot_scheduler = PlotScheduler(window, freeloader.plot_weight_measurements,
+                                       sample_count=lambda: len(freeloader.measurements))
+
         # Run the GUI event loop
+        freeloader.bridge.start()
+        plot_scheduler.start()
         window.mainloop()
 
     except FreeloaderError as e:
@@ -5,27 +5,34 @@ Written by ChatGPT with guidance by Stephen Wood. Based off of freeLoaderbasic_2
 """
 
 
+import time
+_START_TIME = time.perf_counter()  # Reference point for the cold-start report
+
 import tkinter as tk
 from tkinter import messagebox, filedialog
-import time
 import threading
 import os
-import serial
-from serial.tools import list_ports
-from dynamixel_sdk import *
+from collections import deque
 from datetime import datetime
-import csv
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import matplotlib.pyplot as plt
-from matplotlib.pyplot import figure
 from tkinter.ttk import Button
 from tkinter.ttk import Combobox
+from freeloadertiming import TIMINGS
+from freeloaderbridge import GuiBridge, PlotScheduler
+from freeloaderfilters import make_filter
+from freeloaderbuffers import RunBuffer, SegmentedRunBuffer, format_timestamp, plan_capacity
+from freeloaderjournal import JournalWriter, journal_summary, read_journal
+from freeloadermotion import MotionController
+
+# serial, dynamixel_sdk, csv and matplotlib are imported where they are first
+# needed so the window can be shown before any of them have loaded.
 
 
 # Control table address
 ADDR_MX_GOAL_ANGLE = 30
 ADDR_MX_MOVING_SPEED = 32
 ADDR_MX_PRESENT_ANGLE = 36
+ADDR_MX_PRESENT_SPEED = 38
+ADDR_MX_PRESENT_LOAD = 40
 ADDR_MX_TORQUE_ENABLE = 24
 ADDR_MX_PRESENT_TEMPERATURE = 43
 ADDR_MX_CW_ANGLE_LIMIT = 6
@@ -38,14 +45,96 @@ PROTOCOL_VERSION = 1.0
 BAUDRATE = 57600
 DEVICENAME = 'COM3'
 DXL_ID = 1
+DXL_IDS = [DXL_ID]  # Every servo on the bus, e.g. [1, 2] for a grip plus a clamp
 TORQUE_ENABLE = 1
 TORQUE_DISABLE = 0
 
 DXL_MOVING_STATUS_THRESHOLD = 30
 
+# Goal angle and moving speed are adjacent, so one sync write sets both
+LEN_MX_GOAL = 4
+# Present angle, speed, load, voltage and temperature are read in one block
+LEN_MX_PRESENT_STATE = ADDR_MX_PRESENT_TEMPERATURE + 1 - ADDR_MX_PRESENT_ANGLE
+
+# A measure() run takes one sample per step
+RUN_STEPS = 40 * 4095
+RUN_CAPACITY = plan_capacity(RUN_STEPS, 1, 1)
+
 # Default Loadstar settings
 LOADSTAR_BAUDRATE = 9600
 LOADSTAR_COM_PORT = 'COM2'
+LOADSTAR_RESPONSE_WAIT = 0.2  # Seconds between a weigh command and reading the reply
+
+# Set to a folder to record the serial traffic of every GUI session for replay
+CAPTURE_DIRECTORY = None
+
+# Folder saved runs are overlaid from; the GUI asks for one when this is None
+ARCHIVE_DIRECTORY = None
+
+# Set to a folder to stream every run to a Parquet file there as it is
+# acquired (needs pyarrow; see freeloaderexport)
+EXPORT_DIRECTORY = None
+
+# The GUI journals each run here until it is saved, and offers to restore a
+# run found here when it starts (see freeloaderjournal); None turns this off
+JOURNAL_FILE = "freeloader_journal.bin"
+
+# USB identifiers used to recognise the devices when they are plugged in
+U2D2_USB_IDS = [(0x0403, 0x6014)]  # FTDI FT232H inside the U2D2
+LOADSTAR_USB_IDS = [(0x0403, 0x6001), (0x0403, 0x6015)]  # FTDI bridges used by Loadstar interfaces
+
+# Hot-plug and reconnect settings, in seconds
+PORT_SCAN_INTERVAL = 1.0
+RECONNECT_BACKOFF_MIN = 0.5
+RECONNECT_BACKOFF_MAX = 8.0
+RECONNECT_TIMEOUT = 30.0
+TEMPERATURE_INTERVAL = 1.0  # Between servo temperature reads while the Dynamixel is online
+
+# Written to the position and load columns where samples were lost to a disconnect
+GAP_MARKER = float("nan")
+
+# The reads for one sample are retried on timeouts and corrupt replies until
+# SAMPLE_RETRY_BUDGET seconds after the sample began, which leaves room for
+# one more Loadstar reply. Dynamixel transactions outside a sample are
+# retried for up to DXL_TRANSACTION_BUDGET each.
+SAMPLE_RETRY_BUDGET = 0.5
+DXL_TRANSACTION_BUDGET = 0.02
+
+# Error rates are tracked over this many seconds. Above ERROR_RATE_HIGH the
+# period between samples doubles (up to MAX_SAMPLE_INTERVAL), below
+# ERROR_RATE_LOW it halves back towards the Loadstar's reply wait, the
+# quickest a sample can be read.
+ERROR_RATE_WINDOW = 5.0
+ERROR_RATE_HIGH = 0.05
+ERROR_RATE_LOW = 0.01
+MAX_SAMPLE_INTERVAL = 1.6
+
+# Load cell calibration. Tables are kept per cell in CALIBRATION_FILE; a cell
+# without one reads its raw Loadstar value in LOAD_UNIT. A software tare
+# averages TARE_SAMPLES readings and fails if they spread more than
+# TARE_TOLERANCE. From a tare until the motor next moves the cell is known to
+# be unloaded, and its zero is read every DRIFT_SAMPLE_INTERVAL seconds to
+# correct later samples for drift.
+CALIBRATION_FILE = "loadcell_calibration.json"
+LOADCELL_ID = "default"
+LOAD_UNIT = "lb"
+TARE_SAMPLES = 10
+TARE_TOLERANCE = 0.05
+DRIFT_SAMPLE_INTERVAL = 10.0
+
+# Streaming filter between acquisition and the plot and break detector. It
+# runs on calibrated, tared loads; the raw weights are still stored as
+# well. One of the kinds in freeloaderfilters: "none", "average", "median"
+# or "lowpass" (with a cutoff in Hz; its sample rate is the acquisition
+# rate, 1 / LOADSTAR_RESPONSE_WAIT, unless the settings give one).
+LOAD_FILTER = "median"
+LOAD_FILTER_SETTINGS = {"window": 5}
+
+# A run stops as a broken sample once the filtered load has fallen below
+# BREAK_DROP_RATIO of its peak, after the peak has passed BREAK_MIN_LOAD (in
+# the calibration's display unit)
+BREAK_MIN_LOAD = 0.5
+BREAK_DROP_RATIO = 0.1
 
 
 class FreeloaderError(Exception):
@@ -53,20 +142,177 @@ class FreeloaderError(Exception):
     pass
 
 
+class DeviceDisconnectedError(FreeloaderError):
+    """ Raised when a device stops responding because its port has gone away """
+    pass
+
+
+class DynamixelCommError(FreeloaderError):
+    """
+    Raised when a Dynamixel transaction fails for good.
+    kind is "timeout", "corrupt", "hardware" or "comm", and code is the
+    dynamixel_sdk result code, or the error bits for hardware errors.
+    """
+
+    def __init__(self, message, kind, code):
+        super().__init__(message)
+        self.kind = kind
+        self.code = code
+
+
+class ErrorRateCounter:
+    """
+    Rolling count of device transactions and failures over the last
+    ERROR_RATE_WINDOW seconds, plus running totals of each failure kind.
+    """
+
+    def __init__(self, window=ERROR_RATE_WINDOW):
+        self.window = window
+        self.events = deque()  # (time, failed) for each transaction in the window
+        self.failures = 0
+        self.totals = {"transactions": 0, "retries": 0, "timeout": 0, "corrupt": 0, "hardware": 0, "comm": 0}
+        self.lock = threading.Lock()
+
+    def record(self, kind=None):
+        """ Count one transaction attempt; kind is None for a success """
+        now = time.monotonic()
+        with self.lock:
+            self.events.append((now, kind is not None))
+            self.totals["transactions"] += 1
+            if kind is not None:
+                self.failures += 1
+                self.totals[kind] += 1
+            while self.events and self.events[0][0] < now - self.window:
+                if self.events.popleft()[1]:
+                    self.failures -= 1
+
+    def count_retry(self):
+        with self.lock:
+            self.totals["retries"] += 1
+
+    def rate(self):
+        """ Fraction of transactions in the window that failed """
+        with self.lock:
+            return self.failures / len(self.events) if self.events else 0.0
+
+
+def _dxl_sdk():
+    """
+    Return the dynamixel_sdk module, importing it on first use.
+    Importing it is slow, so it is deferred until a device is connected.
+    """
+    import dynamixel_sdk
+    return dynamixel_sdk
+
+
+def _load_matplotlib():
+    """
+    Import the matplotlib pieces used by the GUI plot.
+    Safe to call from a background thread; no widgets are created here.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+    return Figure, FigureCanvasTkAgg
+
+
+def probe_loadstar(port, baudrate):
+    """
+    Check whether a Loadstar is listening on port.
+    A weigh command is sent and True is returned if a number comes back.
+    """
+    import serial
+
+    try:
+        with serial.Serial(port, baudrate, timeout=0.5) as connection:
+            connection.write(('W\r\n').encode('utf-8'))
+            time.sleep(0.2)
+            float(connection.read_all().decode('utf-8'))
+    except (OSError, ValueError, UnicodeDecodeError):
+        return False
+
+    return True
+
+
+def find_ports(probe=True):
+    """
+    Enumerate the serial ports and pick out the U2D2 and the Loadstar.
+    The U2D2 is recognised by its USB VID/PID. Loadstar candidates are matched
+    by VID/PID (or the LOADSTAR_COM_PORT default) and confirmed with
+    probe_loadstar unless probe is False.
+    Returns a dict mapping "Dynamixel" and "Loadstar" to a port name or None.
+    """
+    from serial.tools import list_ports
+
+    ports = list_ports.comports()
+    found = {"Dynamixel": None, "Loadstar": None}
+
+    for info in ports:
+        if (info.vid, info.pid) in U2D2_USB_IDS:
+            found["Dynamixel"] = info.device
+            break
+    else:
+        if any(info.device == DEVICENAME for info in ports):
+            found["Dynamixel"] = DEVICENAME
+
+    # Never probe the U2D2, a weigh command would end up on the Dynamixel bus
+    candidates = [
+        info.device for info in ports
+        if info.device != found["Dynamixel"]
+        and ((info.vid, info.pid) in LOADSTAR_USB_IDS or info.device == LOADSTAR_COM_PORT)
+    ]
+    for port in candidates:
+        if not probe or probe_loadstar(port, LOADSTAR_BAUDRATE):
+            found["Loadstar"] = port
+            break
+
+    return found
+
+
 class Freeloader:
- def __init__(self):
+ def __init__(self, dxl_ids=None):
+        self.dxl_ids = list(dxl_ids) if dxl_ids is not None else list(DXL_IDS)
         self.dyna_online = False
         self.cell_online = False
         self.portHandler = None
         self.packetHandler = None
+        self.goal_writer = None  # GroupSyncWrite of goal angle and speed for every servo
+        self.speed_writer = None  # GroupSyncWrite of moving speed for every servo
+        self.state_reader = None  # GroupBulkRead of the present state of every servo
+        self.dynamixel_lock = threading.Lock()  # Held for each Dynamixel transaction
+        self.motion = MotionController(self)  # Ramps the moving speed; the only caller of set_speed
+        self.motion_error = None  # FreeloaderError of a failed speed write, raised in the run by check_motion
         self.loadstar = None
+        self.loadstar_response_wait = LOADSTAR_RESPONSE_WAIT
+        self.loadstar_lock = threading.Lock()  # Held for each Loadstar command and reply
+        self.calibration = None  # LoadCalibration of the connected cell
+        self.capture = None  # CaptureWriter recording serial traffic, if any
+        self.bus_errors = ErrorRateCounter()  # Dynamixel transactions
+        self.loadstar_errors = ErrorRateCounter()  # Loadstar weigh commands
+        self.sample_interval = LOADSTAR_RESPONSE_WAIT  # Seconds from one sample's start to the next
+        self.interval_changed_at = 0.0
         self.interrupt_flag = False
-        self.measurements = []
+        self.measurements = RunBuffer()
+        self.load_filter = make_filter(LOAD_FILTER, 1 / self.sample_interval, **LOAD_FILTER_SETTINGS)
+        self.filtered_weight = GAP_MARKER  # Filtered calibrated, tared load of the latest sample
+        self.peak_weight = 0.0
+        # Time, position and filtered weight of the highest load of the whole
+        # run, for the plot's peak marker; peak_weight restarts with each recipe
+        # stage. run_peak_time stays None until the first sample with a load.
+        self.run_peak_time = None
+        self.run_peak_position = GAP_MARKER
+        self.run_peak_weight = float("-inf")
+        self.sample_listeners = []  # Callables given (t, position, weight) of each new sample
+        self.acquisition_threads = []
+        self.run_metadata = {}  # Operator, sample, material and lot of the next run, for streamed exports
+        self.export_directory = EXPORT_DIRECTORY  # Each run is streamed to a Parquet file here, if set
+        self.servo_temperature = float("nan")  # Latest temperature of the first servo in degrees C, from read_servos
+        self.journal_file = None  # Recovery journal each run is written to, if any
+        self.journal = None  # JournalWriter of the current run
+        self.recipe_run = None  # RecipeRun of the current test, if it follows a recipe
+        self.recipe_stage = None  # Name of the recipe stage running now
         self.window = None
         self.graph_frame = None
 
-        self.portHandler = PortHandler(DEVICENAME)
-        self.packetHandler = PacketHandler(PROTOCOL_VERSION)
         self.machine_steps = None
         self.machine_steps = 0
         self.is_moving = False
@@ -84,8 +330,10 @@ class Freeloader:
         if self.dyna_online:
             raise FreeloaderError("Dynamixel already connected.")
 
-        # Initialize the port
-        self.portHandler = PortHandler(port)
+        # Initialize the port and packet handlers
+        sdk = _dxl_sdk()
+        self.portHandler = self.make_port_handler(port)
+        self.packetHandler = sdk.PacketHandler(PROTOCOL_VERSION)
 
         # Open the port
         if self.portHandler.openPort():
@@ -99,12 +347,26 @@ class Freeloader:
         else:
             raise FreeloaderError("Failed to change baudrate.")
 
-        # Enable Dynamixel torque
-        dxl_comm_result, dxl_error = self.packetHandler.write1ByteTxRx(self.portHandler, DXL_ID, ADDR_MX_TORQUE_ENABLE, TORQUE_ENABLE)
-        if dxl_comm_result != COMM_SUCCESS:
-            raise FreeloaderError("Dynamixel torque enable failed.")
-        elif dxl_error != 0:
-            raise FreeloaderError("Dynamixel error occurred.")
+        # Setting the baudrate reopens the serial port, so tap it afterwards
+        self.tap_ports()
+
+        # Enable Dynamixel torque on every servo on the bus
+        for dxl_id in self.dxl_ids:
+            dxl_comm_result, dxl_error = self.packetHandler.write1ByteTxRx(self.portHandler, dxl_id, ADDR_MX_TORQUE_ENABLE, TORQUE_ENABLE)
+            if dxl_comm_result != sdk.COMM_SUCCESS:
+                raise FreeloaderError(f"Dynamixel {dxl_id} torque enable failed.")
+            elif dxl_error != 0:
+                raise FreeloaderError(f"Dynamixel {dxl_id} error occurred.")
+
+        # Build the group packets once so each cycle only changes their data
+        self.goal_writer = sdk.GroupSyncWrite(self.portHandler, self.packetHandler, ADDR_MX_GOAL_ANGLE, LEN_MX_GOAL)
+        self.speed_writer = sdk.GroupSyncWrite(self.portHandler, self.packetHandler, ADDR_MX_MOVING_SPEED, 2)
+        self.state_reader = sdk.GroupBulkRead(self.portHandler, self.packetHandler)
+        for dxl_id in self.dxl_ids:
+            self.goal_writer.addParam(dxl_id, [0, 0, 0, 0])
+            self.speed_writer.addParam(dxl_id, [0, 0])
+            if not self.state_reader.addParam(dxl_id, ADDR_MX_PRESENT_ANGLE, LEN_MX_PRESENT_STATE):
+                raise FreeloaderError(f"Failed to add Dynamixel {dxl_id} to the bulk read.")
 
         self.dyna_online = True
 
@@ -120,18 +382,169 @@ class Freeloader:
         except ImportError:
             raise FreeloaderError("Failed to import serial module.")
 
+        if self.calibration is None:
+            self.calibration = self.load_calibration()
+
         try:
-            self.loadstar = serial.Serial(com_port, baudrate)
+            self.loadstar = self.open_loadstar(com_port, baudrate)
             self.cell_online = True
         except serial.SerialException:
             raise FreeloaderError("Failed to connect to the Loadstar device.")
 
+        self.tap_ports()
+
+ def load_calibration(self, cell_id=LOADCELL_ID):
+        """
+        Method to load the calibration table of a load cell from CALIBRATION_FILE.
+        A cell with no table is left uncalibrated, reading raw values in LOAD_UNIT.
+        """
+        from freeloadercalibration import CalibrationTable, LoadCalibration, load_tables
+
+        try:
+            table = load_tables(CALIBRATION_FILE).get(cell_id)
+        except (OSError, ValueError, KeyError) as e:
+            raise FreeloaderError(f"Failed to read the calibration of load cell {cell_id}: {e}")
+        if table is None:
+            table = CalibrationTable(cell_id, LOAD_UNIT)
+        return LoadCalibration(table, LOAD_UNIT)
+
+ def make_port_handler(self, port):
+        """ Create the Dynamixel PortHandler for port. Replaced by the replay backend. """
+        return _dxl_sdk().PortHandler(port)
+
+ def open_loadstar(self, com_port, baudrate):
+        """ Open the Loadstar serial connection. Replaced by the replay backend. """
+        import serial
+        return serial.Serial(com_port, baudrate)
+
+ def start_capture(self, filename):
+        """
+        Method to record all serial traffic of both devices to a capture file
+        that freeloadercapture can replay. Connections opened later are tapped
+        as they are made.
+        """
+        from freeloadercapture import CaptureWriter
+        self.capture = CaptureWriter(filename)
+        self.tap_ports()
+
+ def stop_capture(self):
+        """ Method to stop recording serial traffic and close the capture file """
+        if self.capture is None:
+            return
+
+        from freeloadercapture import TappedSerial
+        if isinstance(getattr(self.portHandler, "ser", None), TappedSerial):
+            self.portHandler.ser = self.portHandler.ser.inner
+        if isinstance(self.loadstar, TappedSerial):
+            self.loadstar = self.loadstar.inner
+        self.capture.close()
+        self.capture = None
+
+ def tap_ports(self):
+        """ Wrap any open, untapped serial connection so the capture sees its traffic """
+        if self.capture is None:
+            return
+
+        from freeloadercapture import CHANNEL_DYNAMIXEL, CHANNEL_LOADSTAR, TappedSerial
+        port_serial = getattr(self.portHandler, "ser", None)
+        if port_serial is not None and not isinstance(port_serial, TappedSerial):
+            self.portHandler.ser = TappedSerial(port_serial, self.capture, CHANNEL_DYNAMIXEL)
+        if self.loadstar is not None and not isinstance(self.loadstar, TappedSerial):
+            self.loadstar = TappedSerial(self.loadstar, self.capture, CHANNEL_LOADSTAR)
+
  def disconnect_loadstar(self):
         """ Method to disconnect from the Loadstar device """
         if self.loadstar:
             self.loadstar.close()
             self.cell_online = False
 
+ def report_error(self, message):
+        """
+        Method to report an error raised on a worker thread.
+        Prints it by default. FreeloaderGUI replaces it to show a message box
+        from the Tk thread, and the acquisition engine to send errors back to
+        the GUI process; Tk must never be called from the worker thread itself.
+        """
+        print("Error:", message)
+
+ def dynamixel_lost(self):
+        """ Mark the Dynamixel offline after its port has gone away so it can be reconnected """
+        self.dyna_online = False
+        try:
+            self.portHandler.closePort()
+        except OSError:
+            pass
+
+ def loadstar_lost(self):
+        """ Mark the Loadstar offline after its port has gone away so it can be reconnected """
+        self.cell_online = False
+        try:
+            self.loadstar.close()
+        except OSError:
+            pass
+
+ def wait_for_reconnect(self, timeout=RECONNECT_TIMEOUT):
+        """
+        Block until both devices are online again, the stop button is pressed
+        or timeout seconds have passed. Reconnecting is left to a DeviceMonitor.
+        Returns True if both devices came back.
+        """
+        deadline = time.monotonic() + timeout
+        while not (self.dyna_online and self.cell_online):
+            if self.interrupt_flag or time.monotonic() > deadline:
+                return False
+            time.sleep(0.1)
+
+        return True
+
+ def record_gap(self):
+        """ Append a gap marker row so the saved run shows where samples were lost """
+        self.add_measurement(time.time(), GAP_MARKER, GAP_MARKER)
+
+ @TIMINGS.timed("add_measurement")
+ def add_measurement(self, t, position, weight):
+        """
+        Store a sample taken at t (epoch seconds) with its filtered load and
+        hand it to every sample listener. The filter, peak and break detector
+        see the calibrated, tared load, as the raw weight carries the tare
+        offset. Allocates nothing beyond the two floats of the calibrated and
+        filtered load while the run buffer has room and there are no
+        listeners (see freeloaderbuffers --check).
+        """
+        filtered = self.load_filter.update(self.calibrated_load(weight))
+        self.measurements.append(t, position, weight, filtered)
+        self.filtered_weight = filtered
+        if filtered > self.peak_weight:
+            self.peak_weight = filtered
+        if filtered > self.run_peak_weight:
+            self.run_peak_time = t
+            self.run_peak_position = position
+            self.run_peak_weight = filtered
+        for listener in self.sample_listeners:
+            listener(t, position, weight)
+
+ def clear_measurements(self, capacity=RUN_CAPACITY, long_run=None):
+        """
+        Method to forget the previous run and allocate room for capacity samples.
+        long_run is an optional dict of SegmentedRunBuffer settings, including
+        its directory, for runs that stream to rolling segment files.
+        """
+        self.measurements.close()
+        if long_run is not None:
+            self.measurements = SegmentedRunBuffer(capacity=capacity, **long_run)
+        else:
+            self.measurements = RunBuffer(capacity)
+        self.load_filter.reset()
+        self.filtered_weight = GAP_MARKER
+        self.peak_weight = 0.0
+        self.run_peak_time = None
+        self.run_peak_position = GAP_MARKER
+        self.run_peak_weight = float("-inf")
+
+ def sample_broken(self):
+        """ Method to check whether the filtered load shows the sample has broken """
+        return self.peak_weight > BREAK_MIN_LOAD and self.filtered_weight < self.peak_weight * BREAK_DROP_RATIO
+
  def get_machine_steps(self):
         # Return the current machine steps
         return self.machine_steps
@@ -141,14 +554,187 @@ class Freeloader:
         # Set the motor steps to the specified value
         self.machine_steps = steps
 
+ def transact(self, description, call, deadline=None):
+        """
+        Method to run one Dynamixel transaction with retries.
+        call performs the packetHandler or group call and returns its result.
+        Timeouts, corrupt replies and a busy port are retried until deadline
+        (a time.monotonic time; reads for a sample pass the sample's) or, by
+        default, until DXL_TRANSACTION_BUDGET runs out; hardware errors
+        reported by the servo are not. Every attempt is counted in
+        bus_errors. Returns the result of call, or raises DynamixelCommError
+        or DeviceDisconnectedError.
+        """
+        sdk = _dxl_sdk()
+        if deadline is None:
+            deadline = time.monotonic() + DXL_TRANSACTION_BUDGET
+        while True:
+            try:
+                with self.dynamixel_lock:
+                    result = call()
+            except OSError:
+                self.dynamixel_lost()
+                raise DeviceDisconnectedError("Lost connection to the Dynamixel.")
+
+            # Group packets return only a comm result; TxRx calls end with (comm result, error)
+            if isinstance(result, int):
+                dxl_comm_result, dxl_error = result, 0
+            else:
+                dxl_comm_result, dxl_error = result[-2], result[-1]
+
+            if dxl_comm_result == sdk.COMM_SUCCESS and dxl_error == 0:
+                self.bus_errors.record()
+                return result
+
+            if dxl_comm_result != sdk.COMM_SUCCESS:
+                if dxl_comm_result == sdk.COMM_RX_TIMEOUT:
+                    kind = "timeout"
+                elif dxl_comm_result == sdk.COMM_RX_CORRUPT:
+                    kind = "corrupt"
+                else:
+                    kind = "comm"
+                message = f"{description} failed: {self.packetHandler.getTxRxResult(dxl_comm_result)}"
+                code = dxl_comm_result
+            else:
+                kind = "hardware"
+                message = f"{description} failed: {self.packetHandler.getRxPacketError(dxl_error)}"
+                code = dxl_error
+            self.bus_errors.record(kind)
+
+            retryable = kind != "hardware" and dxl_comm_result != sdk.COMM_TX_FAIL
+            if not retryable or time.monotonic() >= deadline:
+                raise DynamixelCommError(message, kind, code)
+            self.bus_errors.count_retry()
+
+ def adapt_sample_interval(self):
+        """
+        Method to slow sampling down while either device's error rate is
+        high and speed it back up once it recovers. Changes at most once per
+        quarter of the error-rate window so each change has time to show.
+        """
+        now = time.monotonic()
+        if now - self.interval_changed_at < ERROR_RATE_WINDOW / 4:
+            return
+
+        quickest = self.loadstar_response_wait
+        rate = max(self.bus_errors.rate(), self.loadstar_errors.rate())
+        if rate > ERROR_RATE_HIGH and self.sample_interval < MAX_SAMPLE_INTERVAL:
+            self.sample_interval = min(max(self.sample_interval * 2, quickest), MAX_SAMPLE_INTERVAL)
+            self.interval_changed_at = now
+        elif rate < ERROR_RATE_LOW and self.sample_interval > quickest:
+            self.sample_interval = max(self.sample_interval / 2, quickest)
+            self.interval_changed_at = now
+
+ def sample_deadline(self):
+        """ Method to get the time.monotonic time by which the reads of a sample starting now must succeed """
+        return time.monotonic() + SAMPLE_RETRY_BUDGET
+
+ @TIMINGS.timed("set_speed")
  def set_speed(self, speed):
         """
         Method to set the speed of the Dynamixel motor.
         speed is an integer between 0 and 1023.
+        With several servos on the bus they are all set in one sync write packet.
+        This writes the register at once; motion commands go through
+        command_speed so the speed is ramped.
         """
-        self.packetHandler.write2ByteTxRx(
-            self.portHandler, DXL_ID, ADDR_MX_MOVING_SPEED, speed
-        )
+        if len(self.dxl_ids) == 1:
+            self.transact("Setting the Dynamixel speed", lambda: self.packetHandler.write2ByteTxRx(
+                self.portHandler, self.dxl_ids[0], ADDR_MX_MOVING_SPEED, speed
+            ))
+        else:
+            sdk = _dxl_sdk()
+            data = [sdk.DXL_LOBYTE(speed), sdk.DXL_HIBYTE(speed)]
+            for dxl_id in self.dxl_ids:
+                self.speed_writer.changeParam(dxl_id, data)
+            self.transact("Setting the Dynamixel speeds", self.speed_writer.txPacket)
+
+ def command_speed(self, speed):
+        """
+        Method to ramp the motor to moving speed register value speed along
+        the motion profile. Returns at once; self.motion writes the setpoints.
+        Any movement may load the cell, so drift is no longer tracked until
+        the next tare.
+        """
+        if speed and self.calibration is not None:
+            self.calibration.unloaded = False
+        self.motion.command(speed)
+
+ def write_setpoint(self, speed):
+        """
+        Method the motion controller writes each speed setpoint with.
+        Returns False if it could not be written. A lost connection is
+        ridden out by the run, which resends once it is back; any other
+        error is handed to the run through check_motion, or reported if no
+        run is going.
+        """
+        if not self.dyna_online:
+            return False
+        try:
+            self.set_speed(speed)
+        except DeviceDisconnectedError:
+            return False
+        except FreeloaderError as e:
+            if self.acquiring():
+                self.motion_error = e
+            else:
+                self.report_error(str(e))
+            return False
+        return True
+
+ def check_motion(self):
+        """ Method to raise, on a run's thread, the error of a speed setpoint that could not be written """
+        error, self.motion_error = self.motion_error, None
+        if error is not None:
+            raise error
+
+ def set_goals(self, goals):
+        """
+        Method to command several servos at once.
+        goals maps a servo ID to a (goal angle, moving speed) pair. Every
+        servo is sent its goal in a single sync write packet.
+        """
+        sdk = _dxl_sdk()
+        for dxl_id, (angle, speed) in goals.items():
+            self.goal_writer.changeParam(dxl_id, [
+                sdk.DXL_LOBYTE(angle), sdk.DXL_HIBYTE(angle),
+                sdk.DXL_LOBYTE(speed), sdk.DXL_HIBYTE(speed),
+            ])
+        self.transact("Setting the Dynamixel goals", self.goal_writer.txPacket)
+
+ @TIMINGS.timed("read_servos")
+ def read_servos(self):
+        """
+        Method to sample every servo on the bus with one bulk read.
+        Returns a dict mapping each servo ID to a tuple of
+        (angle, speed, load, temperature) raw register values.
+        """
+        self.transact("Dynamixel bulk read", self.state_reader.txRxPacket)
+
+        states = {}
+        for dxl_id in self.dxl_ids:
+            if not self.state_reader.isAvailable(dxl_id, ADDR_MX_PRESENT_ANGLE, LEN_MX_PRESENT_STATE):
+                raise FreeloaderError(f"No bulk read data from Dynamixel {dxl_id}.")
+            states[dxl_id] = (
+                self.state_reader.getData(dxl_id, ADDR_MX_PRESENT_ANGLE, 2),
+                self.state_reader.getData(dxl_id, ADDR_MX_PRESENT_SPEED, 2),
+                self.state_reader.getData(dxl_id, ADDR_MX_PRESENT_LOAD, 2),
+                self.state_reader.getData(dxl_id, ADDR_MX_PRESENT_TEMPERATURE, 1),
+            )
+        self.servo_temperature = float(states[self.dxl_ids[0]][3])
+
+        return states
+
+ def time_bus_cycle(self, cycles=100):
+        """
+        Method to measure the bus time of one full read cycle.
+        Runs cycles bulk reads and returns the mean time per cycle in
+        milliseconds, which should stay flat as servos are added.
+        """
+        start = time.perf_counter()
+        for _ in range(cycles):
+            self.read_servos()
+        return (time.perf_counter() - start) * 1000 / cycles
 
  def disconnect_dynamixel(self):
         """ 
@@ -159,12 +745,13 @@ class Freeloader:
         if not self.dyna_online:
             raise FreeloaderError("No Dynamixel connected.")
 
-        # Disable Dynamixel torque
-        dxl_comm_result, dxl_error = self.packetHandler.write1ByteTxRx(self.portHandler, DXL_ID, ADDR_MX_TORQUE_ENABLE, TORQUE_DISABLE)
-        if dxl_comm_result != COMM_SUCCESS:
-            raise FreeloaderError("Dynamixel torque disable failed.")
-        elif dxl_error != 0:
-            raise FreeloaderError("Dynamixel error occurred.")
+        # Disable Dynamixel torque on every servo on the bus
+        for dxl_id in self.dxl_ids:
+            dxl_comm_result, dxl_error = self.packetHandler.write1ByteTxRx(self.portHandler, dxl_id, ADDR_MX_TORQUE_ENABLE, TORQUE_DISABLE)
+            if dxl_comm_result != _dxl_sdk().COMM_SUCCESS:
+                raise FreeloaderError(f"Dynamixel {dxl_id} torque disable failed.")
+            elif dxl_error != 0:
+                raise FreeloaderError(f"Dynamixel {dxl_id} error occurred.")
 
         # Close the port
         self.portHandler.closePort()
@@ -172,25 +759,112 @@ class Freeloader:
         self.dyna_online = False
 
 
- def get_weight(self):
+ def tare_load_cell(self, samples=TARE_SAMPLES):
+        """
+        Method to tare the load cell in software.
+        The mean of samples readings becomes the new zero, which is checked
+        rather than trusting the Loadstar's TARE command, and drift tracking
+        starts again from it. Returns the tare offset in the calibration's unit.
+        """
+        if not self.cell_online:
+            raise FreeloaderError("Load cell not connected.")
+
+        from freeloadercalibration import CalibrationError
+
+        if self.calibration is None:
+            self.calibration = self.load_calibration()
+        readings = [self.get_weight() for _ in range(samples)]
+        try:
+            return self.calibration.tare(time.time(), readings, TARE_TOLERANCE)
+        except CalibrationError as e:
+            raise FreeloaderError(f"Tare failed: {e}")
+
+ def track_drift(self):
+        """
+        Method to read the load cell zero while the machine is idle, so drift
+        since the last tare can be subtracted from later samples.
+        Does nothing while a run or jog is in progress, or unless the cell has
+        been tared and the motor has not moved since, as a clamped specimen
+        may still be loading it.
+        """
+        if not self.cell_online or self.calibration is None or not self.calibration.unloaded:
+            return
+        if self.is_moving or self.acquiring():
+            return
+
+        self.calibration.observe_idle(time.time(), self.get_weight())
+
+ def calibrated_loads(self, times, weights):
+        """
+        Method to convert a block of raw weights taken at times
+        (epoch seconds) to calibrated, tared and drift-corrected loads.
+        Returns a NumPy array.
+        """
+        if self.calibration is None:
+            self.calibration = self.load_calibration()
+        return self.calibration.apply(times, weights)
+
+ def calibrated_load(self, weight):
+        """
+        Method to convert one raw weight just read to a calibrated, tared and
+        drift-corrected load, or to leave it raw while no cell is connected.
+        """
+        calibration = self.calibration
+        return calibration.load(weight) if calibration is not None else weight
+
+ def load_label(self):
+        """ Method to get the axis and column label for calibrated loads """
+        from freeloadercalibration import load_label
+
+        return load_label(self.calibration.display_unit if self.calibration is not None else LOAD_UNIT)
+
+ @TIMINGS.timed("get_position")
+ def get_position(self, deadline=None):
+        """
+        Method to get the current position of the first Dynamixel motor.
+        Returns an integer between 0 and 4095. deadline is passed on to transact.
+        """
+        dxl_present_position, dxl_comm_result, dxl_error = self.transact(
+            "Getting the Dynamixel position", lambda: self.packetHandler.read2ByteTxRx(
+                self.portHandler, self.dxl_ids[0], ADDR_MX_PRESENT_ANGLE
+            ), deadline)
+
+        return dxl_present_position
+
+ @TIMINGS.timed("get_weight")
+ def get_weight(self, deadline=None):
         """
         Method to read the weight from the Loadstar device.
         It sends the command to the device and waits for the response.
-        If the communication fails, it will raise a descriptive
-        FreeloaderError.
+        An empty or garbled reply is retried until deadline (a time.monotonic
+        time, normally the end of the sample's retry budget); without one
+        there is a single attempt. Every attempt is counted in
+        loadstar_errors. If the communication fails, it will raise a
+        descriptive FreeloaderError.
         """
         if not self.cell_online:
             raise FreeloaderError("Loadstar device is not connected.")
 
-        self.loadstar.write(('W\r\n').encode('utf-8'))  # Send weigh command
-        time.sleep(0.2)  # Wait for the response
-        response = self.loadstar.read_all().decode('utf-8')  # Read the response
-
-        try:
-            weight = float(response)
+        while True:
+            try:
+                with self.loadstar_lock:
+                    self.loadstar.write(('W\r\n').encode('utf-8'))  # Send weigh command
+                    time.sleep(self.loadstar_response_wait)  # Wait for the response
+                    response = self.loadstar.read_all().decode('utf-8')  # Read the response
+            except OSError:
+                self.loadstar_lost()
+                raise DeviceDisconnectedError("Lost connection to the Loadstar device.")
+
+            try:
+                weight = float(response)
+            except ValueError:
+                self.loadstar_errors.record("corrupt" if response.strip() else "timeout")
+                if deadline is None or time.monotonic() >= deadline:
+                    raise FreeloaderError("Failed to read weight from the Loadstar device.")
+                self.loadstar_errors.count_retry()
+                continue
+            self.loadstar_errors.record()
             return weight
-        except ValueError:
-            raise FreeloaderError("Failed to read weight from the Loadstar device.")
 
  def measure(self):
         """
@@ -201,17 +875,19 @@ class Freeloader:
             initial_steps = self.get_machine_steps()
 
             # Set the desired speed (adjust as needed)
-            self.set_speed(2040)
+            self.command_speed(2040)
 
-            # Define the number of steps for one revolution
-            steps_per_revolution = 4095 # Adjust this value based on your motor's steps per revolution
-            revolutions = 40 * steps_per_revolution
+            # One sample is taken per step
+            revolutions = RUN_STEPS
             mm_per_step = 104/(4095*40)
 
             for _ in range(revolutions):
                 if self.interrupt_flag:  # Check if the stop button was pressed
                     break
 
+                sample_start = time.perf_counter_ns()
+                deadline = self.sample_deadline()
+
                 # Move the motor by one step
                 self.set_machine_steps(initial_steps + 1)
                 initial_steps += 1
@@ -220,21 +896,39 @@ class Freeloader:
                 distance_mm = mm_per_step * initial_steps
 
                 # Get timestamp, position, and weight values
-                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                t = time.time()
                 position =  mm_per_step * initial_steps
-                weight = self.get_weight()  # Replace this with the actual method to get weight value
-
-                # Append measurement data to self.measurements list
-                self.measurements.append((timestamp, position, weight))
+                try:
+                    weight = self.get_weight(deadline)
+                    self.check_motion()
+                except DeviceDisconnectedError:
+                    # Keep the run alive across a brief disconnect
+                    self.record_gap()
+                    if not self.wait_for_reconnect():
+                        raise
+                    self.motion.resend()
+                    continue
+
+                # Store the sample in the run buffer
+                self.add_measurement(t, position, weight)
+                if self.sample_broken():
+                    break
 
-                # Sleep for a short duration between steps
-                time.sleep(0.001)  # Adjust this delay as needed
+                if TIMINGS.enabled:
+                    TIMINGS.record("measure", time.perf_counter_ns() - sample_start)
 
-            # Stop the motor by setting the moving speed to 0
-            self.set_speed(0)
+                # Wait for the next sample period, longer while either device is dropping replies
+                self.adapt_sample_interval()
+                remaining = sample_start / 1e9 + self.sample_interval - time.perf_counter()
+                if remaining > 0:
+                    time.sleep(remaining)
 
         except FreeloaderError as e:
-            messagebox.showerror("Error", str(e))
+            self.report_error(str(e))
+
+        finally:
+            # Stop the motor by setting the moving speed to 0, however the run ended
+            self.command_speed(0)
 
  def perform_motor_movement(self):
         """
@@ -245,7 +939,8 @@ class Freeloader:
             initial_steps = self.get_machine_steps()
 
             # Set the desired speed (adjust as needed)
-            self.set_speed(2000)
+            self.command_speed(2000)
+            motor_was_lost = False
 
             # Define the number of steps for one revolution
             steps_per_revolution = 4095  # Adjust this value based on your motor's steps per revolution
@@ -259,27 +954,34 @@ class Freeloader:
                 self.set_machine_steps(initial_steps + 1)
                 initial_steps += 1
 
+                # Restart the motor once the monitor has brought it back
+                if not self.dyna_online:
+                    motor_was_lost = True
+                elif motor_was_lost:
+                    motor_was_lost = False
+                    self.motion.resend()
+
                 # Sleep for a short duration between steps
                 time.sleep(0.001)  # Adjust this delay as needed
 
             # Stop the motor by setting the moving speed to 0
-            self.set_speed(0)
+            self.command_speed(0)
 
         except FreeloaderError as e:
-            messagebox.showerror("Error", str(e))
+            self.report_error(str(e))
 
  
  def move_motor_in_one_direction_down(self):
         """ Method to move the motor in one direction (continuous) FOR ADJUSTING MOTOR """
         if not self.is_moving:
             self.is_moving = True
-            self.set_speed(1020)
+            self.command_speed(1020)
 
  def move_motor_in_one_direction_up(self):
         """ Method to move the motor in one direction (continuous) FOR ADJUSTING MOTOR """
         if not self.is_moving:
             self.is_moving = True
-            self.set_speed(2040)
+            self.command_speed(2040)
 
  def stop_motor_movement(self):
         """ Method to stop the motor movement """
@@ -294,11 +996,11 @@ class Freeloader:
                 self.move_motor_in_one_direction()
                 time.sleep(0.001)  # Adjust this delay as needed
 
-            self.set_speed(0)  # Stop the motor
+            self.command_speed(0)  # Stop the motor
             self.is_moving = False  # Update the is_moving attribute
 
         except FreeloaderError as e:
-            messagebox.showerror("Error", str(e))
+            self.report_error(str(e))
 
  def continuous_motor_movement_down(self):
         """ Method to continuously move the motor in one direction """
@@ -309,22 +1011,120 @@ class Freeloader:
                 self.move_motor_in_one_direction()
                 time.sleep(0.001)  # Adjust this delay as needed
 
-            self.set_speed(0)  # Stop the motor
+            self.command_speed(0)  # Stop the motor
             self.is_moving = False  # Update the is_moving attribute
 
         except FreeloaderError as e:
-            messagebox.showerror("Error", str(e))
+            self.report_error(str(e))
 
 
- def start_measurement(self):
-        """ Method to start the measurement process """
+ def start_measurement(self, recipe=None):
+        """
+        Method to start the measurement process.
+        recipe is an optional recipe definition (see freeloaderrecipes) to run
+        instead of the fixed 40 revolution pull.
+        """
         self.interrupt_flag = False  # Reset the interrupt flag
-        self.measurements = []
-        motor_thread = threading.Thread(target=self.perform_motor_movement)
-        motor_thread.start()
+        self.motion_error = None
+        if self.calibration is not None:
+            self.calibration.unloaded = False  # A specimen is clamped in now
+        if recipe is not None:
+            from freeloaderrecipes import Recipe, RecipeRun
+
+            recipe = Recipe(recipe)
+            self.clear_measurements(recipe.capacity(), recipe.long_run)
+            self.recipe_run = RecipeRun(self, recipe)
+            self.acquisition_threads = [threading.Thread(target=self.recipe_run.run)]
+        else:
+            self.recipe_run = None
+            self.clear_measurements()
 
-        # Perform measurements asynchronously while the motor moves
-        threading.Thread(target=self.measure).start()
+            # measure drives the motor as well as sampling, so one thread owns its speed;
+            # perform_motor_movement is only for trying the motor on its own
+            self.acquisition_threads = [threading.Thread(target=self.measure)]
+
+        self.start_recording()
+        for thread in self.acquisition_threads:
+            thread.start()
+
+ def start_recording(self):
+        """
+        Method to start the streamed export and recovery journal of the run
+        about to start. They listen from the first sample and finish once
+        acquiring() turns False.
+        """
+        if self.export_directory is not None:
+            self.start_export(self.export_directory)
+        # Long runs are already on disk in their segment files
+        if self.journal_file is not None and not isinstance(self.measurements, SegmentedRunBuffer):
+            self.start_journal(self.journal_file)
+
+ def acquiring(self):
+        """ Method to check whether a run's acquisition threads are still going """
+        return any(thread.is_alive() for thread in self.acquisition_threads)
+
+ def start_export(self, directory):
+        """ Method to stream the run about to start to a new Parquet file in directory """
+        try:
+            from freeloaderexport import ParquetRunWriter
+        except ImportError:
+            self.report_error("Streaming runs to Parquet needs the pyarrow package.")
+            return
+
+        filename = os.path.join(directory, "run_{}.parquet".format(datetime.now().strftime("%Y%m%d%H%M%S")))
+        try:
+            ParquetRunWriter(filename, self, self.run_metadata).start()
+        except OSError as e:
+            self.report_error(f"Could not stream the run to {filename}: {e}")
+
+ def start_journal(self, filename):
+        """ Method to journal the run about to start to filename until it is saved """
+        if self.journal is not None:
+            self.journal.close()
+        try:
+            self.journal = JournalWriter(filename, self, self.run_metadata)
+        except OSError as e:
+            self.journal = None
+            self.report_error(f"Could not write the recovery journal {filename}: {e}")
+            return
+        self.journal.start()
+
+ def discard_journal(self):
+        """ Method to delete the recovery journal once its run has been saved or turned down """
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        if self.journal_file is not None:
+            try:
+                os.remove(self.journal_file)
+            except OSError:
+                pass  # Already gone
+
+ def restore_journal(self, filename):
+        """
+        Method to make the run in a recovery journal the current run, with
+        the tare it was taken with. Returns the journal's state dict.
+        """
+        import numpy as np
+
+        state, columns = read_journal(filename)
+        self.clear_measurements(max(len(columns[0]), 1))
+        self.measurements.fill(columns)
+        self.run_metadata = state.get("metadata", {})
+
+        if self.calibration is None:
+            self.calibration = self.load_calibration()
+        if "calibration" in state and state.get("load_cell") == self.calibration.table.cell_id:
+            self.calibration.restore(state["calibration"])
+
+        # Put back the peak the plot marks
+        filtered = np.frombuffer(columns[3])
+        if len(filtered) and not np.isnan(filtered).all():
+            peak = int(np.nanargmax(filtered))
+            self.run_peak_time = columns[0][peak]
+            self.run_peak_position = columns[1][peak]
+            self.run_peak_weight = self.peak_weight = columns[3][peak]
+        return state
 
  def stop_measurement(self):
         """ Method to stop the measurement process """
@@ -343,43 +1143,209 @@ class Freeloader:
      if not self.measurements:
         raise FreeloaderError("No measurements available.")
 
+     filename = filedialog.asksaveasfilename(defaultextension=".csv",
+                                             filetypes=[("CSV", "*.csv"), ("Parquet", "*.parquet"),
+                                                        ("Compressed run", "*.flrun")])
+     metadata = {"operator": operator_initials, "sample": sample_description, "material": material_code,
+                 "lot": lot_number, "sample_type": selected_option}
+     if filename.lower().endswith(".parquet"):
+        self.export_parquet(filename, metadata)
+     elif filename.lower().endswith(".flrun"):
+        self.save_archive(filename, metadata)
+     else:
+        self.save_csv(filename, metadata)
+     self.discard_journal()
+
+     # Keep the stage timings of the run next to its data, whatever its format
+     if TIMINGS.histograms:
+        try:
+           TIMINGS.dump(os.path.splitext(filename)[0] + "_timing.csv")
+        except IOError:
+           raise FreeloaderError("Failed to save the stage timings to file.")
+
+     # Have the run's decimated curve ready for overlays; if this fails it is
+     # built the first time the run is overlaid instead
+     from freeloaderoverlay import cache_run
+
      try:
-        filename = filedialog.asksaveasfilename(defaultextension=".csv")
-        with open(filename, 'w', newline='') as file:
-            writer = csv.writer(file)
+        cache_run(filename)
+     except (OSError, ValueError, ImportError):
+        pass
 
-            # Write the operator initials as a row
-            writer.writerow(["freeLoaderGUI_4_0"])
+ def save_csv(self, filename, metadata):
+        """ Method to save the run to a CSV file, with metadata rows above the samples """
+        import csv
 
-            # Write the operator initials as a row
-            writer.writerow(["Operator Initials", operator_initials])
+        try:
+            with open(filename, 'w', newline='') as file:
+                writer = csv.writer(file)
+
+                # Write the operator initials as a row
+                writer.writerow(["freeLoaderGUI_4_0"])
+
+                # Write the operator initials as a row
+                writer.writerow(["Operator Initials", metadata["operator"]])
+
+                # Write the sample name as a row
+                writer.writerow(["Sample Name", metadata["sample"]])
+
+                # Write the material code as a row
+                writer.writerow(["Material Code", metadata["material"]])
+
+                # Write the lot number as a row
+                writer.writerow(["Lot #", metadata["lot"]])
+
+                # Write the selected option from the combobox as a row
+                writer.writerow(["Selected Option", metadata["sample_type"]])
+
+                # Raw Loadstar weights are kept next to the calibrated loads,
+                # written a block at a time so long runs need not fit in memory
+                if self.calibration is None:
+                    self.calibration = self.load_calibration()
+                writer.writerow(["Load Cell", self.calibration.table.cell_id])
+                writer.writerow(["Tare Offset", self.calibration.tare_offset])
+                writer.writerow(["Timestamp", "Position", "Weight", self.load_label()])
+                for times, positions, weights, filtered in self.measurements.blocks():
+                    loads = self.calibrated_loads(times, weights)
+                    writer.writerows((format_timestamp(t), position, weight, load)
+                                     for t, position, weight, load in zip(times, positions, weights, loads.tolist()))
+        except IOError:
+            raise FreeloaderError("Failed to save data to file.")
+
+ def export_parquet(self, filename, metadata):
+        """ Method to save the run to a Parquet file, with metadata (a dict of strings) in its schema """
+        try:
+            from freeloaderexport import export_run
+        except ImportError:
+            raise FreeloaderError("Saving as Parquet needs the pyarrow package.")
 
-            # Write the sample name as a row
-            writer.writerow(["Sample Name", sample_description])
+        try:
+            export_run(filename, self, metadata)
+        except OSError:
+            raise FreeloaderError("Failed to save data to file.")
 
-            # Write the material code as a row
-            writer.writerow(["Material Code", material_code])
+ def save_archive(self, filename, metadata):
+        """ Method to save the run to a compressed, indexed .flrun file (see freeloaderarchive) """
+        from freeloaderarchive import archive_run
 
-            # Write the lot number as a row
-            writer.writerow(["Lot #", lot_number])
+        try:
+            archive_run(filename, self, metadata)
+        except OSError:
+            raise FreeloaderError("Failed to save data to file.")
+
+class DeviceMonitor:
+    """
+    Background watcher that finds the U2D2 and Loadstar as they are plugged in
+    and reconnects them if they drop out, backing off between failed attempts.
+    The latest state of each device is kept in the status dict.
+    """
+
+    def __init__(self, freeloader, interval=PORT_SCAN_INTERVAL):
+        self.freeloader = freeloader
+        self.interval = interval
+        self.status = {"Dynamixel": "searching", "Loadstar": "searching"}
+        self.backoff = {name: RECONNECT_BACKOFF_MIN for name in self.status}
+        self.next_attempt = {name: 0.0 for name in self.status}
+        self.next_drift_check = 0.0
+        self.next_temperature_check = 0.0
+        self.running = False
+        self.thread = None
 
-            # Write the selected option from the combobox as a row
-            writer.writerow(["Selected Option", selected_option])
+    def start(self):
+        """ Start watching the ports in a daemon thread """
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """ Stop watching the ports """
+        self.running = False
+
+    def run(self):
+        """ Thread target that polls until stop is called """
+        while self.running:
+            self.poll()
+            time.sleep(self.interval)
+
+    def poll(self):
+        """
+        Try to connect any offline device whose backoff has expired, read
+        the idle load cell zero and keep the servo temperature current
+        """
+        online = {"Dynamixel": self.freeloader.dyna_online, "Loadstar": self.freeloader.cell_online}
+        now = time.monotonic()
+        if online["Dynamixel"] and now >= self.next_temperature_check:
+            self.next_temperature_check = now + TEMPERATURE_INTERVAL
+            try:
+                self.freeloader.read_servos()
+            except FreeloaderError:
+                pass  # A lost Dynamixel is picked up on the next poll
+        if online["Loadstar"] and now >= self.next_drift_check:
+            self.next_drift_check = now + DRIFT_SAMPLE_INTERVAL
+            try:
+                self.freeloader.track_drift()
+            except FreeloaderError:
+                pass  # A lost Loadstar is picked up on the next poll
+        due = []
+        for name, is_online in online.items():
+            if is_online:
+                self.status[name] = "online"
+                self.backoff[name] = RECONNECT_BACKOFF_MIN
+            elif now >= self.next_attempt[name]:
+                due.append(name)
+            elif self.status[name] == "online":
+                self.status[name] = "reconnecting"
+
+        if not due:
+            return
+
+        # Only probe for a Loadstar when it is actually missing
+        ports = find_ports(probe="Loadstar" in due)
+        for name in due:
+            port = ports[name]
+            if port is None:
+                self.status[name] = "searching"
+                self.delay(name)
+                continue
+
+            try:
+                if name == "Dynamixel":
+                    self.freeloader.connect_dynamixel(port, BAUDRATE)
+                else:
+                    self.freeloader.connect_loadstar(port, LOADSTAR_BAUDRATE)
+            except FreeloaderError as e:
+                self.status[name] = f"offline ({e})"
+                self.delay(name)
+            else:
+                self.status[name] = "online"
+                self.backoff[name] = RECONNECT_BACKOFF_MIN
+
+    def delay(self, name):
+        """ Push back the next attempt for name, doubling the backoff up to its limit """
+        self.next_attempt[name] = time.monotonic() + self.backoff[name]
+        self.backoff[name] = min(self.backoff[name] * 2, RECONNECT_BACKOFF_MAX)
 
-            writer.writerow(["Timestamp", "Position", "Weight"])
-            writer.writerows(self.measurements)
-     except IOError:
-        raise FreeloaderError("Failed to save data to file.")
 
 class FreeloaderGUI:
-    def __init__(self, freeloader):
+    def __init__(self, freeloader, monitor=None):
         self.freeloader = freeloader
         self.window = tk.Tk()
+        self.bridge = GuiBridge(self.window)  # Worker threads reach Tk only through this
+        freeloader.report_error = self.report_error
+        freeloader.journal_file = JOURNAL_FILE
         self.graph_frame = tk.Frame(self.window)
         self.buttons_frame = tk.Frame(self.window)
-        self.figure = figure(figsize=(6, 4), dpi=100)
-        self.plot = self.figure.add_subplot(111)
-        self.canvas = FigureCanvasTkAgg(self.figure, master=self.graph_frame)
+        self.status_frame = tk.Frame(self.window)
+        # The figure and canvas are built once matplotlib has loaded in the background
+        self.figure = None
+        self.run_plot = None  # freeloaderplot.RunPlot drawing the current view
+        self.canvas = None
+        self.plot_placeholder = tk.Label(self.graph_frame, text="Loading plot...")
+        self.matplotlib_classes = None
+        self.drawn_until = 0.0  # Time of the newest sample drawn so far
+        self.plot_scheduler = PlotScheduler(self.window, self.update_plot,
+                                            sample_count=lambda: len(self.freeloader.measurements))
+        self.monitor = monitor if monitor is not None else DeviceMonitor(freeloader)
         self.boxes_frame = tk.Frame(self.window)
         self.type_frame = tk.Frame(self.window)
         self.is_moving = False
@@ -389,6 +1355,17 @@ class FreeloaderGUI:
         self.start_button = Button(self.buttons_frame, text="Start", command=self.start_measurement, width=25)
         self.stop_button = Button(self.buttons_frame, text="Stop", command=self.stop_measurement)
         self.save_button = Button(self.buttons_frame, text="Save", command=self.save_data)
+        self.tare_button = Button(self.buttons_frame, text="Tare", command=self.tare_load_cell)
+        self.recipe_button = Button(self.buttons_frame, text="Load Recipe", command=self.load_recipe)
+        self.recipe = None  # Recipe definition the next run follows, if any
+        self.diagnostics_button = Button(self.buttons_frame, text="Diagnostics", command=self.show_diagnostics)
+        self.diagnostics_window = None
+        self.view_var = tk.StringVar()
+        self.view_combobox = Combobox(self.buttons_frame, textvariable=self.view_var, state="disabled")
+        self.view_combobox.bind("<<ComboboxSelected>>", self.select_view)
+        self.overlay_button = Button(self.buttons_frame, text="Overlay Lot", command=self.show_overlays)
+        self.clear_overlay_button = Button(self.buttons_frame, text="Clear Overlay", command=self.clear_overlays)
+        self.archive_directory = ARCHIVE_DIRECTORY
         self.move_up_button = Button(self.buttons_frame, text="Move Motor Up", command=self.move_motor_up)
         self.move_up_button.bind("<ButtonPress-1>", self.start_motorup)
         self.move_up_button.bind("<ButtonRelease-1>", self.stop_motor)
@@ -408,12 +1385,176 @@ class FreeloaderGUI:
         self.type_var = tk.StringVar()
         self.type_combobox = Combobox(self.type_frame, textvariable=self.type_var, state="readonly")
         self.type_combobox["values"] = ["Monofilament", "ASTM Dog Bone", "Slit Film Yarn"]  # Add sample types
-          
+
+        # Create status indicators
+        self.status_labels = {}
+        for device in self.monitor.status:
+            self.status_labels[device] = tk.Label(self.status_frame, text=f"{device}: searching", fg="orange")
+        self.startup_label = tk.Label(self.status_frame, text="")
+        self.recipe_label = tk.Label(self.status_frame, text="No recipe")
+
+    def load_plot_backend(self):
+        """ Background thread target that imports matplotlib """
+        self.matplotlib_classes = _load_matplotlib()
+
+    def build_plot(self):
+        """ Create the figure and canvas once matplotlib is available. Runs on the Tk thread. """
+        if self.matplotlib_classes is None:
+            self.window.after(50, self.build_plot)
+            return
+
+        from freeloaderplot import PLOT_VIEWS, RunPlot
+
+        Figure, FigureCanvasTkAgg = self.matplotlib_classes
+        self.figure = Figure(figsize=(6, 4), dpi=100)
+        self.run_plot = RunPlot(self.figure)
+        self.view_combobox["values"] = list(PLOT_VIEWS.values())
+        self.view_var.set(PLOT_VIEWS[self.run_plot.view])
+        self.view_combobox.config(state="readonly")
+        self.canvas = FigureCanvasTkAgg(self.figure, master=self.graph_frame)
+        self.plot_placeholder.destroy()
+        self.canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+        self.plot_scheduler.invalidate()
+        print("Plot ready after {:.0f} ms.".format((time.perf_counter() - _START_TIME) * 1000))
+
+    def select_view(self, event):
+        """ Switch the plot to the view picked in the view selector """
+        from freeloaderplot import PLOT_VIEWS
+
+        view = list(PLOT_VIEWS)[self.view_combobox.current()]
+        if view != self.run_plot.view:
+            self.run_plot.set_view(view)
+            self.plot_scheduler.invalidate()
+
+    def show_overlays(self):
+        """
+        Method to overlay the latest saved runs matching the material code
+        and lot number entered, whichever are filled in, on the plot
+        """
+        if self.run_plot is None:
+            return
+        material = self.mat_box.get().strip() or None
+        lot = self.lot_box.get().strip() or None
+        if material is None and lot is None:
+            messagebox.showerror("Error", "Enter a material code or lot number to compare against.")
+            return
+        if self.archive_directory is None:
+            self.archive_directory = filedialog.askdirectory(title="Folder of saved runs") or None
+            if self.archive_directory is None:
+                return
+
+        # Older runs may need reading in full the first time, so load off the Tk thread
+        threading.Thread(target=self.load_overlays, args=(material, lot), daemon=True).start()
+
+    def load_overlays(self, material, lot):
+        """ Thread target that loads the cached curves of the matching runs """
+        from freeloaderoverlay import RunArchive
+
+        calibration = self.freeloader.calibration
+        unit = calibration.display_unit if calibration is not None else LOAD_UNIT
+        try:
+            archive = RunArchive(self.archive_directory)
+            overlays = archive.overlays(archive.runs(material, lot), unit)
+        except (OSError, ValueError) as e:
+            self.report_error(f"Could not load saved runs: {e}")
+            return
+        self.bridge.call(self.set_overlays, overlays)
+
+    def set_overlays(self, overlays):
+        """ Show loaded overlays on the plot. Runs on the Tk thread. """
+        if not overlays:
+            messagebox.showinfo("Overlay", "No saved runs match.")
+        self.run_plot.set_overlays(overlays)
+        self.plot_scheduler.invalidate()
+
+    def clear_overlays(self):
+        """ Method to remove the overlaid runs from the plot """
+        if self.run_plot is not None:
+            self.run_plot.set_overlays([])
+            self.plot_scheduler.invalidate()
+
+    def refresh_status(self):
+        """ Show the current device status in the status bar """
+        for device, status in self.monitor.status.items():
+            if status == "online":
+                colour = "green"
+            elif status in ("searching", "reconnecting"):
+                colour = "orange"
+            else:
+                colour = "red"
+            self.status_labels[device].config(text=f"{device}: {status}", fg=colour)
+
+        recipe_text = self.recipe["name"] if self.recipe is not None else "No recipe"
+        if self.freeloader.recipe_stage is not None:
+            recipe_text += f" ({self.freeloader.recipe_stage})"
+        self.recipe_label.config(text=recipe_text)
+
+        self.window.after(200, self.refresh_status)
+
+    def report_startup_time(self):
+        """ Report the cold-start time from module import to an interactive window """
+        elapsed_ms = (time.perf_counter() - _START_TIME) * 1000
+        print("Window interactive after {:.0f} ms.".format(elapsed_ms))
+        self.startup_label.config(text="Started in {:.0f} ms".format(elapsed_ms))
+
+    def report_error(self, message):
+        """ Show an error in a message box. Safe to call from any thread. """
+        self.bridge.call(messagebox.showerror, "Error", message)
+
+    def offer_recovery(self):
+        """ Method to offer to restore a run left unsaved in the recovery journal by a crash or closed window """
+        summary = journal_summary(JOURNAL_FILE) if JOURNAL_FILE is not None else None
+        if summary is None:
+            return
+        state, samples = summary
+        metadata = state.get("metadata", {})
+        if not samples:
+            self.freeloader.discard_journal()
+            return
+
+        started = datetime.fromtimestamp(state["started"]).strftime("%Y-%m-%d %H:%M")
+        sample = metadata.get("sample") or "unnamed sample"
+        if not messagebox.askyesno("Restore Run", f"The run of {sample} started {started} ({samples} samples) "
+                                                  "was not saved. Restore it?"):
+            self.freeloader.discard_journal()
+            return
+
+        try:
+            self.freeloader.restore_journal(JOURNAL_FILE)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Error", f"Could not restore the run: {e}")
+            return
+        for box, key in ((self.op_box, "operator"), (self.desc_box, "sample"), (self.mat_box, "material"),
+                         (self.lot_box, "lot")):
+            box.delete(0, tk.END)
+            box.insert(0, metadata.get(key, ""))
+        self.type_var.set(metadata.get("sample_type", ""))
+        self.plot_scheduler.invalidate()
 
     def start_measurement(self):
         """ Method to start the measurement process """
+        if not (self.freeloader.dyna_online and self.freeloader.cell_online):
+            messagebox.showerror("Error", "The Dynamixel and Loadstar must both be online to start.")
+            return
+
+        self.freeloader.run_metadata = {"operator": self.op_box.get(), "sample": self.desc_box.get(),
+                                        "material": self.mat_box.get(), "lot": self.lot_box.get(),
+                                        "sample_type": self.type_combobox.get()}
         try:
-            self.freeloader.start_measurement()
+            self.freeloader.start_measurement(self.recipe)
+        except FreeloaderError as e:
+            messagebox.showerror("Error", str(e))
+
+    def load_recipe(self):
+        """ Method to choose the test recipe the next run follows """
+        filename = filedialog.askopenfilename(filetypes=[("Recipes", "*.json")])
+        if not filename:
+            return
+
+        from freeloaderrecipes import Recipe
+
+        try:
+            self.recipe = Recipe.load(filename).definition
         except FreeloaderError as e:
             messagebox.showerror("Error", str(e))
 
@@ -430,22 +1571,100 @@ class FreeloaderGUI:
         messagebox.showerror("Error", str(e))
 
 
+    def tare_load_cell(self):
+        """ Method to zero the load cell before a run, reading it off the Tk thread """
+        threading.Thread(target=self.run_tare, daemon=True).start()
+
+    def run_tare(self):
+        """ Thread target that tares the load cell and reports the result """
+        try:
+            self.freeloader.tare_load_cell()
+        except FreeloaderError as e:
+            self.report_error(str(e))
+        else:
+            self.bridge.call(self.plot_scheduler.invalidate)
+            self.bridge.call(messagebox.showinfo, "Success", "Load cell tared.")
+
+    def show_diagnostics(self):
+        """ Open the diagnostics panel with the per-stage timing histograms """
+        if self.diagnostics_window is not None:
+            self.diagnostics_window.lift()
+            return
+
+        self.diagnostics_window = tk.Toplevel(self.window)
+        self.diagnostics_window.title("Diagnostics")
+        self.diagnostics_window.protocol("WM_DELETE_WINDOW", self.close_diagnostics)
+
+        self.timing_var = tk.BooleanVar(value=TIMINGS.enabled)
+        tk.Checkbutton(self.diagnostics_window, text="Record stage timings", variable=self.timing_var,
+                       command=self.toggle_timing).pack(side=tk.TOP, anchor=tk.W, padx=10, pady=5)
+        Button(self.diagnostics_window, text="Reset", command=TIMINGS.reset).pack(side=tk.TOP, anchor=tk.W, padx=10)
+        self.timing_label = tk.Label(self.diagnostics_window, font=("Courier", 10), justify=tk.LEFT, anchor=tk.W)
+        self.timing_label.pack(side=tk.TOP, fill=tk.BOTH, expand=True, padx=10, pady=5)
+        self.overhead_ns = TIMINGS.overhead_ns()
+        self.refresh_diagnostics()
+
+    def close_diagnostics(self):
+        """ Close the diagnostics panel """
+        self.diagnostics_window.destroy()
+        self.diagnostics_window = None
+
+    def toggle_timing(self):
+        """ Switch stage timing on or off from the diagnostics panel """
+        TIMINGS.enabled = self.timing_var.get()
+
+    def refresh_diagnostics(self):
+        """ Redraw the timing table while the diagnostics panel is open """
+        if self.diagnostics_window is None:
+            return
+
+        text = TIMINGS.report()
+        sample = TIMINGS.histograms.get("measure")
+        if sample is not None and sample.count:
+            text += "\n\nTiming overhead {:.0f} ns per stage, {:.3%} of a sample period".format(
+                self.overhead_ns, self.overhead_ns * len(TIMINGS.histograms) / sample.mean())
+        bus, loadstar = self.freeloader.bus_errors, self.freeloader.loadstar_errors
+        text += "\n\nDynamixel error rate {:.1%}, Loadstar error rate {:.1%}, sample interval {:.0f} ms\n".format(
+            bus.rate(), loadstar.rate(), self.freeloader.sample_interval * 1000)
+        text += "Dynamixel  " + "  ".join(f"{kind} {count}" for kind, count in bus.totals.items())
+        text += "\nLoadstar  " + "  ".join(f"{kind} {count}" for kind, count in loadstar.totals.items())
+        text += "\n\n" + self.plot_scheduler.report()
+        self.timing_label.config(text=text)
+        self.diagnostics_window.after(1000, self.refresh_diagnostics)
+
+    @TIMINGS.timed("update_plot")
     def update_plot(self):
         """ Method to update the graph with the latest measurements """
-        measurements = self.freeloader.measurements
-        if measurements:
-            timestamps = [m[0] for m in measurements]
-            positions = [m[1] for m in measurements]
-            weights = [m[2] for m in measurements]
-            self.plot.cla()
-            self.plot.plot(timestamps, positions, label='Distance (mm)')
-            self.plot.plot(timestamps, weights, label='Tensile Load (lb.)')
-            self.plot.legend()
-            self.plot.set_xlabel('Timestamp')
-            self.plot.set_ylabel('Distance (mm)/Load (lb.)')
-            self.plot.set_title('Freeloader Tensile Data')
-            self.figure.autofmt_xdate()
-            self.canvas.draw()
+        if self.canvas is None:
+            return
+        import numpy as np
+
+        freeloader = self.freeloader
+        times, positions, filtered = freeloader.measurements.read("time", "position", "filtered")
+        if not times and not self.run_plot.overlays:
+            # Nothing to show yet, or a long run whose samples have all just gone to a segment file
+            return
+        loads = np.frombuffer(filtered)  # Already calibrated and tared
+
+        # Plot against elapsed time as plain numbers, computed in one pass,
+        # so matplotlib's ordinary tick locator handles the axis
+        times = np.frombuffer(times)
+        start = times[0] if len(times) else 0.0
+
+        # The peak comes from the running maximum, not a search of the run.
+        # Long runs only hold their latest samples, which may not include it.
+        peak = None
+        if freeloader.run_peak_time is not None and freeloader.run_peak_time >= start:
+            peak = (freeloader.run_peak_time - start, freeloader.run_peak_position, freeloader.run_peak_weight)
+
+        self.run_plot.update(times - start, np.frombuffer(positions), loads, freeloader.load_label(), peak)
+        self.canvas.draw()
+
+        # Sample-to-screen latency of the newest sample, once per new sample drawn
+        if len(times):
+            if TIMINGS.enabled and times[-1] > self.drawn_until:
+                TIMINGS.record("to_screen", int((time.time() - times[-1]) * 1e9))
+            self.drawn_until = times[-1]
 
 
     def start_motorup(self, event):
@@ -483,11 +1702,12 @@ class FreeloaderGUI:
                 self.freeloader.move_motor_in_one_direction_up()
                 time.sleep(0.001)  # Adjust this delay as needed
 
-            self.freeloader.set_speed(0)  # Stop the motor
+            self.freeloader.command_speed(0)  # Stop the motor
+            self.freeloader.is_moving = False
             self.is_moving = False
 
         except FreeloaderError as e:
-            messagebox.showerror("Error", str(e))
+            self.report_error(str(e))
 
     def continuous_motor_movement_down(self):
         """ Method to continuously move the motor in one direction """
@@ -498,11 +1718,12 @@ class FreeloaderGUI:
                 self.freeloader.move_motor_in_one_direction_down()
                 time.sleep(0.001)  # Adjust this delay as needed
 
-            self.freeloader.set_speed(0)  # Stop the motor
+            self.freeloader.command_speed(0)  # Stop the motor
+            self.freeloader.is_moving = False
             self.is_moving = False
 
         except FreeloaderError as e:
-            messagebox.showerror("Error", str(e))
+            self.report_error(str(e))
 
 
     def start(self):
@@ -510,10 +1731,18 @@ class FreeloaderGUI:
         self.window.title("FreeloaderGUI_6_0")
         self.window.geometry("1280x800")
 
+        # Status frame
+        self.status_frame.pack(side=tk.BOTTOM, fill=tk.X, padx=25)
+        for label in self.status_labels.values():
+            label.pack(side=tk.LEFT, padx=15)
+        self.startup_label.pack(side=tk.RIGHT, padx=15)
+        self.recipe_label.pack(side=tk.RIGHT, padx=15)
+
         # Graph frame
         self.graph_frame.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
-        self.canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
-        
+        self.plot_placeholder.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+
+
         # Boxes frame
         self.boxes_frame.pack(side=tk.RIGHT, padx=50)
         button_font = ("Arial", 18)
@@ -542,6 +1771,12 @@ class FreeloaderGUI:
         self.start_button.pack(side=tk.LEFT, padx=15)
         self.stop_button.pack(side=tk.LEFT, padx=15)
         self.save_button.pack(side=tk.LEFT, padx=15)
+        self.tare_button.pack(side=tk.LEFT, padx=15)
+        self.recipe_button.pack(side=tk.LEFT, padx=15)
+        self.diagnostics_button.pack(side=tk.LEFT, padx=15)
+        self.view_combobox.pack(side=tk.LEFT, padx=15)
+        self.overlay_button.pack(side=tk.LEFT, padx=15)
+        self.clear_overlay_button.pack(side=tk.LEFT, padx=15)
         self.move_down_button.pack(side=tk.RIGHT, padx=15)
         self.move_up_button.pack(side=tk.RIGHT, padx=15)
 
@@ -550,14 +1785,20 @@ class FreeloaderGUI:
         self.type_label.pack(anchor=tk.E, side=tk.LEFT, fill=tk.Y, padx=30, pady=30)
         self.type_combobox.pack(anchor=tk.NE, side=tk.LEFT, fill=tk.Y, padx=25, pady=25)
 
-        # Update the graph periodically
-        def update_graph():
-            self.update_plot()
-            self.window.after(1000, update_graph)
+        # Redraw the graph as often as its draw time allows
+        self.plot_scheduler.start()
 
-        update_graph()
+        # Load matplotlib and connect the devices without holding up the window
+        threading.Thread(target=self.load_plot_backend, daemon=True).start()
+        self.monitor.start()
+        self.bridge.start()
+        self.window.after(50, self.build_plot)
+        self.refresh_status()
+        self.window.after_idle(self.report_startup_time)
+        self.window.after_idle(self.offer_recovery)
 
         self.window.mainloop()
+        self.monitor.stop()
 
 
 
@@ -565,14 +1806,15 @@ class FreeloaderGUI:
 
 if __name__ == '__main__':
     freeloader = Freeloader()
+    if CAPTURE_DIRECTORY is not None:
+        freeloader.start_capture(os.path.join(
+            CAPTURE_DIRECTORY, "session_{}.flcap".format(datetime.now().strftime("%Y%m%d%H%M%S"))))
 
-    try:
-        freeloader.connect_dynamixel(DEVICENAME, BAUDRATE)
-        freeloader.connect_loadstar(LOADSTAR_COM_PORT, LOADSTAR_BAUDRATE)
-    except FreeloaderError as e:
-        messagebox.showerror("Error", str(e))
-    else:
-        gui = FreeloaderGUI(freeloader)
-        gui.start()
+    # Devices are found and connected in the background once the window is up
+    gui = FreeloaderGUI(freeloader)
+    gui.start()
+
+    if freeloader.dyna_online:
         freeloader.disconnect_dynamixel()
-        freeloader.disconnect_loadstar()
+    freeloader.disconnect_loadstar()
+    freeloader.stop_capture()
@@ -0,0 +1,394 @@
+"""
+freeloaderarchive
+
+Compact run files for long-term storage, with an index for reading any
+stretch of time without decompressing the rest. A .flrun file holds the
+same columns as a Parquet export (see freeloaderexport)
+
+    time        epoch seconds, kept to ARCHIVE_TIME_RESOLUTION
+    position    mm, kept to ARCHIVE_POSITION_RESOLUTION, NaN at gaps
+    load        calibrated load in the file's load unit
+    weight      raw Loadstar reading
+    filtered    load after the load filter, in the file's load unit
+
+cut into blocks of ARCHIVE_BLOCK_ROWS samples, each compressed on its own.
+Within a block time and position, which only ever creep forward, are
+stored as integer steps from the previous sample, and every column is
+byte-shuffled so the bytes that barely change sit next to each other. The
+block index at the end of the file holds each block's time range, offset
+and length, so read(start, end) only decompresses the blocks it needs.
+
+Blocks are compressed with zstd or lz4 where the zstandard or lz4 package
+is installed and with zlib otherwise; the codec is named in the file.
+
+Layout:
+
+    ARCHIVE_MAGIC, header length (u32), JSON header (codec, columns, metadata)
+    compressed blocks
+    block index (INDEX_DTYPE records)
+    trailer: index offset (u64), block count (u32), ARCHIVE_MAGIC
+
+Run with --benchmark to compare size and speed against the CSV written by
+save_data.
+"""
+
+import argparse
+import csv
+import json
+import os
+import struct
+import tempfile
+import time
+import zlib
+
+import numpy as np
+
+
+ARCHIVE_MAGIC = b"FLRUN\x01"
+
+ARCHIVE_COLUMNS = ("time", "position", "load", "weight", "filtered")
+
+# Samples per compressed block; the smallest stretch read decodes one block
+ARCHIVE_BLOCK_ROWS = 16384
+
+# Codecs in order of preference, and their compression levels
+ARCHIVE_CODECS = ("zstd", "lz4", "zlib")
+ARCHIVE_LEVELS = {"zstd": 9, "lz4": 0, "zlib": 6}
+
+# Resolution time and position are stored to: microseconds, as in the Parquet
+# export, and nanometres, well below one motor step
+ARCHIVE_TIME_RESOLUTION = 1e-6
+ARCHIVE_POSITION_RESOLUTION = 1e-6
+
+INDEX_DTYPE = np.dtype([("start", "<f8"), ("end", "<f8"), ("offset", "<u8"), ("size", "<u4"), ("rows", "<u4")])
+TRAILER = struct.Struct("<QI6s")
+
+SOFTWARE_VERSION = "freeLoaderGUI_5_9"
+
+
+def codec(name):
+    """ (compress, decompress) functions of the named codec. Raises ImportError if its package is missing. """
+    level = ARCHIVE_LEVELS[name]
+    if name == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level=level).compress, zstandard.ZstdDecompressor().decompress
+    if name == "lz4":
+        import lz4.frame
+        return (lambda data: lz4.frame.compress(data, compression_level=level)), lz4.frame.decompress
+    if name == "zlib":
+        return (lambda data: zlib.compress(data, level)), zlib.decompress
+    raise ValueError(f"Unknown archive codec '{name}'.")
+
+
+def default_codec():
+    """ The first codec in ARCHIVE_CODECS whose package is installed """
+    for name in ARCHIVE_CODECS:
+        try:
+            codec(name)
+            return name
+        except ImportError:
+            continue
+
+
+def shuffle(values):
+    """ Bytes of an array of 8-byte values, all first bytes first, then all second bytes and so on """
+    return np.ascontiguousarray(values).view(np.uint8).reshape(-1, 8).T.tobytes()
+
+
+def unshuffle(data, rows, dtype):
+    return np.frombuffer(data, np.uint8).reshape(8, rows).T.copy().view(dtype).ravel()
+
+
+def to_steps(values, resolution, gaps=None):
+    """
+    Integer steps of resolution from each value to the one before, the first
+    from zero. Gap samples repeat the value before them, so cost nothing.
+    """
+    quantized = np.round(values / resolution)
+    if gaps is not None and gaps.any():
+        # Carry the last real value over each gap; leading gaps start from zero
+        quantized[gaps] = 0.0
+        last = np.maximum.accumulate(np.where(gaps, 0, np.arange(len(values))))
+        quantized = quantized[last]
+    return np.diff(quantized.astype(np.int64), prepend=np.int64(0))
+
+
+def from_steps(steps, resolution):
+    return np.cumsum(steps) * resolution
+
+
+def encode_block(times, positions, loads, weights, filtered):
+    """ Uncompressed bytes of one block of samples """
+    gaps = np.isnan(positions)
+    return b"".join([
+        shuffle(to_steps(times, ARCHIVE_TIME_RESOLUTION)),
+        shuffle(to_steps(positions, ARCHIVE_POSITION_RESOLUTION, gaps)),
+        np.packbits(gaps).tobytes(),
+        shuffle(np.asarray(loads, dtype="<f8")),
+        shuffle(np.asarray(weights, dtype="<f8")),
+        shuffle(np.asarray(filtered, dtype="<f8")),
+    ])
+
+
+def decode_block(data, rows):
+    """ Dict of the column arrays of one block, from its uncompressed bytes """
+    size = rows * 8
+    mask_size = (rows + 7) // 8
+    offset = 0
+    sections = []
+    for length in (size, size, mask_size, size, size, size):
+        sections.append(data[offset:offset + length])
+        offset += length
+
+    gaps = np.unpackbits(np.frombuffer(sections[2], np.uint8), count=rows).astype(bool)
+    positions = from_steps(unshuffle(sections[1], rows, "<i8"), ARCHIVE_POSITION_RESOLUTION)
+    positions[gaps] = np.nan
+    return {
+        "time": from_steps(unshuffle(sections[0], rows, "<i8"), ARCHIVE_TIME_RESOLUTION),
+        "position": positions,
+        "load": unshuffle(sections[3], rows, "<f8"),
+        "weight": unshuffle(sections[4], rows, "<f8"),
+        "filtered": unshuffle(sections[5], rows, "<f8"),
+    }
+
+
+class ArchiveWriter:
+    """
+    Writes a run to a .flrun file a block at a time. Samples handed to
+    write() are gathered into blocks of block_rows; close() writes the last
+    partial block and the index.
+    """
+
+    def __init__(self, filename, metadata=None, load_unit="lb", codec_name=None, block_rows=ARCHIVE_BLOCK_ROWS):
+        self.codec_name = codec_name or default_codec()
+        self.compress = codec(self.codec_name)[0]
+        self.block_rows = block_rows
+        self.pending = [[] for _ in ARCHIVE_COLUMNS]  # Arrays not yet making up a whole block
+        self.pending_rows = 0
+        self.index = []
+        self.file = open(filename, 'wb')
+
+        metadata = {key: str(value) for key, value in (metadata or {}).items()}
+        header = json.dumps({"software": SOFTWARE_VERSION, "codec": self.codec_name, "columns": ARCHIVE_COLUMNS,
+                             "load_unit": load_unit, "metadata": metadata}).encode()
+        self.file.write(ARCHIVE_MAGIC + struct.pack("<I", len(header)) + header)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, times, positions, loads, weights, filtered):
+        """ Add samples, given as equal-length arrays, writing each block as it fills """
+        for pending, values in zip(self.pending, (times, positions, loads, weights, filtered)):
+            pending.append(np.asarray(values, dtype=float))
+        self.pending_rows += len(times)
+        if self.pending_rows >= self.block_rows:
+            columns = [np.concatenate(pending) for pending in self.pending]
+            whole = self.pending_rows - self.pending_rows % self.block_rows
+            for start in range(0, whole, self.block_rows):
+                self.write_block([values[start:start + self.block_rows] for values in columns])
+            self.pending = [[values[whole:]] for values in columns]
+            self.pending_rows -= whole
+
+    def write_block(self, columns):
+        times = columns[0]
+        data = self.compress(encode_block(*columns))
+        self.index.append((np.min(times), np.max(times), self.file.tell(), len(data), len(times)))
+        self.file.write(data)
+
+    def close(self):
+        if self.file.closed:
+            return
+        if self.pending_rows:
+            self.write_block([np.concatenate(pending) for pending in self.pending])
+        index_offset = self.file.tell()
+        self.file.write(np.array(self.index, dtype=INDEX_DTYPE).tobytes())
+        self.file.write(TRAILER.pack(index_offset, len(self.index), ARCHIVE_MAGIC))
+        self.file.close()
+
+
+class ArchiveReader:
+    """ A .flrun file opened for reading; only its header and block index are read up front """
+
+    def __init__(self, filename):
+        self.file = open(filename, 'rb')
+        try:
+            if self.file.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+                raise ValueError(f"{filename} is not a run archive.")
+            length, = struct.unpack("<I", self.file.read(4))
+            header = json.loads(self.file.read(length))
+            self.file.seek(-TRAILER.size, os.SEEK_END)
+            index_offset, blocks, magic = TRAILER.unpack(self.file.read(TRAILER.size))
+            if magic != ARCHIVE_MAGIC:
+                raise ValueError(f"{filename} is incomplete; it was not closed after writing.")
+            self.file.seek(index_offset)
+            self.index = np.frombuffer(self.file.read(blocks * INDEX_DTYPE.itemsize), INDEX_DTYPE)
+        except (ValueError, struct.error):
+            self.file.close()
+            raise
+
+        self.codec_name = header["codec"]
+        self.decompress = codec(self.codec_name)[1]
+        self.load_unit = header["load_unit"]
+        self.metadata = dict(header["metadata"], software=header["software"], load_unit=self.load_unit)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def __len__(self):
+        return int(self.index["rows"].sum())
+
+    def time_range(self):
+        """ (first, last) sample time in epoch seconds, from the index alone """
+        if not len(self.index):
+            return None
+        return float(self.index["start"].min()), float(self.index["end"].max())
+
+    def read_block(self, number):
+        entry = self.index[number]
+        self.file.seek(int(entry["offset"]))
+        return decode_block(self.decompress(self.file.read(int(entry["size"]))), int(entry["rows"]))
+
+    def read(self, start=None, end=None, columns=None):
+        """
+        Dict of NumPy arrays of the samples taken between start and end
+        (epoch seconds, inclusive; None for the start or end of the run),
+        for only the named columns if columns is given. Only the blocks
+        overlapping that time are decompressed.
+        """
+        wanted = np.ones(len(self.index), dtype=bool)
+        if start is not None:
+            wanted &= self.index["end"] >= start
+        if end is not None:
+            wanted &= self.index["start"] <= end
+        names = list(columns) if columns is not None else list(ARCHIVE_COLUMNS)
+
+        parts = {name: [] for name in names}
+        for number in np.flatnonzero(wanted):
+            block = self.read_block(number)
+            keep = np.ones(len(block["time"]), dtype=bool)
+            if start is not None:
+                keep &= block["time"] >= start
+            if end is not None:
+                keep &= block["time"] <= end
+            for name in names:
+                parts[name].append(block[name][keep])
+        return {name: np.concatenate(values) if values else np.array([]) for name, values in parts.items()}
+
+
+def read_run(filename, start=None, end=None, columns=None):
+    """ Metadata and dict of column arrays of a .flrun file, as freeloaderexport.read_run returns them """
+    with ArchiveReader(filename) as reader:
+        return reader.metadata, reader.read(start, end, columns)
+
+
+def archive_run(filename, freeloader, metadata, codec_name=None):
+    """ Write the freeloader's finished run to a .flrun file, one block of samples at a time """
+    if freeloader.calibration is None:
+        freeloader.calibration = freeloader.load_calibration()
+    metadata = dict(metadata, load_cell=freeloader.calibration.table.cell_id,
+                    tare_offset=freeloader.calibration.tare_offset)
+    with ArchiveWriter(filename, metadata, freeloader.calibration.display_unit, codec_name) as writer:
+        for times, positions, weights, filtered in freeloader.measurements.blocks():
+            if len(times):
+                times = np.frombuffer(times)
+                writer.write(times, np.frombuffer(positions), freeloader.calibrated_loads(times, weights),
+                             np.frombuffer(weights), np.frombuffer(filtered))
+
+
+def example_run(samples):
+    """ Columns of a simulated pull sampled at about 1 kHz, with timing jitter and a gap """
+    rng = np.random.default_rng(1)
+    times = 1.7e9 + np.cumsum(rng.normal(0.001, 0.0001, samples).clip(0.0002))
+    positions = np.floor(np.arange(samples) * 0.3) * (104 / 40 / 4096)  # Whole motor steps
+    weights = np.round(np.where(positions < positions[-1] * 0.9, positions * 2, 0.1)
+                       + rng.normal(0, 0.05, samples), 3)
+    filtered = weights.copy()
+    filtered[1:] = 0.8 * weights[1:] + 0.2 * weights[:-1]
+    gap = slice(samples // 2, samples // 2 + 10)
+    positions[gap] = weights[gap] = filtered[gap] = np.nan
+    return times, positions, weights * 1.01, weights, filtered
+
+
+def benchmark(samples=1000000):
+    """
+    Save a simulated run as CSV, the way save_data does, and as a .flrun
+    file with each installed codec, then compare file size, write time and
+    decode throughput, and time reading one second out of the middle.
+    """
+    from freeloaderbuffers import format_timestamp
+
+    columns = example_run(samples)
+    times = columns[0]
+    middle = times[samples // 2]
+    raw_mb = samples * 8 * len(ARCHIVE_COLUMNS) / 1e6
+
+    with tempfile.TemporaryDirectory() as directory:
+        csv_file = os.path.join(directory, "run.csv")
+        start = time.perf_counter()
+        with open(csv_file, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(["Timestamp", "Position", "Weight", "Tensile Load (lb.)"])
+            writer.writerows((format_timestamp(t), position, weight, load) for t, position, load, weight, filtered
+                             in zip(*(values.tolist() for values in columns)))
+        csv_write = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with open(csv_file, newline='') as file:
+            reader = csv.reader(file)
+            next(reader)
+            for row in reader:
+                float(row[3])  # Parse the load column, as a reader of the file would
+        csv_read = time.perf_counter() - start
+        csv_size = os.path.getsize(csv_file)
+
+        print("{:<8}{:>9}{:>8}{:>10}{:>10}{:>10}{:>12}".format(
+            "", "MB", "ratio", "write s", "read s", "MB/s", "1 s read ms"))
+        print("{:<8}{:>9.1f}{:>8.1f}{:>10.3f}{:>10.3f}{:>10.0f}{:>12}".format(
+            "CSV", csv_size / 1e6, 1.0, csv_write, csv_read, raw_mb / csv_read, ""))
+
+        for name in ARCHIVE_CODECS:
+            try:
+                codec(name)
+            except ImportError:
+                print("{:<8}not installed".format(name))
+                continue
+            archive_file = os.path.join(directory, f"run_{name}.flrun")
+            start = time.perf_counter()
+            with ArchiveWriter(archive_file, {"operator": "XX"}, "lb", name) as writer:
+                for block in range(0, samples, 65536):
+                    writer.write(*(values[block:block + 65536] for values in columns))
+            archive_write = time.perf_counter() - start
+
+            start = time.perf_counter()
+            metadata, run = read_run(archive_file)
+            archive_read = time.perf_counter() - start
+
+            start = time.perf_counter()
+            read_run(archive_file, middle, middle + 1.0)
+            range_read = time.perf_counter() - start
+
+            size = os.path.getsize(archive_file)
+            print("{:<8}{:>9.1f}{:>8.1f}{:>10.3f}{:>10.3f}{:>10.0f}{:>12.2f}".format(
+                name, size / 1e6, csv_size / size, archive_write, archive_read, raw_mb / archive_read,
+                range_read * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Freeloader compressed run archives.")
+    parser.add_argument("--benchmark", action="store_true", help="compare size and speed against CSV")
+    parser.add_argument("--samples", type=int, default=1000000)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.samples)
+    else:
+        parser.print_help()
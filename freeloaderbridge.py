@@ -0,0 +1,178 @@
+"""
+freeloaderbridge
+
+Thread-safe hand-off from worker threads to the Tk thread. Tk widgets may
+only be touched from the thread running mainloop, so acquisition, motor
+and tare threads post their message boxes to a GuiBridge
+instead of calling Tk themselves. The Tk thread drains the queue in
+batches from an after() callback, so a burst of events costs one pass of
+the event loop rather than one cross-thread call each.
+
+Calls posted with call() run in order. While TIMINGS is enabled the time
+each call waited in the queue is recorded under "gui_event".
+
+A PlotScheduler redraws a plot from the Tk thread as often as its own
+measured draw time allows: each redraw may take at most a set share of the
+Tk thread's time, between MAX_PLOT_FPS and MIN_PLOT_FPS. While samples are
+arriving faster than BUSY_SAMPLE_RATE a smaller share applies, leaving
+more of the interpreter to the acquisition threads, and ticks with no new
+samples skip the draw altogether.
+"""
+
+import queue
+import time
+
+from freeloadertiming import TIMINGS, TimingHistogram
+
+
+# Milliseconds between drains of the event queue
+BRIDGE_INTERVAL = 20
+
+# Most queued calls run in one drain, so a flood cannot stall the event loop
+BRIDGE_BATCH = 200
+
+# Plot refresh limits in frames per second, and the share of the Tk thread's
+# time redraws may take, normally and while samples arrive faster than
+# BUSY_SAMPLE_RATE per second
+MAX_PLOT_FPS = 10.0
+MIN_PLOT_FPS = 0.5
+PLOT_TIME_SHARE = 0.25
+BUSY_PLOT_TIME_SHARE = 0.05
+BUSY_SAMPLE_RATE = 100.0
+
+# Weight of the newest draw time in the smoothed draw time
+RENDER_SMOOTHING = 0.3
+
+
+class GuiBridge:
+    """ Queue of calls made by worker threads and run on the Tk thread of window """
+
+    def __init__(self, window, interval=BRIDGE_INTERVAL, batch=BRIDGE_BATCH):
+        self.window = window
+        self.interval = interval
+        self.batch = batch
+        self.calls = queue.SimpleQueue()
+        self.after_id = None
+
+    def call(self, function, *args):
+        """ Run function(*args) on the Tk thread. Safe to use from any thread. """
+        self.calls.put((time.perf_counter_ns(), function, args))
+
+    def start(self):
+        """ Start draining on the Tk thread; call from the Tk thread before mainloop """
+        if self.after_id is None:
+            self.after_id = self.window.after(self.interval, self.drain)
+
+    def stop(self):
+        if self.after_id is not None:
+            self.window.after_cancel(self.after_id)
+            self.after_id = None
+
+    def drain(self):
+        """ Run up to batch queued calls, then schedule the next drain """
+        try:
+            for _ in range(self.batch):
+                try:
+                    posted, function, args = self.calls.get_nowait()
+                except queue.Empty:
+                    break
+                if TIMINGS.enabled:
+                    TIMINGS.record("gui_event", time.perf_counter_ns() - posted)
+                function(*args)
+        finally:
+            # Keep draining even if one of the calls raised
+            self.after_id = self.window.after(self.interval, self.drain)
+
+
+class PlotScheduler:
+    """
+    Calls draw on the Tk thread of window at a rate adapted to how long
+    draw takes. sample_count, if given, returns how many samples the plot
+    shows; it is used to skip draws with nothing new and to tell when a
+    high-rate acquisition is running.
+    """
+
+    def __init__(self, window, draw, sample_count=None, max_fps=MAX_PLOT_FPS, min_fps=MIN_PLOT_FPS,
+                 share=PLOT_TIME_SHARE, busy_share=BUSY_PLOT_TIME_SHARE, busy_rate=BUSY_SAMPLE_RATE):
+        self.window = window
+        self.draw = draw
+        self.sample_count = sample_count
+        self.min_interval = 1 / max_fps
+        self.max_interval = 1 / min_fps
+        self.share = share
+        self.busy_share = busy_share
+        self.busy_rate = busy_rate
+        self.render = TimingHistogram()  # Draw times in nanoseconds
+        self.cost = 0.0  # Smoothed draw time in seconds
+        self.interval = self.min_interval
+        self.frames = 0
+        self.skipped = 0  # Ticks with no new samples to draw
+        self.sample_rate = 0.0
+        self.busy = False
+        self.stale = True  # Draw on the next tick even without new samples
+        self.last_count = None
+        self.last_tick = None
+        self.after_id = None
+
+    def start(self):
+        if self.after_id is None:
+            self.after_id = self.window.after(0, self.tick)
+
+    def stop(self):
+        if self.after_id is not None:
+            self.window.after_cancel(self.after_id)
+            self.after_id = None
+
+    def invalidate(self):
+        """ Redraw on the next tick, for changes that do not add samples """
+        self.stale = True
+
+    def tick(self):
+        """ Draw if there is anything new, then schedule the next tick from the draw time """
+        try:
+            now = time.perf_counter()
+            count = self.sample_count() if self.sample_count is not None else None
+            if count is not None and self.last_count is not None:
+                # A smaller count means the run was cleared and started again
+                added = count - self.last_count if count >= self.last_count else count
+                self.sample_rate = added / (now - self.last_tick)
+            self.busy = self.sample_rate > self.busy_rate
+            changed = self.stale or count is None or count != self.last_count
+            self.last_count, self.last_tick = count, now
+
+            if changed:
+                self.stale = False
+                start = time.perf_counter_ns()
+                self.draw()
+                cost_ns = time.perf_counter_ns() - start
+                self.render.record(cost_ns)
+                self.frames += 1
+                self.cost += RENDER_SMOOTHING * (cost_ns / 1e9 - self.cost)
+            else:
+                self.skipped += 1
+        finally:
+            share = self.busy_share if self.busy else self.share
+            self.interval = min(max(self.cost / share, self.min_interval), self.max_interval)
+            self.after_id = self.window.after(round(self.interval * 1000), self.tick)
+
+    def stats(self):
+        """ Render statistics: frames drawn and skipped, refresh rate and draw times in ms """
+        return {
+            "frames": self.frames,
+            "skipped": self.skipped,
+            "fps": 1 / self.interval,
+            "interval_ms": self.interval * 1000,
+            "draw_mean_ms": self.render.mean() / 1e6,
+            "draw_p99_ms": self.render.percentile(99) / 1e6,
+            "draw_max_ms": self.render.max / 1e6,
+            "sample_rate": self.sample_rate,
+            "busy": self.busy,
+        }
+
+    def report(self):
+        """ Return the render statistics as one line of text """
+        text = "Plot {fps:.1f} fps, draw {draw_mean_ms:.1f} ms mean, {draw_p99_ms:.1f} ms p99, " \
+               "{frames} drawn, {skipped} skipped".format(**self.stats())
+        if self.busy:
+            text += ", backed off for acquisition"
+        return text
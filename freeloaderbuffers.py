@@ -0,0 +1,392 @@
+"""
+freeloaderbuffers
+
+Pre-allocated, typed storage for the samples of a run. A RunBuffer holds
+one array.array of doubles per column (time in epoch seconds, position,
+raw weight, filtered weight), sized up front from the test plan, so the
+acquisition loop only writes numbers into memory that already exists. If
+a run outlasts its plan the full arrays are spilled to a temporary file
+and refilled, so nothing is lost and memory stays at the planned size.
+
+Timestamps are only formatted when rows are read back for saving or
+display.
+
+Long creep and relaxation runs use a SegmentedRunBuffer instead, whose
+writer thread streams samples to rolling CSV segment files as it goes,
+while only the latest samples are kept in memory, so RAM stays bounded
+however many days a run lasts and a crash loses at most a few seconds of
+data.
+
+Run with --check to measure with tracemalloc what appending a sample
+through Freeloader.add_measurement allocates within the call and keeps.
+It keeps nothing, and allocates only the CHECK_FLOATS_PER_SAMPLE float
+objects holding the sample's calibrated and filtered load.
+"""
+
+import argparse
+import csv
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from array import array
+from datetime import datetime
+
+
+COLUMNS = ("time", "position", "weight", "filtered")
+
+# Capacity used when a run has no plan to size it from
+DEFAULT_CAPACITY = 65536
+
+# Extra room allowed over the planned sample count, for gap rows and timing slack
+CAPACITY_MARGIN = 0.05
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Long runs: samples kept in memory, and when segment files are flushed and rolled over
+LONG_RUN_WINDOW = 16384
+SEGMENT_FLUSH_INTERVAL = 5.0
+SEGMENT_SECONDS = 3600.0
+SEGMENT_ROWS = 1000000
+
+# Float objects add_measurement is allowed to allocate per sample in --check:
+# the calibrated load and the filtered load. Python makes a new float for
+# every arithmetic result, so no Python loop computing them can do with fewer;
+# anything else per sample (a tuple, a string, list growth) fails the check
+CHECK_FLOATS_PER_SAMPLE = 2
+
+
+def plan_capacity(travel, rate, sample_hz, margin=CAPACITY_MARGIN):
+    """ Samples needed to cover travel at rate (in the same units per second) sampling at sample_hz """
+    return max(1, math.ceil(travel / rate * sample_hz * (1 + margin)))
+
+
+def format_timestamp(t):
+    """ Format epoch seconds as the timestamp used in saved runs """
+    return datetime.fromtimestamp(t).strftime(TIMESTAMP_FORMAT)
+
+
+class RunBuffer:
+    """
+    Column store for one run. append() is called only by the acquisition
+    thread and allocates nothing unless the buffer is full; readers may call
+    read() and rows() from any thread.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.columns = [array('d', [0.0]) * capacity for _ in COLUMNS]
+        self.time, self.position, self.weight, self.filtered = self.columns
+        self.count = 0
+        self.spill_file = None
+        self.spilled = 0  # Samples written to the spill file
+        self.lock = threading.Lock()  # Serializes spilling with readers
+
+    def __len__(self):
+        return self.spilled + self.count
+
+    def append(self, t, position, weight, filtered):
+        """ Store one sample """
+        index = self.count
+        if index == self.capacity:
+            self.spill()
+            index = 0
+        self.time[index] = t
+        self.position[index] = position
+        self.weight[index] = weight
+        self.filtered[index] = filtered
+        self.count = index + 1
+
+    def fill(self, columns):
+        """
+        Replace the samples with whole time, position, weight and filtered
+        arrays of doubles, such as a run read back from a journal. They must
+        fit in the buffer's capacity.
+        """
+        count = len(columns[0])
+        if count > self.capacity:
+            raise ValueError("The samples do not fit in the run buffer.")
+        with self.lock:
+            for values, new_values in zip(self.columns, columns):
+                values[:count] = new_values
+            self.count = count
+
+    def spill(self):
+        """ Move the full arrays to the spill file so they can be refilled """
+        with self.lock:
+            if self.spill_file is None:
+                self.spill_file = tempfile.TemporaryFile(prefix="freeloader_spill_")
+            self.spill_file.seek(0, os.SEEK_END)
+            for values in self.columns:
+                values.tofile(self.spill_file)
+            self.spilled += self.count
+            self.count = 0
+
+    def read(self, *names):
+        """
+        Return copies of the named columns over the whole run as arrays of
+        doubles, all the same length even while samples are being appended.
+        """
+        result = []
+        with self.lock:
+            count = self.count
+            for name in names:
+                position = COLUMNS.index(name)
+                values = array('d')
+                if self.spill_file is not None:
+                    # Each spilled block holds every column, capacity values apiece
+                    for block in range(self.spilled // self.capacity):
+                        self.spill_file.seek((block * len(COLUMNS) + position) * self.capacity * values.itemsize)
+                        values.fromfile(self.spill_file, self.capacity)
+                values.extend(self.columns[position][:count])
+                result.append(values)
+        return result
+
+    def blocks(self):
+        """ Yield the whole run as (time, position, weight, filtered) arrays, one block at a time """
+        with self.lock:
+            spilled_blocks = self.spilled // self.capacity if self.spill_file is not None else 0
+        for block in range(spilled_blocks):
+            columns = []
+            with self.lock:
+                self.spill_file.seek(block * len(COLUMNS) * self.capacity * 8)
+                for _ in COLUMNS:
+                    values = array('d')
+                    values.fromfile(self.spill_file, self.capacity)
+                    columns.append(values)
+            yield columns
+        with self.lock:
+            count = self.count
+            live = [values[:count] for values in self.columns]
+        yield live
+
+    def rows(self):
+        """ Yield (timestamp, position, weight) rows in the format saved runs use """
+        for times, positions, weights, filtered in self.blocks():
+            for t, position, weight in zip(times, positions, weights):
+                yield format_timestamp(t), position, weight
+
+    def flush(self):
+        """ Make sure every sample so far is stored; nothing to do while it is all in memory """
+        pass
+
+    def close(self):
+        """ Delete the spill file """
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+
+
+class SegmentedRunBuffer(RunBuffer):
+    """
+    RunBuffer for long runs that writes samples to rolling CSV segment
+    files in directory rather than a temporary spill file. A writer thread
+    writes the new samples every flush_interval seconds, and starts a new
+    segment once the current one is segment_seconds old or holds
+    segment_rows rows, so the acquisition thread never formats or writes a
+    row. The in-memory window is double-buffered: a full set of arrays is
+    handed to the writer and the spare set refilled. read() returns only
+    the samples in the current set, at most capacity of them; blocks() and
+    rows() read the whole run back from the segments and should be used
+    once the run has finished.
+    """
+
+    def __init__(self, directory, capacity=LONG_RUN_WINDOW, segment_seconds=SEGMENT_SECONDS,
+                 segment_rows=SEGMENT_ROWS, flush_interval=SEGMENT_FLUSH_INTERVAL):
+        super().__init__(capacity)
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.prefix = "run_" + datetime.now().strftime("%Y%m%d%H%M%S")
+        self.segment_seconds = segment_seconds
+        self.segment_rows = segment_rows
+        self.flush_interval = flush_interval
+        self.segments = []  # Filenames of every segment so far
+        self.segment = None
+        self.writer = None
+        self.segment_started = 0.0
+        self.segment_written = 0
+
+        self.spare = [array('d', [0.0]) * capacity for _ in COLUMNS]
+        self.full = None  # Filled arrays handed over by spill(), until the writer has written them
+        self.handed_over = threading.Condition()  # Guards full
+        self.write_lock = threading.Lock()  # Held while writing rows, by the writer thread or flush()
+        self.written = 0  # Samples of the whole run written to a segment
+        self.closing = threading.Event()
+        self.writer_thread = threading.Thread(target=self.run_writer, daemon=True)
+        self.writer_thread.start()
+
+    def run_writer(self):
+        """ Thread target that writes new samples every flush_interval until close() """
+        while not self.closing.wait(self.flush_interval):
+            self.flush()
+
+    def open_segment(self):
+        """ Close the current segment file, if any, and start the next one """
+        if self.segment is not None:
+            self.segment.close()
+        filename = os.path.join(self.directory, "{}_{:04d}.csv".format(self.prefix, len(self.segments) + 1))
+        self.segment = open(filename, 'w', newline='')
+        self.writer = csv.writer(self.segment)
+        self.writer.writerow(["Time", "Timestamp", "Position", "Weight", "Filtered"])
+        self.segments.append(filename)
+        self.segment_started = time.monotonic()
+        self.segment_written = 0
+
+    def write_rows(self, columns, start, end):
+        times, positions, weights, filtered = columns
+        for index in range(start, end):
+            t = times[index]
+            self.writer.writerow([repr(t), format_timestamp(t), positions[index], weights[index], filtered[index]])
+        self.segment_written += end - start
+
+    def flush(self):
+        """ Write the samples not yet in a segment file, rolling over to a new file when due """
+        with self.write_lock:
+            # Rows below count are complete, and no array is refilled before it is written
+            with self.lock:
+                full, live, spilled, count = self.full, self.columns, self.spilled, self.count
+            if spilled + count == self.written:
+                return
+            if (self.segment is None or self.segment_written >= self.segment_rows
+                    or time.monotonic() - self.segment_started >= self.segment_seconds):
+                self.open_segment()
+
+            if full is not None:
+                self.write_rows(full, self.written - (spilled - self.capacity), self.capacity)
+                with self.handed_over:
+                    self.full = None
+                    self.handed_over.notify()
+            self.write_rows(live, max(self.written, spilled) - spilled, count)
+            self.segment.flush()
+            self.written = spilled + count
+
+    def spill(self):
+        """ Hand the full arrays to the writer and refill the spare set """
+        with self.handed_over:
+            # Only waits if the writer has fallen a whole window behind
+            while self.full is not None:
+                self.handed_over.wait()
+            with self.lock:
+                self.full, self.columns, self.spare = self.columns, self.spare, self.columns
+                self.time, self.position, self.weight, self.filtered = self.columns
+                self.spilled += self.count
+                self.count = 0
+
+    def blocks(self):
+        self.flush()
+        for filename in list(self.segments):
+            with open(filename, newline='') as file:
+                reader = csv.reader(file)
+                next(reader)
+                columns = [array('d') for _ in COLUMNS]
+                for row in reader:
+                    for values, field in zip(columns, (row[0], row[2], row[3], row[4])):
+                        values.append(float(field))
+                    if len(columns[0]) == self.capacity:
+                        yield columns
+                        columns = [array('d') for _ in COLUMNS]
+                if columns[0]:
+                    yield columns
+
+        # Samples appended since the flush
+        with self.write_lock, self.lock:
+            start, count = max(self.written - self.spilled, 0), self.count
+            live = [values[start:count] for values in self.columns]
+        yield live
+
+    def close(self):
+        """ Stop the writer, write out everything left and close the current segment """
+        self.closing.set()
+        self.writer_thread.join()
+        self.flush()
+        with self.write_lock:
+            if self.segment is not None:
+                self.segment.close()
+                self.segment = None
+
+
+def traced_allocations(call, samples):
+    """
+    Call call(t, position, weight) for samples made-up samples under
+    tracemalloc. Returns the mean and largest bytes allocated at once within
+    a call, and the bytes per sample still held afterwards. The peak is
+    reset before each call, so memory freed again before it returns, such
+    as the float objects of its arithmetic, is counted too.
+    """
+    tracemalloc.start()
+    get_traced_memory, reset_peak = tracemalloc.get_traced_memory, tracemalloc.reset_peak
+    total = largest = 0
+    start = get_traced_memory()[0]
+    for i in range(samples):
+        t, position = 1.7e9 + i, i * 0.001
+        before = get_traced_memory()[0]
+        reset_peak()
+        call(t, position, 1.0)
+        allocated = get_traced_memory()[1] - before
+        total += allocated
+        largest = max(largest, allocated)
+    kept = get_traced_memory()[0] - start
+    tracemalloc.stop()
+    return total / samples, largest, kept / samples
+
+
+def allocation_allowance():
+    """ Bytes add_measurement is allowed to allocate per sample: CHECK_FLOATS_PER_SAMPLE floats """
+    return CHECK_FLOATS_PER_SAMPLE * sys.getsizeof(0.0)
+
+
+def check_allocations(samples=100000):
+    """
+    Append samples through Freeloader.add_measurement under tracemalloc,
+    once into a RunBuffer and once into a list of tuples as the old code
+    did, and print what each allocates within a call and keeps per sample,
+    less the cost of the measuring loop itself, found by measuring a call
+    that does nothing. The Freeloader has its calibration loaded, as once
+    the Loadstar is connected. Returns the RunBuffer path's (mean bytes
+    allocated per call, bytes kept per sample).
+    """
+    from freeloaderGUI_5_9 import Freeloader
+
+    freeloader = Freeloader()
+    freeloader.calibration = freeloader.load_calibration()
+    freeloader.clear_measurements(samples)
+
+    # Warm up so the filter window and any caches are already allocated
+    for i in range(1000):
+        freeloader.add_measurement(1.7e9 + i, i * 0.001, 1.0)
+    freeloader.clear_measurements(samples)
+
+    rows = []
+    overhead = traced_allocations(lambda t, position, weight: None, samples)
+    results = [
+        ("RunBuffer:", traced_allocations(freeloader.add_measurement, samples)),
+        ("list of tuples:", traced_allocations(
+            lambda t, position, weight: rows.append((format_timestamp(t), position, weight)), samples)),
+    ]
+    for name, (mean, largest, kept) in results:
+        print("{:<16}{:.1f} bytes allocated per call (up to {}), {:.2f} bytes kept per sample".format(
+            name, mean - overhead[0], largest, kept - overhead[2]))
+    print("allowed:        {} bytes allocated per sample ({} float objects), nothing kept".format(
+        allocation_allowance(), CHECK_FLOATS_PER_SAMPLE))
+    mean, largest, kept = results[0][1]
+    return mean - overhead[0], kept - overhead[2]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Freeloader run buffer checks.")
+    parser.add_argument("--check", action="store_true", help="measure memory allocated and kept per appended sample")
+    parser.add_argument("--samples", type=int, default=100000)
+    args = parser.parse_args()
+
+    if args.check:
+        allocated, kept = check_allocations(args.samples)
+        # Both are averages over every sample, so anything per sample shows as a byte or more
+        if kept >= 1:
+            raise SystemExit("add_measurement kept memory for each sample.")
+        if allocated - allocation_allowance() >= 1:
+            raise SystemExit("add_measurement allocated more than its calibrated and filtered load per sample.")
+    else:
+        parser.print_help()
@@ -0,0 +1,222 @@
+"""
+freeloadercalibration
+
+Load cell calibration, software tare and zero-drift compensation.
+
+Each cell has a CalibrationTable of (raw reading, load) points in a stated
+unit, applied by piecewise-linear interpolation, extended linearly past the
+end points. A LoadCalibration pairs a table with a software tare offset,
+taken by averaging readings, and a record of the zero baseline observed
+while the cell is known to be unloaded: from a tare until the motor next
+moves. Corrections are applied with NumPy to whole blocks of samples: the
+latest baseline observed before each sample is subtracted along with the
+tare, so readings taken after a run never change its loads.
+
+Tables are kept in a JSON file keyed by cell ID.
+"""
+
+import json
+import os
+import threading
+from bisect import bisect_right
+from collections import deque
+
+import numpy as np
+
+
+# Size of each unit in pounds-force
+UNIT_FACTORS = {
+    "lb": 1.0,
+    "N": 4.4482216152605,
+    "kgf": 0.45359237,
+    "g": 453.59237,
+}
+
+UNIT_LABELS = {"lb": "lb.", "N": "N", "kgf": "kgf", "g": "g"}
+
+# Idle baseline observations kept per cell
+MAX_DRIFT_POINTS = 10000
+
+
+class CalibrationError(ValueError):
+    """ Raised for unusable calibration tables or tare readings """
+    pass
+
+
+def load_label(unit):
+    """ Axis and column label for loads in unit """
+    return "Tensile Load ({})".format(UNIT_LABELS[unit])
+
+
+def convert_units(values, from_unit, to_unit):
+    """ Convert loads between units in UNIT_FACTORS """
+    if from_unit == to_unit:
+        return values
+    return values * (UNIT_FACTORS[to_unit] / UNIT_FACTORS[from_unit])
+
+
+class CalibrationTable:
+    """ Multi-point calibration of one load cell from raw readings to load in unit """
+
+    def __init__(self, cell_id, unit="lb", points=None):
+        if unit not in UNIT_FACTORS:
+            raise CalibrationError(f"Unknown load unit '{unit}'.")
+        points = sorted(points) if points else [(0.0, 0.0), (1.0, 1.0)]
+        if len(points) < 2:
+            raise CalibrationError("A calibration table needs at least two points.")
+
+        self.cell_id = cell_id
+        self.unit = unit
+        self.raw = np.array([point[0] for point in points], dtype=float)
+        self.load = np.array([point[1] for point in points], dtype=float)
+        if np.any(np.diff(self.raw) <= 0):
+            raise CalibrationError("Calibration points must have distinct raw readings.")
+
+        # Slopes of the end segments, used to extrapolate past the table
+        self.low_slope = (self.load[1] - self.load[0]) / (self.raw[1] - self.raw[0])
+        self.high_slope = (self.load[-1] - self.load[-2]) / (self.raw[-1] - self.raw[-2])
+        self.raw_points = self.raw.tolist()  # Plain floats for convert_one
+        self.load_points = self.load.tolist()
+
+    def convert(self, raw):
+        """ Convert raw readings (scalar or array) to load in the table's unit """
+        raw = np.asarray(raw, dtype=float)
+        load = np.interp(raw, self.raw, self.load)
+        load = np.where(raw < self.raw[0], self.load[0] + (raw - self.raw[0]) * self.low_slope, load)
+        load = np.where(raw > self.raw[-1], self.load[-1] + (raw - self.raw[-1]) * self.high_slope, load)
+        return load
+
+    def convert_one(self, raw):
+        """ convert() for a single reading, in plain Python so the acquisition loop allocates no arrays """
+        raw_points, load_points = self.raw_points, self.load_points
+        # The end segments carry on past the table, as in convert()
+        index = min(max(bisect_right(raw_points, raw), 1), len(raw_points) - 1)
+        raw0, load0 = raw_points[index - 1], load_points[index - 1]
+        slope = (load_points[index] - load0) / (raw_points[index] - raw0)
+        return load0 + (raw - raw0) * slope
+
+    def to_dict(self):
+        return {"unit": self.unit, "points": [[float(r), float(l)] for r, l in zip(self.raw, self.load)]}
+
+    @classmethod
+    def from_dict(cls, cell_id, data):
+        return cls(cell_id, data.get("unit", "lb"), [tuple(point) for point in data["points"]])
+
+
+def load_tables(filename):
+    """ Read every calibration table from a JSON file, returning {} if it does not exist """
+    if not os.path.exists(filename):
+        return {}
+    with open(filename) as file:
+        data = json.load(file)
+    return {cell_id: CalibrationTable.from_dict(cell_id, table) for cell_id, table in data.items()}
+
+
+def save_table(filename, table):
+    """ Add or replace one cell's table in a JSON file """
+    data = {}
+    if os.path.exists(filename):
+        with open(filename) as file:
+            data = json.load(file)
+    data[table.cell_id] = table.to_dict()
+    with open(filename, 'w') as file:
+        json.dump(data, file, indent=2)
+
+
+class LoadCalibration:
+    """
+    Calibration, tare and drift state of the connected load cell.
+    Loads are reported in display_unit, which defaults to the table's unit.
+    """
+
+    def __init__(self, table, display_unit=None):
+        self.table = table
+        self.display_unit = display_unit or table.unit
+        self.tare_offset = 0.0  # In the table's unit
+        self.drift_times = deque(maxlen=MAX_DRIFT_POINTS)
+        self.drift_values = deque(maxlen=MAX_DRIFT_POINTS)
+        self.drift_lock = threading.Lock()  # Drift is observed and applied on different threads
+        self.zero = 0.0  # Tare offset plus the latest drift, replaced whole so load() needs no lock
+        self.unloaded = False  # Set by a tare and cleared once the motor moves; drift is only read while set
+
+    @property
+    def label(self):
+        """ Axis and column label for calibrated loads """
+        return load_label(self.display_unit)
+
+    def tare(self, t, raw_readings, tolerance=None):
+        """
+        Take the mean of raw_readings as the new zero and restart drift
+        tracking from time t. If tolerance is given, readings whose spread
+        (in the table's unit) exceeds it raise CalibrationError.
+        """
+        loads = self.table.convert(np.asarray(raw_readings, dtype=float))
+        loads = loads[~np.isnan(loads)]
+        if not loads.size:
+            raise CalibrationError("No valid readings to tare with.")
+        if tolerance is not None and np.ptp(loads) > tolerance:
+            raise CalibrationError("Load cell readings were not steady enough to tare.")
+
+        with self.drift_lock:
+            self.tare_offset = float(loads.mean())
+            self.drift_times.clear()
+            self.drift_values.clear()
+            self.drift_times.append(t)
+            self.drift_values.append(0.0)
+            self.zero = self.tare_offset
+        self.unloaded = True
+        return self.tare_offset
+
+    def state(self):
+        """ Tare offset and drift observations, for copying to another process """
+        with self.drift_lock:
+            return self.tare_offset, list(self.drift_times), list(self.drift_values)
+
+    def restore(self, state):
+        """ Take over the tare offset and drift observations from state() """
+        tare_offset, drift_times, drift_values = state
+        with self.drift_lock:
+            self.tare_offset = tare_offset
+            self.drift_times.clear()
+            self.drift_times.extend(drift_times)
+            self.drift_values.clear()
+            self.drift_values.extend(drift_values)
+            self.zero = tare_offset + (drift_values[-1] if drift_values else 0.0)
+
+    def observe_idle(self, t, raw):
+        """ Record the zero baseline read at time t while nothing is loading the cell; ignored unless unloaded """
+        if not self.unloaded:
+            return
+        load = float(self.table.convert(raw))
+        with self.drift_lock:
+            self.drift_times.append(t)
+            self.drift_values.append(load - self.tare_offset)
+            self.zero = load
+
+    def baseline(self, times):
+        """
+        Drift baseline at each time: the latest observation at or before it,
+        held flat, or zero before the first. Later observations never reach
+        back to samples already taken.
+        """
+        with self.drift_lock:
+            if not self.drift_times:
+                return np.zeros(np.shape(times))
+            drift_times = np.fromiter(self.drift_times, float)
+            drift_values = np.fromiter(self.drift_values, float)
+        index = np.searchsorted(drift_times, times, side="right") - 1
+        return np.where(index >= 0, drift_values[np.maximum(index, 0)], 0.0)
+
+    def load(self, raw):
+        """
+        Calibrated, tared and drift-corrected load in display_unit of one
+        reading taken just now. Called once per sample, so it reads the
+        single zero attribute rather than taking the lock.
+        """
+        return convert_units(self.table.convert_one(raw) - self.zero, self.table.unit, self.display_unit)
+
+    def apply(self, times, raw):
+        """ Calibrated, tared and drift-corrected loads in display_unit for a block of samples """
+        times = np.asarray(times, dtype=float)
+        loads = self.table.convert(raw) - self.tare_offset - self.baseline(times)
+        return convert_units(loads, self.table.unit, self.display_unit)
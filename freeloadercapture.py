@@ -0,0 +1,305 @@
+"""
+freeloadercapture
+
+Serial traffic capture and replay for offline profiling. While capturing,
+the Dynamixel PortHandler's serial port and the Loadstar connection are
+wrapped in TappedSerial, which logs every byte written and read with a
+monotonic timestamp. A capture file is a short magic line followed by
+records of
+
+    t_ns       8 bytes   nanoseconds since the capture started
+    channel    1 byte    0 Dynamixel, 1 Loadstar
+    direction  1 byte    0 written by us, 1 read back
+    length     2 bytes
+    data       length bytes
+
+ReplayFreeloader runs the normal Freeloader code against ReplaySerial
+objects that answer from a capture, either at the recorded pace or as fast
+as possible, so acquisition and parsing can be profiled and regression
+tested without the rig:
+
+    python freeloadercapture.py session.flcap --fast --profile
+"""
+
+import argparse
+import cProfile
+import itertools
+import pstats
+import struct
+import threading
+import time
+
+from freeloaderGUI_5_9 import BAUDRATE, LOADSTAR_BAUDRATE, Freeloader, _dxl_sdk
+from freeloadertiming import TIMINGS
+
+
+CAPTURE_MAGIC = b"FLCAP1\n"
+CAPTURE_RECORD = struct.Struct("<QBBH")
+
+CHANNEL_DYNAMIXEL = 0
+CHANNEL_LOADSTAR = 1
+
+DIRECTION_WRITE = 0
+DIRECTION_READ = 1
+
+# Largest payload a single record can hold; longer transfers are split
+MAX_RECORD_DATA = 0xFFFF
+
+
+class CaptureWriter:
+    """ Thread-safe writer of capture records """
+
+    def __init__(self, filename):
+        self.file = open(filename, 'wb')
+        self.file.write(CAPTURE_MAGIC)
+        self.lock = threading.Lock()
+        self.start_ns = time.monotonic_ns()
+
+    def record(self, channel, direction, data):
+        """ Append one transfer, stamped with the time since the capture started """
+        t_ns = time.monotonic_ns() - self.start_ns
+        with self.lock:
+            for offset in range(0, len(data), MAX_RECORD_DATA):
+                chunk = data[offset:offset + MAX_RECORD_DATA]
+                self.file.write(CAPTURE_RECORD.pack(t_ns, channel, direction, len(chunk)))
+                self.file.write(chunk)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def read_capture(filename):
+    """ Return the records of a capture file as (t_ns, channel, direction, data) tuples """
+    with open(filename, 'rb') as file:
+        content = file.read()
+
+    if not content.startswith(CAPTURE_MAGIC):
+        raise ValueError(f"{filename} is not a Freeloader capture file.")
+
+    records = []
+    offset = len(CAPTURE_MAGIC)
+    while offset + CAPTURE_RECORD.size <= len(content):
+        t_ns, channel, direction, length = CAPTURE_RECORD.unpack_from(content, offset)
+        offset += CAPTURE_RECORD.size
+        records.append((t_ns, channel, direction, content[offset:offset + length]))
+        offset += length
+    return records
+
+
+class TappedSerial:
+    """
+    Wraps a serial.Serial and copies every byte it writes and reads into a
+    CaptureWriter. Anything not intercepted is passed through to the port.
+    """
+
+    def __init__(self, inner, capture, channel):
+        self.inner = inner
+        self.capture = capture
+        self.channel = channel
+
+    def write(self, data):
+        written = self.inner.write(data)
+        self.capture.record(self.channel, DIRECTION_WRITE, bytes(data))
+        return written
+
+    def read(self, size=1):
+        data = self.inner.read(size)
+        if data:
+            self.capture.record(self.channel, DIRECTION_READ, data)
+        return data
+
+    def read_all(self):
+        data = self.inner.read_all()
+        if data:
+            self.capture.record(self.channel, DIRECTION_READ, data)
+        return data
+
+    def readline(self, *args):
+        data = self.inner.readline(*args)
+        if data:
+            self.capture.record(self.channel, DIRECTION_READ, data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+
+class ReplaySerial:
+    """
+    Serial stand-in that answers from one channel of a capture.
+
+    Each write consumes the next recorded write, counting a mismatch if the
+    bytes differ. Reads return the recorded replies that followed it. With
+    realtime set, replies only become readable once as much time has passed
+    since the replay started as had passed in the capture. on_finished is
+    called once the channel has nothing left to replay.
+    """
+
+    def __init__(self, records, channel, realtime=True, on_finished=None):
+        self.events = [(t_ns, direction, data) for t_ns, record_channel, direction, data in records
+                       if record_channel == channel]
+        self.position = 0
+        self.pending = b""  # Part of a read event not yet returned
+        self.realtime = realtime
+        self.on_finished = on_finished
+        self.start = time.monotonic_ns()
+        self.origin = self.events[0][0] if self.events else 0
+        self.mismatches = 0
+        self.is_open = True
+
+    def due(self, t_ns):
+        """ True once a recorded event's time has come """
+        return not self.realtime or time.monotonic_ns() - self.start >= t_ns - self.origin
+
+    def finish_if_done(self):
+        if self.position >= len(self.events) and not self.pending and self.on_finished is not None:
+            self.on_finished()
+            self.on_finished = None
+
+    def write(self, data):
+        # Skip replies the code never read before its next command
+        while self.position < len(self.events) and self.events[self.position][1] == DIRECTION_READ:
+            self.position += 1
+        self.pending = b""
+
+        if self.position < len(self.events):
+            if self.events[self.position][2] != bytes(data):
+                self.mismatches += 1
+            self.position += 1
+        self.finish_if_done()
+        return len(data)
+
+    def collect(self, size=None, wait=False):
+        """ Gather available reply bytes, waiting for the next reply if wait is set """
+        data = self.pending
+        while size is None or len(data) < size:
+            if self.position >= len(self.events):
+                break
+            t_ns, direction, chunk = self.events[self.position]
+            if direction != DIRECTION_READ:
+                break
+            if not self.due(t_ns):
+                if not (wait and not data):
+                    break
+                time.sleep(max(0, (t_ns - self.origin - (time.monotonic_ns() - self.start)) / 1e9))
+            data += chunk
+            self.position += 1
+
+        if size is not None:
+            data, self.pending = data[:size], data[size:]
+        else:
+            self.pending = b""
+        self.finish_if_done()
+        return data
+
+    def read(self, size=1):
+        return self.collect(size, wait=True)
+
+    def read_all(self):
+        return self.collect()
+
+    def readline(self, *args):
+        data = self.collect(wait=True)
+        line, newline, rest = data.partition(b"\n")
+        self.pending = rest + self.pending
+        return line + newline
+
+    @property
+    def in_waiting(self):
+        waiting = len(self.pending)
+        for t_ns, direction, chunk in itertools.islice(self.events, self.position, None):
+            if direction != DIRECTION_READ or not self.due(t_ns):
+                break
+            waiting += len(chunk)
+        return waiting
+
+    def inWaiting(self):
+        return self.in_waiting
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        self.pending = b""
+
+    def close(self):
+        self.is_open = False
+
+
+def replay_port_handler(port_name, replay):
+    """ Build a dynamixel_sdk PortHandler whose serial port is a ReplaySerial """
+    sdk = _dxl_sdk()
+
+    class ReplayPortHandler(sdk.PortHandler):
+        def setupPort(self, cflag_baud):
+            self.ser = replay
+            self.is_open = True
+            self.tx_time_per_byte = (1000.0 / self.baudrate) * 10.0
+            return True
+
+    return ReplayPortHandler(port_name)
+
+
+class ReplayFreeloader(Freeloader):
+    """
+    Freeloader whose devices answer from a capture file. Everything above
+    the serial ports is the normal Freeloader code. The run stops when the
+    Loadstar channel is used up, and errors are collected rather than shown.
+    """
+
+    def __init__(self, filename, realtime=True):
+        super().__init__()
+        records = read_capture(filename)
+        self.dynamixel_replay = ReplaySerial(records, CHANNEL_DYNAMIXEL, realtime)
+        self.loadstar_replay = ReplaySerial(records, CHANNEL_LOADSTAR, realtime, self.stop_measurement)
+        self.errors = []
+        if not realtime:
+            self.loadstar_response_wait = self.sample_interval = 0
+
+    def make_port_handler(self, port):
+        return replay_port_handler(port, self.dynamixel_replay)
+
+    def open_loadstar(self, com_port, baudrate):
+        return self.loadstar_replay
+
+    def report_error(self, message):
+        self.errors.append(message)
+
+    def replay(self):
+        """ Connect to the replayed devices and run one measurement to the end of the capture """
+        self.connect_dynamixel("replay", BAUDRATE)
+        self.connect_loadstar("replay", LOADSTAR_BAUDRATE)
+        self.start_measurement()
+        for thread in self.acquisition_threads:
+            thread.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay a Freeloader serial capture through the acquisition code.")
+    parser.add_argument("capture", help="capture file recorded with Freeloader.start_capture")
+    parser.add_argument("--fast", action="store_true", help="replay as fast as possible instead of at recorded speed")
+    parser.add_argument("--profile", action="store_true", help="run the replay under cProfile")
+    parser.add_argument("--timings", action="store_true", help="print the stage timing histograms")
+    args = parser.parse_args()
+
+    freeloader = ReplayFreeloader(args.capture, realtime=not args.fast)
+    TIMINGS.enabled = args.timings
+
+    start = time.perf_counter()
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.runcall(freeloader.replay)
+    else:
+        freeloader.replay()
+    elapsed = time.perf_counter() - start
+
+    print("Replayed {} samples in {:.2f} s ({} Dynamixel and {} Loadstar write mismatches)".format(
+        len(freeloader.measurements), elapsed,
+        freeloader.dynamixel_replay.mismatches, freeloader.loadstar_replay.mismatches))
+    for message in freeloader.errors:
+        print("Error:", message)
+    if args.timings:
+        print(TIMINGS.report())
+    if args.profile:
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(20)
@@ -0,0 +1,306 @@
+"""
+freeloaderdaemon
+
+Headless Freeloader acquisition daemon. It owns the Dynamixel and Loadstar
+and exposes them over HTTP on localhost, so lab automation and any number
+of viewers can drive and watch a test without each opening the serial
+ports. Unlike freeloaderbasic2_7_2 it needs neither msvcrt nor keyboard.
+
+Endpoints:
+    GET  /status                 device status and run state as JSON
+    POST /start                  start a measurement run, following the
+                                 recipe in the JSON body if one is sent
+    POST /stop                   stop the run and the motor
+    POST /tare                   tare the load cell
+    POST /jog?direction=up       jog the motor up, down or stop
+    GET  /stream                 server-sent events, one JSON sample per event
+
+Pass --telemetry-port to also publish samples on the binary stream from
+freeloadertelemetry. Run with --latency against a running daemon to measure
+how long samples take to reach a client.
+"""
+
+import argparse
+import json
+import queue
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from freeloaderGUI_5_9 import DeviceMonitor, Freeloader, FreeloaderError
+from freeloaderbuffers import format_timestamp
+
+
+DAEMON_HOST = "127.0.0.1"
+DAEMON_PORT = 8765
+
+# Samples buffered per stream client before the oldest are dropped
+CLIENT_QUEUE_SIZE = 4096
+
+# Seconds between keep-alive comments on an idle stream
+KEEPALIVE_INTERVAL = 5.0
+
+
+class FreeloaderDaemon:
+    """
+    Owns a Freeloader and fans its samples out to stream clients.
+    Each client gets its own bounded queue so a slow viewer only loses its
+    own samples and never holds up acquisition.
+    """
+
+    def __init__(self, freeloader, monitor=None):
+        self.freeloader = freeloader
+        self.monitor = monitor
+        self.clients = []
+        self.clients_lock = threading.Lock()
+        self.errors = []
+        freeloader.sample_listeners.append(self.publish)
+        freeloader.report_error = self.errors.append
+
+    def publish(self, t, position, weight):
+        """
+        Sample listener that queues each measurement, stamped with the time
+        it was taken and with the calibrated, tared load saved runs hold,
+        for every client
+        """
+        event = json.dumps({
+            "t_ns": int(t * 1e9),
+            "timestamp": format_timestamp(t),
+            "position": position,
+            "load": self.freeloader.calibrated_load(weight),
+        })
+        with self.clients_lock:
+            clients = list(self.clients)
+        for client in clients:
+            try:
+                client.put_nowait(event)
+            except queue.Full:
+                pass
+
+    def subscribe(self):
+        """ Register a new stream client and return its queue """
+        client = queue.Queue(CLIENT_QUEUE_SIZE)
+        with self.clients_lock:
+            self.clients.append(client)
+        return client
+
+    def unsubscribe(self, client):
+        """ Forget a stream client """
+        with self.clients_lock:
+            self.clients.remove(client)
+
+    def running(self):
+        """ True while a measurement run is in progress """
+        return self.freeloader.acquiring()
+
+    def status(self):
+        """ Return the daemon state as a JSON-ready dict """
+        return {
+            "dynamixel": self.freeloader.dyna_online,
+            "loadstar": self.freeloader.cell_online,
+            "devices": dict(self.monitor.status) if self.monitor is not None else {},
+            "running": self.running(),
+            "stage": self.freeloader.recipe_stage,
+            "samples": len(self.freeloader.measurements),
+            "clients": len(self.clients),
+            "errors": list(self.errors),
+        }
+
+    def start(self, recipe=None):
+        """ Start a measurement run, following recipe if given """
+        if not (self.freeloader.dyna_online and self.freeloader.cell_online):
+            raise FreeloaderError("The Dynamixel and Loadstar must both be online to start.")
+        if self.running():
+            raise FreeloaderError("A measurement is already running.")
+        self.errors.clear()
+        self.freeloader.start_measurement(recipe)
+
+    def stop(self):
+        """ Stop the run and any jog """
+        self.freeloader.stop_measurement()
+        self.jog("stop")
+
+    def tare(self):
+        """ Tare the load cell, unless a run is in progress """
+        if self.running():
+            raise FreeloaderError("Cannot tare while a measurement is running.")
+        self.freeloader.tare_load_cell()
+
+    def jog(self, direction):
+        """ Move the motor up or down until told to stop; only stopping is allowed during a run """
+        if direction in ("up", "down") and self.running():
+            raise FreeloaderError("Cannot jog while a measurement is running.")
+        if direction == "up":
+            self.freeloader.move_motor_in_one_direction_up()
+        elif direction == "down":
+            self.freeloader.move_motor_in_one_direction_down()
+        elif direction == "stop":
+            self.freeloader.command_speed(0)
+            self.freeloader.is_moving = False
+        else:
+            raise FreeloaderError(f"Unknown jog direction '{direction}'.")
+
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    """ HTTP front end for the FreeloaderDaemon held by the server """
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/status":
+            self.send_json(200, self.server.daemon.status())
+        elif path == "/stream":
+            self.stream()
+        else:
+            self.send_json(404, {"error": "Not found."})
+
+    def read_json(self):
+        """ Return the JSON request body, or None if there is none """
+        length = int(self.headers.get("Content-Length", 0))
+        if not length:
+            return None
+        try:
+            return json.loads(self.rfile.read(length))
+        except ValueError:
+            raise FreeloaderError("Request body is not valid JSON.")
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        daemon = self.server.daemon
+        try:
+            if url.path == "/start":
+                daemon.start(self.read_json())
+            elif url.path == "/stop":
+                daemon.stop()
+            elif url.path == "/tare":
+                daemon.tare()
+            elif url.path == "/jog":
+                daemon.jog(parse_qs(url.query).get("direction", [""])[0])
+            else:
+                self.send_json(404, {"error": "Not found."})
+                return
+        except FreeloaderError as e:
+            self.send_json(409, {"error": str(e)})
+            return
+
+        self.send_json(200, daemon.status())
+
+    def stream(self):
+        """ Send samples as server-sent events until the client goes away """
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        client = self.server.daemon.subscribe()
+        try:
+            while True:
+                try:
+                    event = client.get(timeout=KEEPALIVE_INTERVAL)
+                except queue.Empty:
+                    self.wfile.write(b": keepalive\n\n")
+                else:
+                    self.wfile.write(b"data: " + event.encode('utf-8') + b"\n\n")
+                self.wfile.flush()
+        except OSError:
+            pass
+        finally:
+            self.server.daemon.unsubscribe(client)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(daemon, host=DAEMON_HOST, port=DAEMON_PORT):
+    """ Serve the daemon's HTTP API until interrupted """
+    server = ThreadingHTTPServer((host, port), DaemonRequestHandler)
+    server.daemon_threads = True
+    server.daemon = daemon
+    print(f"Freeloader daemon listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def measure_latency(url, samples=200):
+    """
+    Read samples from a daemon's /stream and print how long each took to
+    arrive after it was acquired. Both ends must share a clock, so run it
+    on the daemon's host. Returns the latencies in milliseconds.
+    """
+    latencies = []
+    with urllib.request.urlopen(url + "/stream") as response:
+        for line in response:
+            if not line.startswith(b"data: "):
+                continue
+            arrived = time.time_ns()
+            sample = json.loads(line[len(b"data: "):])
+            latencies.append((arrived - sample["t_ns"]) / 1e6)
+            if len(latencies) >= samples:
+                break
+
+    latencies.sort()
+    print("samples {}  mean {:.3f} ms  p50 {:.3f} ms  p99 {:.3f} ms  max {:.3f} ms".format(
+        len(latencies),
+        sum(latencies) / len(latencies),
+        latencies[len(latencies) // 2],
+        latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        latencies[-1],
+    ))
+    return latencies
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Headless Freeloader acquisition daemon.")
+    parser.add_argument("--host", default=DAEMON_HOST)
+    parser.add_argument("--port", type=int, default=DAEMON_PORT)
+    parser.add_argument("--simulate", action="store_true", help="use simulated devices")
+    parser.add_argument("--latency", action="store_true", help="measure sample latency from a running daemon")
+    parser.add_argument("--samples", type=int, default=200, help="samples to time with --latency")
+    parser.add_argument("--telemetry-port", type=int, default=None, help="also serve the binary telemetry stream")
+    args = parser.parse_args()
+
+    if args.latency:
+        measure_latency(f"http://{args.host}:{args.port}", args.samples)
+    else:
+        if args.simulate:
+            from freeloaderstations import SimulatedFreeloader
+            freeloader = SimulatedFreeloader()
+            freeloader.connect_dynamixel(None, None)
+            freeloader.connect_loadstar(None, None)
+            monitor = None
+        else:
+            freeloader = Freeloader()
+            monitor = DeviceMonitor(freeloader)
+            monitor.start()
+
+        telemetry = None
+        if args.telemetry_port is not None:
+            from freeloadertelemetry import TelemetryServer
+            telemetry = TelemetryServer(args.host, args.telemetry_port, freeloader)
+            freeloader.sample_listeners.append(telemetry.listener)
+            telemetry.start()
+
+        serve(FreeloaderDaemon(freeloader, monitor), args.host, args.port)
+
+        if telemetry is not None:
+            telemetry.stop()
+
+        freeloader.stop_measurement()
+        if monitor is not None:
+            monitor.stop()
+        if freeloader.dyna_online:
+            freeloader.disconnect_dynamixel()
+        freeloader.disconnect_loadstar()
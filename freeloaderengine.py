@@ -0,0 +1,427 @@
+"""
+freeloaderengine
+
+Runs Freeloader acquisition in its own process so that plotting and other
+work in the Tk process cannot stall sampling. Samples are streamed back
+through a SampleRing, a shared-memory ring buffer written by a single
+producer and published with a sequence counter, so neither side ever takes
+a lock. Commands go to the engine and status and errors come back over
+multiprocessing queues; a tare also gets a reply, so the GUI only reports
+it done once the engine has tared.
+
+Run this file to start the GUI with acquisition in a separate process, or
+with --benchmark to compare sample timing under GUI load with acquisition
+on threads inside the GUI process and in the engine process.
+"""
+
+import argparse
+import multiprocessing
+import queue
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+from freeloaderGUI_5_9 import (
+    DXL_IDS,
+    DeviceMonitor,
+    Freeloader,
+    FreeloaderError,
+    FreeloaderGUI,
+)
+
+
+# Number of samples the ring holds before the oldest are overwritten
+RING_CAPACITY = 65536
+
+# How often the GUI side drains the ring and the engine reports status, in seconds
+DRAIN_INTERVAL = 0.05
+STATUS_INTERVAL = 0.2
+
+# Longest the GUI waits for the engine to answer a tare, in seconds
+TARE_REPLY_TIMEOUT = 30.0
+
+# Ring layout: a header holding the published sequence number and the
+# capacity, followed by fixed-size (t_ns, position, load, temperature) records
+RING_HEADER = struct.Struct("<QQ")
+RING_SEQUENCE = struct.Struct("<Q")
+RING_RECORD = struct.Struct("<qddd")
+
+
+class SampleRing:
+    """
+    Single-producer ring buffer of samples in shared memory.
+
+    The producer writes a record into its slot and only then publishes the
+    new sequence number, so a reader never sees a slot before it is complete.
+    Readers keep their own position; if they fall more than a ring behind,
+    the overwritten samples are counted in dropped instead of being returned.
+    Pass name to attach to a ring created by another process.
+    """
+
+    def __init__(self, capacity=RING_CAPACITY, name=None):
+        if name is None:
+            size = RING_HEADER.size + capacity * RING_RECORD.size
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            RING_HEADER.pack_into(self.shm.buf, 0, 0, capacity)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+
+        self.name = self.shm.name
+        self.capacity = RING_HEADER.unpack_from(self.shm.buf, 0)[1]
+        self.write_seq = RING_SEQUENCE.unpack_from(self.shm.buf, 0)[0]
+        self.read_seq = self.write_seq
+        self.dropped = 0
+
+    def offset(self, seq):
+        """ Byte offset of the slot holding sequence number seq """
+        return RING_HEADER.size + (seq % self.capacity) * RING_RECORD.size
+
+    def write(self, t_ns, position, load, temperature):
+        """ Append one sample and publish it. Only one process may write. """
+        RING_RECORD.pack_into(self.shm.buf, self.offset(self.write_seq), t_ns, position, load, temperature)
+        self.write_seq += 1
+        RING_SEQUENCE.pack_into(self.shm.buf, 0, self.write_seq)
+
+    def read_new(self):
+        """ Return every sample published since the last call, oldest first """
+        head = RING_SEQUENCE.unpack_from(self.shm.buf, 0)[0]
+        start = max(self.read_seq, head - self.capacity)
+        self.dropped += start - self.read_seq
+
+        records = [RING_RECORD.unpack_from(self.shm.buf, self.offset(seq)) for seq in range(start, head)]
+
+        # Drop any slots the producer lapped while they were being copied
+        # The producer fills slot head before publishing head + 1, so slot head - capacity is already suspect
+        overwritten = RING_SEQUENCE.unpack_from(self.shm.buf, 0)[0] - self.capacity - start + 1
+        if overwritten > 0:
+            records = records[overwritten:]
+            self.dropped += overwritten
+
+        self.read_seq = head
+        return records
+
+    def close(self):
+        """ Detach from the shared memory """
+        self.shm.close()
+
+    def unlink(self):
+        """ Free the shared memory. Only the creating process should call this. """
+        self.shm.unlink()
+
+
+def run_engine(ring_name, commands, events, dxl_ids, simulate=False):
+    """
+    Entry point of the acquisition process.
+    Owns the Freeloader and its serial ports, writes every sample into the
+    ring and answers commands until told to quit.
+    """
+    ring = SampleRing(name=ring_name)
+    runs = 0  # Start commands handled, so the GUI can tell a finished run from one not yet begun
+
+    if simulate:
+        from freeloaderstations import SimulatedFreeloader
+        freeloader = SimulatedFreeloader()
+        freeloader.connect_dynamixel(None, None)
+        freeloader.connect_loadstar(None, None)
+        monitor = None
+    else:
+        freeloader = Freeloader(dxl_ids)
+        monitor = DeviceMonitor(freeloader)
+        monitor.start()
+
+    # Errors from the worker threads go back to the GUI instead of a message box,
+    # and the GUI process streams and journals the run from the ring
+    freeloader.report_error = lambda message: events.put(("error", message))
+    freeloader.export_directory = None
+    freeloader.sample_listeners.append(
+        lambda t, position, weight: ring.write(int(t * 1e9), position, weight, freeloader.servo_temperature)
+    )
+
+    last_status = 0.0
+    last_calibration = None
+    while True:
+        now = time.monotonic()
+        if now - last_status >= STATUS_INTERVAL:
+            status = dict(monitor.status) if monitor is not None else {"Dynamixel": "online", "Loadstar": "online"}
+            events.put(("status", status, freeloader.dyna_online, freeloader.cell_online, freeloader.recipe_stage,
+                        runs, freeloader.acquiring()))
+            last_status = now
+
+            # Raw loads cross the ring, so the GUI needs the tare and drift to correct them
+            if freeloader.calibration is not None:
+                calibration = freeloader.calibration.state()
+                if calibration != last_calibration:
+                    events.put(("calibration", calibration))
+                    last_calibration = calibration
+
+        try:
+            command = commands.get(timeout=STATUS_INTERVAL)
+        except queue.Empty:
+            continue
+
+        try:
+            if command[0] == "start":
+                runs += 1
+                freeloader.start_measurement(*command[1:])
+            elif command[0] == "stop":
+                freeloader.stop_measurement()
+            elif command[0] == "speed":
+                freeloader.command_speed(command[1])
+            elif command[0] == "tare":
+                # Answered with the outcome and the new calibration, so the GUI can report it
+                try:
+                    freeloader.tare_load_cell()
+                except FreeloaderError as e:
+                    events.put(("tare", command[1], str(e), None))
+                else:
+                    events.put(("tare", command[1], None, freeloader.calibration.state()))
+            elif command[0] == "quit":
+                break
+        except FreeloaderError as e:
+            events.put(("error", str(e)))
+
+    # Wait for the acquisition threads so nothing writes to the ring after it is closed
+    freeloader.stop_measurement()
+    for thread in freeloader.acquisition_threads:
+        thread.join()
+    if monitor is not None:
+        monitor.stop()
+    if freeloader.dyna_online:
+        freeloader.disconnect_dynamixel()
+    freeloader.disconnect_loadstar()
+    ring.close()
+
+
+class EngineMonitor:
+    """
+    Runs the acquisition process and stands in for DeviceMonitor in the GUI.
+    A drain thread moves samples from the ring into the EngineFreeloader and
+    applies the status and error events the engine sends back.
+    """
+
+    def __init__(self, freeloader, dxl_ids=None, simulate=False):
+        self.freeloader = freeloader
+        self.status = {"Dynamixel": "starting", "Loadstar": "starting"}
+        self.context = multiprocessing.get_context("spawn")
+        self.commands = self.context.Queue()
+        self.events = self.context.Queue()
+        self.ring = SampleRing()
+        self.process = self.context.Process(
+            target=run_engine,
+            args=(self.ring.name, self.commands, self.events,
+                  dxl_ids if dxl_ids is not None else DXL_IDS, simulate),
+            daemon=True,
+        )
+        self.running = False
+        freeloader.engine = self
+
+    def start(self):
+        """ Start the acquisition process and the drain thread """
+        self.running = True
+        self.process.start()
+        threading.Thread(target=self.drain, daemon=True).start()
+
+    def stop(self):
+        """ Ask the engine to shut down, then free the ring """
+        self.running = False
+        self.commands.put(("quit",))
+        self.process.join(timeout=5)
+        self.ring.close()
+        self.ring.unlink()
+
+    def send(self, *command):
+        """ Send a command tuple to the engine """
+        self.commands.put(command)
+
+    def drain(self):
+        """ Thread target that collects samples and events until stop is called """
+        while self.running:
+            # Events are taken before the ring is read, so every sample written
+            # before a status saying the run is over is stored before it is applied
+            events = []
+            while True:
+                try:
+                    events.append(self.events.get_nowait())
+                except queue.Empty:
+                    break
+
+            for t_ns, position, load, temperature in self.ring.read_new():
+                self.freeloader.add_measurement(t_ns / 1e9, position, load)
+                self.freeloader.servo_temperature = temperature
+
+            for event in events:
+                if event[0] == "status":
+                    self.status.update(event[1])
+                    self.freeloader.dyna_online = event[2]
+                    self.freeloader.cell_online = event[3]
+                    self.freeloader.recipe_stage = event[4]
+                    self.freeloader.engine_runs = event[5]
+                    self.freeloader.engine_acquiring = event[6]
+                elif event[0] == "error":
+                    self.freeloader.errors.append(event[1])
+                elif event[0] == "calibration":
+                    if self.freeloader.calibration is None:
+                        self.freeloader.calibration = self.freeloader.load_calibration()
+                    self.freeloader.calibration.restore(event[1])
+                elif event[0] == "tare":
+                    self.freeloader.tare_replies.put(event[1:])
+
+            time.sleep(DRAIN_INTERVAL)
+
+
+class EngineFreeloader(Freeloader):
+    """
+    Freeloader for the GUI process when acquisition runs in the engine.
+    Motion and measurement calls are forwarded to the engine, and
+    measurements is filled from the ring by EngineMonitor, and the run is
+    exported and journaled here as it arrives. Errors sent back by the
+    engine are queued in errors for the Tk thread to show.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.engine = None
+        self.errors = []
+        self.runs_started = 0
+        self.engine_runs = 0  # Start commands the engine has handled, from its status events
+        self.engine_acquiring = False
+        self.tare_replies = queue.Queue()  # (request, error, calibration state) answers to tare commands
+        self.tares_sent = 0
+
+    def start_measurement(self, recipe=None):
+        self.interrupt_flag = False
+        if recipe is not None:
+            from freeloaderrecipes import Recipe
+            self.clear_measurements(Recipe(recipe).capacity())
+            self.engine.send("start", recipe)
+        else:
+            self.clear_measurements()
+            self.engine.send("start")
+        self.runs_started += 1
+        self.start_recording()
+
+    def acquiring(self):
+        # Running until the engine has taken the start command and reported its run over
+        return self.engine_runs < self.runs_started or self.engine_acquiring
+
+    def stop_measurement(self):
+        self.interrupt_flag = True
+        self.engine.send("stop")
+
+    def command_speed(self, speed):
+        # The engine's own MotionController ramps to the speed and owns the bus
+        self.engine.send("speed", speed)
+
+    def tare_load_cell(self):
+        """ Tare in the engine and wait for its answer, raising FreeloaderError if the tare failed """
+        self.tares_sent += 1
+        request = self.tares_sent
+        self.engine.send("tare", request)
+        deadline = time.monotonic() + TARE_REPLY_TIMEOUT
+        while True:
+            try:
+                reply, error, calibration = self.tare_replies.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                raise FreeloaderError("The acquisition process did not answer the tare.")
+            if reply == request:  # Older replies belong to tares already given up on
+                break
+        if error is not None:
+            raise FreeloaderError(error)
+        if self.calibration is None:
+            self.calibration = self.load_calibration()
+        self.calibration.restore(calibration)
+        return self.calibration.tare_offset
+
+
+class EngineGUI(FreeloaderGUI):
+    """ FreeloaderGUI that also shows errors reported by the engine process """
+
+    def refresh_status(self):
+        errors = self.freeloader.errors
+        while errors:
+            self.report_error(errors.pop(0))
+        super().refresh_status()
+
+
+def busy_gui_load(stop, redraw_time=0.05):
+    """ Stand-in for matplotlib redraws: pure-Python work that holds the GIL """
+    while not stop.is_set():
+        end = time.perf_counter() + redraw_time
+        while time.perf_counter() < end:
+            sum(i * i for i in range(1000))
+
+
+def interval_stats(t_ns):
+    """ Mean, 99th percentile and maximum sample interval in milliseconds """
+    intervals = sorted((b - a) / 1e6 for a, b in zip(t_ns, t_ns[1:]))
+    if not intervals:
+        return 0.0, 0.0, 0.0
+    p99 = intervals[min(len(intervals) - 1, int(len(intervals) * 0.99))]
+    return sum(intervals) / len(intervals), p99, intervals[-1]
+
+
+def benchmark(duration=5.0, load_threads=2):
+    """
+    Sample simulated devices for duration seconds with and without GUI-like
+    load, once on threads inside this process and once in the engine
+    process, and print the sample interval statistics of each.
+    """
+    from freeloaderstations import SimulatedFreeloader
+
+    print("mode       load   mean ms   p99 ms   max ms")
+    for mode in ("thread", "process"):
+        for loaded in (False, True):
+            stop = threading.Event()
+            workers = [threading.Thread(target=busy_gui_load, args=(stop,)) for _ in range(load_threads if loaded else 0)]
+
+            if mode == "thread":
+                freeloader = SimulatedFreeloader()
+                freeloader.connect_dynamixel(None, None)
+                freeloader.connect_loadstar(None, None)
+                t_ns = []
+                freeloader.sample_listeners.append(lambda t, position, weight: t_ns.append(int(t * 1e9)))
+                for worker in workers:
+                    worker.start()
+                freeloader.start_measurement()
+                time.sleep(duration)
+                freeloader.stop_measurement()
+            else:
+                # Drain the ring here rather than on a thread so the timestamps are kept
+                freeloader = EngineFreeloader()
+                engine = EngineMonitor(freeloader, simulate=True)
+                engine.process.start()
+                time.sleep(1.0)  # Let the engine process come up
+                for worker in workers:
+                    worker.start()
+                t_ns = []
+                freeloader.start_measurement()
+                end = time.monotonic() + duration
+                while time.monotonic() < end:
+                    t_ns.extend(record[0] for record in engine.ring.read_new())
+                    time.sleep(DRAIN_INTERVAL)
+                freeloader.stop_measurement()
+                engine.stop()
+
+            stop.set()
+            for worker in workers:
+                worker.join()
+
+            mean, p99, worst = interval_stats(t_ns)
+            print("{:9s}  {:4s}  {:8.2f}  {:7.2f}  {:7.2f}".format(mode, "yes" if loaded else "no", mean, p99, worst))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Freeloader GUI with acquisition in a separate process.")
+    parser.add_argument("--benchmark", action="store_true", help="compare sample timing under GUI load")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per benchmark run")
+    parser.add_argument("--simulate", action="store_true", help="use simulated devices")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(duration=args.duration)
+    else:
+        freeloader = EngineFreeloader()
+        engine = EngineMonitor(freeloader, simulate=args.simulate)
+        gui = EngineGUI(freeloader, monitor=engine)
+        gui.start()
@@ -0,0 +1,261 @@
+"""
+freeloaderexport
+
+Columnar export of runs to Parquet for analysis tools and the data
+warehouse. Each file has typed columns
+
+    time        timestamp (us, UTC)
+    position    float64   mm
+    load        float64   calibrated, tared and drift-corrected, in load_unit
+    weight      float64   raw Loadstar reading
+    filtered    float64   load after the load filter, in load_unit
+
+with gap markers stored as nulls. The run's metadata (operator, sample,
+material code, lot, load cell, tare, load unit) is kept in the schema
+rather than in leading rows, and each column's unit in its field metadata.
+
+ParquetRunWriter streams a run to a file while it is acquired, one row
+group per EXPORT_CHUNK_ROWS samples; export_run writes a finished run block
+by block. read_run reads a file back, optionally only some of its columns.
+Run with --benchmark to compare against the CSV written by save_data.
+
+Needs the pyarrow package, which is only imported with this module.
+"""
+
+import argparse
+import csv
+import os
+import queue
+import tempfile
+import threading
+import time
+from array import array
+from datetime import datetime, timezone
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+EXPORT_COLUMNS = ("time", "position", "load", "weight", "filtered")
+
+# Samples per row group, and how often a streaming writer checks whether the run has ended
+EXPORT_CHUNK_ROWS = 65536
+EXPORT_POLL_INTERVAL = 0.5
+
+EXPORT_COMPRESSION = "zstd"
+
+SOFTWARE_VERSION = "freeLoaderGUI_5_9"
+
+
+def run_schema(metadata, load_unit):
+    """ Arrow schema of an exported run, with metadata (a dict of strings) attached """
+    fields = [
+        pa.field("time", pa.timestamp("us", tz="UTC"), nullable=False),
+        pa.field("position", pa.float64(), metadata={"unit": "mm"}),
+        pa.field("load", pa.float64(), metadata={"unit": load_unit}),
+        pa.field("weight", pa.float64(), metadata={"unit": "raw"}),
+        pa.field("filtered", pa.float64(), metadata={"unit": load_unit}),
+    ]
+    schema_metadata = {"software": SOFTWARE_VERSION, "load_unit": load_unit}
+    schema_metadata.update({key: str(value) for key, value in metadata.items()})
+    return pa.schema(fields, metadata=schema_metadata)
+
+
+def calibration_metadata(freeloader):
+    """ Load cell and tare of the freeloader's calibration, as export metadata """
+    if freeloader.calibration is None:
+        freeloader.calibration = freeloader.load_calibration()
+    return {
+        "load_cell": freeloader.calibration.table.cell_id,
+        "tare_offset": freeloader.calibration.tare_offset,
+    }
+
+
+def block_table(schema, freeloader, times, positions, weights, filtered):
+    """ Arrow table of one block of samples, with NaN gap markers as nulls """
+    times = np.asarray(times, dtype=float)
+    loads = freeloader.calibrated_loads(times, weights)
+    return pa.Table.from_arrays([
+        pa.array(np.round(times * 1e6).astype(np.int64), pa.timestamp("us", tz="UTC")),
+        pa.array(np.asarray(positions, dtype=float), from_pandas=True),
+        pa.array(loads, from_pandas=True),
+        pa.array(np.asarray(weights, dtype=float), from_pandas=True),
+        pa.array(np.asarray(filtered, dtype=float), from_pandas=True),
+    ], schema=schema)
+
+
+def load_unit(freeloader):
+    return freeloader.calibration.display_unit if freeloader.calibration is not None else "lb"
+
+
+def export_run(filename, freeloader, metadata):
+    """ Write the freeloader's finished run to a Parquet file, one block of samples at a time """
+    metadata = dict(metadata, **calibration_metadata(freeloader))
+    schema = run_schema(metadata, load_unit(freeloader))
+    with pq.ParquetWriter(filename, schema, compression=EXPORT_COMPRESSION) as writer:
+        for times, positions, weights, filtered in freeloader.measurements.blocks():
+            if len(times):
+                writer.write_table(block_table(schema, freeloader, times, positions, weights, filtered),
+                                   row_group_size=EXPORT_CHUNK_ROWS)
+
+
+class ParquetRunWriter:
+    """
+    Streams a run to a Parquet file while it is acquired. listener() runs on
+    the acquisition thread and only fills preallocated chunk arrays; each
+    full chunk is handed to a writer thread, which calibrates it and writes
+    it as a row group. The file is finished once the run's acquisition
+    threads have all ended, or when close() is called.
+    """
+
+    def __init__(self, filename, freeloader, metadata=None, chunk_rows=EXPORT_CHUNK_ROWS):
+        self.filename = filename
+        self.freeloader = freeloader
+        self.chunk_rows = chunk_rows
+        metadata = dict(metadata or {}, **calibration_metadata(freeloader))
+        metadata["started"] = datetime.now(timezone.utc).isoformat()
+        self.schema = run_schema(metadata, load_unit(freeloader))
+        self.writer = pq.ParquetWriter(filename, self.schema, compression=EXPORT_COMPRESSION)
+        self.chunks = queue.Queue()
+        self.closing = threading.Event()
+        self.rows = 0  # Samples written to the file so far
+        self.new_chunk()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def new_chunk(self):
+        self.columns = [array('d', [0.0]) * self.chunk_rows for _ in range(4)]
+        self.time, self.position, self.weight, self.filtered = self.columns
+        self.count = 0
+
+    def listener(self, t, position, weight):
+        """ Sample listener: add one sample to the current chunk """
+        index = self.count
+        self.time[index] = t
+        self.position[index] = position
+        self.weight[index] = weight
+        self.filtered[index] = self.freeloader.filtered_weight
+        self.count = index + 1
+        if self.count == self.chunk_rows:
+            self.chunks.put((self.columns, self.count))
+            self.new_chunk()
+
+    def start(self):
+        """ Start listening for samples and writing chunks """
+        self.freeloader.sample_listeners.append(self.listener)
+        self.thread.start()
+
+    def write_chunk(self, columns, count):
+        times, positions, weights, filtered = (np.frombuffer(values)[:count] for values in columns)
+        self.writer.write_table(block_table(self.schema, self.freeloader, times, positions, weights, filtered))
+        self.rows += count
+
+    def run(self):
+        """ Thread target that writes each full chunk, then finishes the file when the run is over """
+        while True:
+            try:
+                self.write_chunk(*self.chunks.get(timeout=EXPORT_POLL_INTERVAL))
+            except queue.Empty:
+                if self.closing.is_set() or not self.freeloader.acquiring():
+                    break
+
+        # No samples can arrive once the listener is gone, so the partial chunk is safe to take
+        self.freeloader.sample_listeners.remove(self.listener)
+        while not self.chunks.empty():
+            self.write_chunk(*self.chunks.get())
+        if self.count:
+            self.write_chunk(self.columns, self.count)
+        self.writer.close()
+
+    def close(self):
+        """ Finish the file now, even if the run is still going, and wait for it to be written """
+        self.closing.set()
+        self.thread.join()
+
+
+def read_metadata(filename):
+    """ Metadata of an exported run, read from the file footer alone """
+    metadata = pq.read_schema(filename).metadata or {}
+    return {key.decode(): value.decode() for key, value in metadata.items()}
+
+
+def read_run(filename, columns=None):
+    """
+    Read an exported run. Returns its metadata and a dict of NumPy arrays,
+    for only the named columns if columns is given; only those columns are
+    read from the file. Times are epoch seconds and nulls are NaN.
+    """
+    table = pq.read_table(filename, columns=list(columns) if columns is not None else None)
+    result = {}
+    for name in table.column_names:
+        column = table.column(name)
+        if name == "time":
+            result[name] = column.cast(pa.int64()).to_numpy() / 1e6
+        else:
+            result[name] = column.to_numpy()
+    return read_metadata(filename), result
+
+
+def benchmark(samples=1000000):
+    """
+    Save a simulated run of samples as CSV, the way save_data does, and as
+    Parquet, then compare file size, write time and read time, reading the
+    Parquet file whole and with only the load column.
+    """
+    from freeloaderbuffers import format_timestamp
+    from freeloaderGUI_5_9 import Freeloader
+
+    freeloader = Freeloader()
+    freeloader.clear_measurements(samples)
+    for i in range(samples):
+        freeloader.add_measurement(1.7e9 + i * 0.001, i * 0.0001, (i % 50000) * 0.001)
+
+    with tempfile.TemporaryDirectory() as directory:
+        csv_file = os.path.join(directory, "run.csv")
+        start = time.perf_counter()
+        with open(csv_file, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(["Timestamp", "Position", "Weight", "Tensile Load (lb.)"])
+            for times, positions, weights, filtered in freeloader.measurements.blocks():
+                loads = freeloader.calibrated_loads(times, weights)
+                writer.writerows((format_timestamp(t), position, weight, load)
+                                 for t, position, weight, load in zip(times, positions, weights, loads.tolist()))
+        csv_write = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with open(csv_file, newline='') as file:
+            reader = csv.reader(file)
+            next(reader)
+            loads = [float(row[3]) for row in reader]
+        csv_read = time.perf_counter() - start
+
+        parquet_file = os.path.join(directory, "run.parquet")
+        start = time.perf_counter()
+        export_run(parquet_file, freeloader, {"operator": "XX"})
+        parquet_write = time.perf_counter() - start
+
+        start = time.perf_counter()
+        read_run(parquet_file)
+        parquet_read = time.perf_counter() - start
+
+        start = time.perf_counter()
+        metadata, columns = read_run(parquet_file, ["load"])
+        projected_read = time.perf_counter() - start
+
+        print("{:<22}{:>10}{:>10}{:>10}".format("", "MB", "write s", "read s"))
+        print("{:<22}{:>10.1f}{:>10.3f}{:>10.3f}".format("CSV", os.path.getsize(csv_file) / 1e6, csv_write, csv_read))
+        print("{:<22}{:>10.1f}{:>10.3f}{:>10.3f}".format(
+            "Parquet", os.path.getsize(parquet_file) / 1e6, parquet_write, parquet_read))
+        print("{:<22}{:>10}{:>10}{:>10.3f}".format("Parquet, load only", "", "", projected_read))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Freeloader Parquet export.")
+    parser.add_argument("--benchmark", action="store_true", help="compare size and speed against CSV")
+    parser.add_argument("--samples", type=int, default=1000000)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.samples)
+    else:
+        parser.print_help()
@@ -0,0 +1,173 @@
+"""
+freeloaderfilters
+
+Streaming filters for the load signal. Each filter takes one sample at a
+time through update(value) and returns the filtered value, doing a fixed
+amount of work per sample however long the run is:
+
+    MovingAverage   mean of the last window samples, kept as a running sum
+    MovingMedian    median of the last window samples, from a sorted window
+    LowPass         first-order IIR low-pass with a cutoff in Hz
+
+A NaN sample (a gap in the run) resets the filter and passes through, so
+the filter never smooths across a disconnect. make_filter builds a filter
+from the LOAD_FILTER settings in freeloaderGUI_5_9 and its sample rate.
+Run with --benchmark for the per-sample cost of each filter against a
+1 kHz sample period.
+"""
+
+import argparse
+import bisect
+import math
+import random
+import time
+from collections import deque
+
+
+class MovingAverage:
+    """ Mean of the last window samples """
+
+    def __init__(self, window=8):
+        self.window = window
+        self.samples = deque()
+        self.total = 0.0
+
+    def reset(self):
+        self.samples.clear()
+        self.total = 0.0
+
+    def update(self, value):
+        if math.isnan(value):
+            self.reset()
+            return value
+        self.samples.append(value)
+        self.total += value
+        if len(self.samples) > self.window:
+            self.total -= self.samples.popleft()
+        return self.total / len(self.samples)
+
+
+class MovingMedian:
+    """
+    Median of the last window samples. The window is kept sorted next to
+    the arrival order, so each sample costs a bounded search and shift.
+    """
+
+    def __init__(self, window=5):
+        self.window = window
+        self.samples = deque()
+        self.ordered = []
+
+    def reset(self):
+        self.samples.clear()
+        self.ordered = []
+
+    def update(self, value):
+        if math.isnan(value):
+            self.reset()
+            return value
+        self.samples.append(value)
+        bisect.insort(self.ordered, value)
+        if len(self.samples) > self.window:
+            del self.ordered[bisect.bisect_left(self.ordered, self.samples.popleft())]
+        middle = len(self.ordered) // 2
+        if len(self.ordered) % 2:
+            return self.ordered[middle]
+        return (self.ordered[middle - 1] + self.ordered[middle]) / 2
+
+
+class LowPass:
+    """
+    First-order IIR low-pass filter for samples taken at sample_rate Hz.
+    The rate has no default: the smoothing depends on it, and the right
+    value is the acquisition rate, not the benchmark's 1 kHz.
+    """
+
+    def __init__(self, cutoff, sample_rate):
+        self.cutoff = cutoff
+        self.sample_rate = sample_rate
+        rc = 1 / (2 * math.pi * cutoff)
+        dt = 1 / sample_rate
+        self.alpha = dt / (rc + dt)
+        self.output = None
+
+    def reset(self):
+        self.output = None
+
+    def update(self, value):
+        if math.isnan(value):
+            self.reset()
+            return value
+        if self.output is None:
+            self.output = value
+        else:
+            self.output += self.alpha * (value - self.output)
+        return self.output
+
+
+class PassThrough:
+    """ Filter that leaves samples unchanged """
+
+    def reset(self):
+        pass
+
+    def update(self, value):
+        return value
+
+
+FILTERS = {
+    "none": PassThrough,
+    "average": MovingAverage,
+    "median": MovingMedian,
+    "lowpass": LowPass,
+}
+
+
+def make_filter(kind, acquisition_rate, **settings):
+    """
+    Build the filter named kind in FILTERS with its keyword settings.
+    acquisition_rate, in Hz, is the sample_rate of the filters that depend
+    on one unless the settings give their own.
+    """
+    if kind not in FILTERS:
+        raise ValueError(f"Unknown load filter '{kind}'.")
+    if FILTERS[kind] is LowPass:
+        settings.setdefault("sample_rate", acquisition_rate)
+    return FILTERS[kind](**settings)
+
+
+def benchmark(samples=100000, rate=1000.0):
+    """
+    Push samples of a noisy step through each filter and print the mean
+    cost per sample and the share of a 1/rate second sample period it uses.
+    """
+    signal = [(1.0 if i > samples // 2 else 0.0) + random.gauss(0, 0.05) for i in range(samples)]
+    filters = {
+        "average(8)": MovingAverage(8),
+        "median(5)": MovingMedian(5),
+        "median(51)": MovingMedian(51),
+        f"lowpass(5 Hz @ {rate:.0f} Hz)": LowPass(5.0, rate),
+    }
+
+    period_ns = 1e9 / rate
+    print("{:<26}{:>12}{:>14}".format("filter", "ns/sample", "of period"))
+    for name, load_filter in filters.items():
+        update = load_filter.update
+        start = time.perf_counter_ns()
+        for value in signal:
+            update(value)
+        cost = (time.perf_counter_ns() - start) / samples
+        print("{:<26}{:>12.0f}{:>14.3%}".format(name, cost, cost / period_ns))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Freeloader load signal filters.")
+    parser.add_argument("--benchmark", action="store_true", help="per-sample cost of each filter")
+    parser.add_argument("--samples", type=int, default=100000, help="samples to filter in the benchmark")
+    parser.add_argument("--rate", type=float, default=1000.0, help="sample rate in Hz to compare against")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.samples, args.rate)
+    else:
+        parser.print_help()
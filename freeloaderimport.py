@@ -0,0 +1,292 @@
+"""
+freeloaderimport
+
+Reads runs saved by any version of the freeloader software into the
+columnar form used by freeloaderexport.read_run and freeloaderarchive:
+metadata and a dict of NumPy arrays
+
+    time        epoch seconds
+    position    motor position, in mm or raw counts (see position_unit)
+    weight      raw Loadstar reading
+    load        calibrated load where the file has one, otherwise weight
+
+The layout is recognised from the column header, wherever it is:
+
+    gui_5_9     Freeloader.save_data: "freeLoaderGUI_4_0" banner and
+                metadata rows, then Timestamp, Position (mm), Weight and,
+                in newer files, the calibrated load
+    gui_3_8_6   export_measurements of freeloaderGUI_3_8_6: metadata rows,
+                then Timestamp, Weight (LB), Motor Position (counts)
+    basic       freeloaderbasic2_7_2 text files: "Timestamp, Position, Load"
+                with compact timestamps and positions in counts
+
+Sample rows are parsed in bulk rather than row by row: line and field
+boundaries are found with NumPy, each distinct timestamp is parsed once
+(many samples share each whole second) and the numeric fields are handed
+to NumPy's C float parser in one call. Files with rows it cannot parse
+that way, such as the "None" loads the basic script writes when a reading
+fails, are read row by row instead, with unreadable fields as NaN.
+
+Run with --benchmark to time a simulated 1M sample file of each layout.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import warnings
+from datetime import datetime
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+from freeloaderbuffers import TIMESTAMP_FORMAT
+from freeloadercalibration import UNIT_LABELS
+
+
+# Metadata rows written above the samples, and the keys they are read into
+METADATA_ROWS = {
+    "Operator Initials": "operator",
+    "Sample Name": "sample",
+    "Material Code": "material",
+    "Lot #": "lot",
+    "Selected Option": "sample_type",
+    "Load Cell": "load_cell",
+    "Tare Offset": "tare_offset",
+}
+
+# Layout name to its column names, timestamp format and position unit
+LEGACY_LAYOUTS = {
+    "gui_5_9": (("time", "position", "weight", "load"), TIMESTAMP_FORMAT, "mm"),
+    "gui_3_8_6": (("time", "weight", "position"), TIMESTAMP_FORMAT, "counts"),
+    "basic": (("time", "position", "load"), "%Y%m%d%H%M%S", "counts"),
+}
+
+# Lines read looking for the column header before a file is given up on
+HEADER_LINES = 50
+
+
+def parse_timestamp(text, timestamp_format=TIMESTAMP_FORMAT):
+    """ Epoch seconds of a saved timestamp, in local time """
+    return datetime.strptime(text, timestamp_format).timestamp()
+
+
+def header_layout(fields):
+    """ Layout name and load unit of a column header row, or (None, None) if it is not one """
+    fields = [field.strip() for field in fields]
+    if not fields or fields[0] != "Timestamp":
+        return None, None
+    if fields[1:3] == ["Weight (LB)", "Motor Position"]:
+        return "gui_3_8_6", "lb"
+    if fields[1:3] == ["Position", "Load"]:
+        return "basic", "lb"
+    if fields[1:3] == ["Position", "Weight"]:
+        unit = "lb"
+        if len(fields) > 3:
+            # The calibrated load column is headed "Tensile Load (<unit label>)"
+            label = fields[3][fields[3].rfind("(") + 1:].rstrip(")")
+            unit = next((name for name, unit_label in UNIT_LABELS.items() if unit_label == label), "lb")
+        return "gui_5_9", unit
+    return None, None
+
+
+def read_header(file):
+    """
+    Read the lines of a saved run from an open binary file up to and
+    including its column header. Returns (metadata, layout, load unit,
+    column count) and leaves the file at the first sample row. Raises
+    ValueError if no known header is found.
+    """
+    metadata = {}
+    for _ in range(HEADER_LINES):
+        line = file.readline()
+        if not line:
+            break
+        fields = line.decode("utf-8", "replace").rstrip("\r\n").split(",")
+        layout, unit = header_layout(fields)
+        if layout is not None:
+            return metadata, layout, unit, len(fields)
+        if len(fields) >= 2 and fields[0] in METADATA_ROWS:
+            metadata[METADATA_ROWS[fields[0]]] = fields[1]
+    raise ValueError("No sample header found.")
+
+
+def bulk_timestamps(data, starts, width, timestamp_format):
+    """
+    Epoch seconds of the width-byte timestamps at starts in data. Only the
+    first of each run of identical timestamps is parsed.
+    """
+    # Compare timestamps as three overlapping 8-byte words read straight out of data
+    words = np.ndarray((len(data) - 7,), dtype="<u8", buffer=data, strides=(1,))
+    keys = np.stack([words[starts], words[starts + width // 2 - 4], words[starts + width - 8]], axis=1)
+    changed = np.ones(len(starts), dtype=bool)
+    changed[1:] = (keys[1:] != keys[:-1]).any(axis=1)
+    first = np.flatnonzero(changed)
+    seconds = np.array([parse_timestamp(data[start:start + width].tobytes().decode(), timestamp_format)
+                        for start in starts[first]])
+    return np.repeat(seconds, np.diff(np.append(first, len(starts))))
+
+
+def bulk_rows(data, columns, timestamp_format):
+    """
+    Parse sample rows, given as a uint8 array of their bytes, each a
+    timestamp and columns - 1 numbers. Returns (times, numbers) with
+    numbers shaped (rows, columns - 1), or None if the rows are not all
+    laid out alike and parseable.
+    """
+    newlines = np.flatnonzero(data == ord("\n"))
+    starts = np.concatenate(([0], newlines + 1))
+    if starts[-1] >= len(data):
+        starts = starts[:-1]
+
+    # Timestamps are written zero-padded, so every row's first comma is in the same place
+    width = data[:newlines[0] if len(newlines) else len(data)].tobytes().find(b",")
+    if width < 8 or (starts[-1] + width >= len(data)) or (data[starts + width] != ord(",")).any():
+        return None
+
+    # Blank each timestamp and its comma out and run the numbers of every row together as one list.
+    # NumPy's C parser reads past the given length up to a NUL, so one follows the parsed text.
+    text = np.zeros(len(data) + 1, dtype=np.uint8)
+    text[:-1] = data
+    as_strided(text, (len(data) - width, width + 1), (1, 1))[starts] = ord(" ")
+    text[newlines] = ord(",")
+    with warnings.catch_warnings():
+        # Unparseable text raises, or in older NumPy ends the parse early with
+        # a warning, which the count check catches
+        warnings.simplefilter("ignore")
+        try:
+            values = np.fromstring(text[:-1], sep=",")
+        except ValueError:
+            return None
+    if len(values) != len(starts) * (columns - 1):
+        return None
+
+    try:
+        times = bulk_timestamps(data, starts, width, timestamp_format)
+    except ValueError:
+        return None
+    return times, values.reshape(len(starts), columns - 1)
+
+
+def row_by_row(data, columns, timestamp_format):
+    """ The slow path of bulk_rows for files it cannot parse: rows that are too short are skipped """
+    times, numbers = [], []
+    for line in bytes(data).decode("utf-8", "replace").splitlines():
+        fields = line.split(",")
+        if len(fields) < columns:
+            continue
+        try:
+            t = parse_timestamp(fields[0].strip(), timestamp_format)
+        except ValueError:
+            continue
+        row = []
+        for field in fields[1:columns]:
+            try:
+                row.append(float(field))
+            except ValueError:
+                row.append(np.nan)
+        times.append(t)
+        numbers.append(row)
+    return np.array(times), np.array(numbers).reshape(len(numbers), columns - 1)
+
+
+def read_rows(filename):
+    """
+    Header and sample bytes of a saved run: (metadata, layout, load unit,
+    column count, uint8 array of the sample rows without trailing blanks)
+    """
+    with open(filename, 'rb') as file:
+        metadata, layout, unit, columns = read_header(file)
+        data = np.frombuffer(file.read(), dtype=np.uint8)
+    end = len(data)
+    while end and data[end - 1] in b"\r\n \t":
+        end -= 1
+    return metadata, layout, unit, min(columns, len(LEGACY_LAYOUTS[layout][0])), data[:end]
+
+
+def import_run(filename):
+    """
+    Read a run saved in any of LEGACY_LAYOUTS. Returns its metadata, with
+    the layout, load_unit and position_unit added, and a dict of NumPy
+    arrays of time, position, weight and load.
+    """
+    metadata, layout, unit, columns, data = read_rows(filename)
+    names, timestamp_format, position_unit = LEGACY_LAYOUTS[layout]
+    parsed = bulk_rows(data, columns, timestamp_format) if len(data) else (np.array([]), np.empty((0, columns - 1)))
+    if parsed is None:
+        parsed = row_by_row(data, columns, timestamp_format)
+    times, numbers = parsed
+
+    run = {"time": times}
+    for index, name in enumerate(names[1:columns]):
+        run[name] = numbers[:, index]
+    # Files without a calibrated load column hold raw Loadstar readings
+    if "load" not in run:
+        run["load"] = run["weight"]
+    if "weight" not in run:
+        run["weight"] = run["load"]
+
+    metadata.update(layout=layout, load_unit=unit, position_unit=position_unit)
+    return metadata, run
+
+
+def write_example(filename, layout, samples):
+    """ Write a simulated 1 kHz pull in one of LEGACY_LAYOUTS """
+    names, timestamp_format, position_unit = LEGACY_LAYOUTS[layout]
+    times = 1.7e9 + np.arange(samples) * 0.001
+    positions = np.arange(samples) * (104 / (4095 * 40)) if position_unit == "mm" else np.arange(samples) % 4096
+    weights = np.round(positions * 0.01 + np.random.normal(0, 0.05, samples), 3)
+    stamps = [datetime.fromtimestamp(t).strftime(timestamp_format) for t in times[::1000]]
+
+    with open(filename, 'w', newline='') as file:
+        if layout == "gui_5_9":
+            file.write("freeLoaderGUI_4_0\r\nOperator Initials,XX\r\nSample Name,example\r\n"
+                       "Timestamp,Position,Weight,Tensile Load (lb.)\r\n")
+            rows = zip(positions.tolist(), weights.tolist(), (weights * 1.01).tolist())
+            file.writelines("{},{},{},{}\r\n".format(stamps[i // 1000], p, w, l) for i, (p, w, l) in enumerate(rows))
+        elif layout == "gui_3_8_6":
+            file.write("Version: freeLoaderGUI_4_0\r\nOperator Initials,XX\r\nTimestamp,Weight (LB),Motor Position\r\n")
+            rows = zip(weights.tolist(), positions.tolist())
+            file.writelines("{},{},{}\r\n".format(stamps[i // 1000], w, p) for i, (w, p) in enumerate(rows))
+        else:
+            file.write("Timestamp, Position, Load\n")
+            rows = zip(positions.tolist(), weights.tolist())
+            file.writelines("{}, {}, {}\n".format(stamps[i // 1000], p, w) for i, (p, w) in enumerate(rows))
+
+
+def benchmark(samples=1000000):
+    """
+    Write a simulated run in each layout and time importing it. Fails if any
+    of them was not parsed in bulk, as the row-by-row path is many times slower.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        for layout in LEGACY_LAYOUTS:
+            filename = os.path.join(directory, layout + ".csv")
+            write_example(filename, layout, samples)
+            start = time.perf_counter()
+            metadata, run = import_run(filename)
+            elapsed = time.perf_counter() - start
+            metadata, layout, unit, columns, data = read_rows(filename)
+            bulk = bulk_rows(data, columns, LEGACY_LAYOUTS[layout][1]) is not None
+            print("{:<10}{:>9.1f} MB{:>10} rows in {:.3f} s, {}".format(
+                layout, os.path.getsize(filename) / 1e6, len(run["time"]), elapsed, "bulk" if bulk else "ROW BY ROW"))
+            if not bulk:
+                raise SystemExit(f"The {layout} layout fell back to the row-by-row parser.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Freeloader legacy run import.")
+    parser.add_argument("files", nargs="*", help="saved runs to identify and summarise")
+    parser.add_argument("--benchmark", action="store_true", help="time importing a simulated run of each layout")
+    parser.add_argument("--samples", type=int, default=1000000)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.samples)
+    elif args.files:
+        for filename in args.files:
+            metadata, run = import_run(filename)
+            print("{}: {} layout, {} samples, load in {}, position in {}".format(
+                filename, metadata["layout"], len(run["time"]), metadata["load_unit"], metadata["position_unit"]))
+    else:
+        parser.print_help()
@@ -0,0 +1,244 @@
+"""
+freeloaderjournal
+
+Crash recovery for the run being acquired. A JournalWriter appends the
+run's samples to a journal file every JOURNAL_FLUSH_INTERVAL seconds while
+the run goes on, after a state record holding the operator, sample,
+material, lot and sample type typed in for it and the load cell's tare.
+The journal is deleted once the run is saved, so one found when the GUI
+starts belongs to a run that was lost to a crash or a closed window.
+read_journal reads it back as whole columns, ready to drop into a
+RunBuffer, so restoring a run takes as long as reading the file rather
+than as long as acquiring it again.
+
+The file is JOURNAL_MAGIC followed by records, each a kind (1 byte),
+payload length (u32) and CRC-32 of the payload (u32), then the payload:
+
+    S   state, as JSON; a later state record replaces an earlier one
+    B   a batch of samples: the time, position, weight and filtered
+        columns as doubles, one after the other
+
+A record cut short by a crash fails its length or CRC check, and it and
+anything after it are ignored.
+
+Run with --benchmark to time journaling and restoring a simulated run.
+"""
+
+import argparse
+import json
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from array import array
+
+from freeloaderbuffers import COLUMNS
+
+
+JOURNAL_MAGIC = b"FLJRNL1\n"
+RECORD = struct.Struct("<cII")
+
+# Seconds between appends to the journal, and samples gathered per chunk
+# before the acquisition thread hands them over
+JOURNAL_FLUSH_INTERVAL = 0.5
+JOURNAL_CHUNK_ROWS = 8192
+
+ROW_BYTES = 8 * len(COLUMNS)
+
+
+class JournalWriter:
+    """
+    Journals a run to filename while it is acquired. listener() runs on the
+    acquisition thread and only fills preallocated chunk arrays; a writer
+    thread appends whatever has arrived every JOURNAL_FLUSH_INTERVAL
+    seconds. The journal is finished, with the final tare in a last state
+    record, once the run's acquisition threads have all ended or when
+    close() is called.
+    """
+
+    def __init__(self, filename, freeloader, metadata=None, chunk_rows=JOURNAL_CHUNK_ROWS):
+        self.filename = filename
+        self.freeloader = freeloader
+        self.chunk_rows = chunk_rows
+        self.state = {"started": time.time(), "metadata": dict(metadata or {})}
+        self.lock = threading.Lock()  # Held while a full chunk is swapped for a new one
+        self.full = []  # Full chunks not yet journaled, oldest first
+        self.written = 0  # Samples of the oldest unjournaled chunk already in the file
+        self.closing = threading.Event()
+        self.new_chunk()
+        self.file = open(filename, 'wb')
+        self.file.write(JOURNAL_MAGIC)
+        self.write_state()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def new_chunk(self):
+        self.columns = [array('d', [0.0]) * self.chunk_rows for _ in COLUMNS]
+        self.time, self.position, self.weight, self.filtered = self.columns
+        self.count = 0
+
+    def listener(self, t, position, weight):
+        """ Sample listener: add one sample to the current chunk """
+        index = self.count
+        self.time[index] = t
+        self.position[index] = position
+        self.weight[index] = weight
+        self.filtered[index] = self.freeloader.filtered_weight
+        self.count = index + 1
+        if self.count == self.chunk_rows:
+            with self.lock:
+                self.full.append(self.columns)
+                self.new_chunk()
+
+    def start(self):
+        """ Start listening for samples and journaling them """
+        self.freeloader.sample_listeners.append(self.listener)
+        self.thread.start()
+
+    def write_record(self, kind, payload):
+        self.file.write(RECORD.pack(kind, len(payload), zlib.crc32(payload)) + payload)
+
+    def write_state(self):
+        calibration = self.freeloader.calibration
+        if calibration is not None:
+            self.state["load_cell"] = calibration.table.cell_id
+            self.state["calibration"] = calibration.state()
+        self.write_record(b"S", json.dumps(self.state).encode())
+
+    def write_batch(self, columns, start, end):
+        if end > start:
+            self.write_record(b"B", b"".join(values[start:end].tobytes() for values in columns))
+
+    def flush(self):
+        """ Append every sample that has arrived since the last flush and push it to disk """
+        with self.lock:
+            full, self.full = self.full, []
+            columns, count = self.columns, self.count
+        for chunk in full:
+            self.write_batch(chunk, self.written, self.chunk_rows)
+            self.written = 0
+        self.write_batch(columns, self.written, count)
+        self.written = count
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def run(self):
+        """ Thread target that flushes on an interval, then finishes the journal when the run is over """
+        while not self.closing.wait(JOURNAL_FLUSH_INTERVAL) and self.freeloader.acquiring():
+            self.flush()
+
+        # No samples can arrive once the listener is gone, so the last chunk is safe to take
+        self.freeloader.sample_listeners.remove(self.listener)
+        self.flush()
+        self.write_state()
+        self.file.close()
+
+    def close(self):
+        """ Finish the journal now, even if the run is still going, and wait for it to be written """
+        self.closing.set()
+        self.thread.join()
+
+
+def read_records(file, skip_batches=False):
+    """ Yield (kind, payload) of each intact record; with skip_batches, batches give their length instead """
+    if file.read(len(JOURNAL_MAGIC)) != JOURNAL_MAGIC:
+        raise ValueError("Not a run journal.")
+    size = os.fstat(file.fileno()).st_size
+    while True:
+        header = file.read(RECORD.size)
+        if len(header) < RECORD.size:
+            return
+        kind, length, crc = RECORD.unpack(header)
+        if file.tell() + length > size:
+            return
+        if kind == b"B" and skip_batches:
+            file.seek(length, os.SEEK_CUR)
+            yield kind, length
+            continue
+        payload = file.read(length)
+        if zlib.crc32(payload) != crc:
+            return
+        yield kind, payload
+
+
+def journal_summary(filename):
+    """
+    (state, sample count) of the journal at filename, read without its
+    samples, or None if there is no readable journal there.
+    """
+    try:
+        with open(filename, 'rb') as file:
+            state, samples = None, 0
+            for kind, payload in read_records(file, skip_batches=True):
+                if kind == b"S":
+                    state = json.loads(payload)
+                elif kind == b"B":
+                    samples += payload // ROW_BYTES
+    except (OSError, ValueError):
+        return None
+    return (state, samples) if state is not None else None
+
+
+def read_journal(filename):
+    """
+    Read a journal. Returns its latest state dict and the time, position,
+    weight and filtered columns of every intact batch as arrays of doubles.
+    Raises ValueError if the file is not a journal.
+    """
+    state = None
+    columns = [array('d') for _ in COLUMNS]
+    with open(filename, 'rb') as file:
+        for kind, payload in read_records(file):
+            if kind == b"S":
+                state = json.loads(payload)
+            elif kind == b"B":
+                rows = len(payload) // ROW_BYTES
+                for index, values in enumerate(columns):
+                    values.frombytes(payload[index * rows * 8:(index + 1) * rows * 8])
+    if state is None:
+        raise ValueError("The run journal has no state record.")
+    return state, columns
+
+
+def benchmark(samples=1000000):
+    """
+    Journal a simulated run of samples through Freeloader.add_measurement,
+    then time restoring it into a fresh Freeloader.
+    """
+    from freeloaderGUI_5_9 import Freeloader
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "journal.bin")
+        freeloader = Freeloader()
+        freeloader.clear_measurements(samples)
+        freeloader.acquiring = lambda: True  # There are no acquisition threads; close() ends the journal
+        writer = JournalWriter(filename, freeloader, {"operator": "XX", "sample": "benchmark"})
+        writer.start()
+        start = time.perf_counter()
+        for i in range(samples):
+            freeloader.add_measurement(1.7e9 + i * 0.001, i * 0.0001, (i % 50000) * 0.001)
+        acquired = time.perf_counter() - start
+        writer.close()
+        print("{} samples acquired in {:.2f} s with journaling, {:.1f} MB journal".format(
+            samples, acquired, os.path.getsize(filename) / 1e6))
+
+        start = time.perf_counter()
+        state, count = journal_summary(filename)
+        print("summary read in {:.3f} s: {} samples".format(time.perf_counter() - start, count))
+        start = time.perf_counter()
+        restored = Freeloader()
+        restored.restore_journal(filename)
+        print("restored {} samples in {:.3f} s".format(len(restored.measurements), time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Freeloader run recovery journal.")
+    parser.add_argument("--benchmark", action="store_true", help="time journaling and restoring a simulated run")
+    parser.add_argument("--samples", type=int, default=1000000)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.samples)
+    else:
+        parser.print_help()
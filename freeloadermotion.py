@@ -0,0 +1,271 @@
+"""
+freeloadermotion
+
+Speed profiles for the Dynamixel in wheel mode. Rather than jumping
+straight to a new moving speed, which jerks the sample at the start of a
+pull and overshoots on the way back, a MotionController ramps to it along
+the shortest profile the limits allow:
+
+    trapezoid   acceleration held at MOTION_ACCEL until the new speed is
+                reached (jerk None)
+    S-curve     acceleration itself ramped up and down at MOTION_JERK, so
+                the load on the sample changes smoothly
+
+Setpoints are taken at a fixed MOTION_CONTROL_HZ on a grid measured from
+the start of each ramp, so the same command always produces the same
+setpoints, and a setpoint is only written when it differs from the last
+one written once rounded to whole speed units. Ticks missed to a slow
+write are skipped rather than caught up back to back, and a ramp resumed
+after a failed write is planned afresh from the speed last written. The
+controller's thread is the only writer of ADDR_MX_MOVING_SPEED while it is
+in use.
+
+Speeds are moving speed register values as Freeloader.set_speed takes
+them: 0 to 1023 turning counterclockwise, with CLOCKWISE added for
+clockwise turning. Internally they are signed, clockwise positive.
+
+Run with --check to compare each profile against a bare set_speed for the
+speed changes a pull makes.
+"""
+
+import argparse
+import math
+import threading
+import time
+
+
+MAX_SPEED_UNITS = 1023
+CLOCKWISE = 1024  # Speed register flag for clockwise turning
+
+# Setpoints written per second while ramping
+MOTION_CONTROL_HZ = 50.0
+
+# Acceleration limit in speed units per second, and jerk limit in speed
+# units per second squared (None for trapezoidal ramps)
+MOTION_ACCEL = 4000.0
+MOTION_JERK = 40000.0
+
+
+def signed_speed(speed):
+    """ Signed speed units, clockwise positive, of a moving speed register value """
+    units = speed & MAX_SPEED_UNITS
+    return units if speed & CLOCKWISE else -units
+
+
+def register_speed(units):
+    """ Moving speed register value of signed speed units """
+    units = max(-MAX_SPEED_UNITS, min(MAX_SPEED_UNITS, round(units)))
+    return units | CLOCKWISE if units > 0 else -units
+
+
+def ramp_time(change, accel=MOTION_ACCEL, jerk=MOTION_JERK):
+    """ Shortest time in seconds to change speed by change units within the acceleration and jerk limits """
+    change = abs(change)
+    if jerk is None:
+        return change / accel
+    if change >= accel * accel / jerk:
+        return change / accel + accel / jerk
+    # Too small a change to reach full acceleration before easing off again
+    return 2 * math.sqrt(change / jerk)
+
+
+def ramp_speed(start, end, elapsed, accel=MOTION_ACCEL, jerk=MOTION_JERK):
+    """ Signed speed elapsed seconds into the shortest ramp from start to end """
+    change = abs(end - start)
+    total = ramp_time(change, accel, jerk)
+    if elapsed >= total:
+        return end
+    if jerk is None:
+        done = accel * elapsed
+    else:
+        peak = min(accel, math.sqrt(change * jerk))  # Highest acceleration the ramp reaches
+        rise = peak / jerk
+        if elapsed < rise:
+            done = jerk * elapsed * elapsed / 2
+        elif elapsed < total - rise:
+            done = peak * peak / (2 * jerk) + peak * (elapsed - rise)
+        else:
+            remaining = total - elapsed
+            done = change - jerk * remaining * remaining / 2
+    return start + math.copysign(done, end - start)
+
+
+def speed_profile(start, end, accel=MOTION_ACCEL, jerk=MOTION_JERK, control_hz=MOTION_CONTROL_HZ):
+    """
+    Setpoints of the ramp from speed register value start to end, as a list
+    of (seconds from the start of the ramp, register value), one per
+    control tick at most and only where the value changes.
+    """
+    start, end = signed_speed(start), signed_speed(end)
+    ticks = math.ceil(ramp_time(end - start, accel, jerk) * control_hz)
+    setpoints = []
+    written = register_speed(start)
+    for tick in range(1, ticks + 1):
+        speed = register_speed(ramp_speed(start, end, tick / control_hz, accel, jerk))
+        if speed != written:
+            setpoints.append((tick / control_hz, speed))
+            written = speed
+    return setpoints
+
+
+class MotionController:
+    """
+    The one writer of a Freeloader's moving speed. command() may be called
+    from any thread and returns at once; the controller's thread then
+    ramps to the new speed, writing each setpoint through
+    freeloader.write_setpoint. A command given mid-ramp ramps on from
+    wherever the current ramp has got to.
+    """
+
+    def __init__(self, freeloader, accel=MOTION_ACCEL, jerk=MOTION_JERK, control_hz=MOTION_CONTROL_HZ):
+        self.freeloader = freeloader
+        self.accel = accel
+        self.jerk = jerk
+        self.control_hz = control_hz
+        self.condition = threading.Condition()
+        self.speed = 0.0  # Signed setpoint of the latest control tick
+        self.target = 0.0  # Signed speed being ramped to
+        self.ramp_from = 0.0
+        self.ramp_started = None  # perf_counter time the current ramp started, None once it is done
+        self.ticks = 0  # Control ticks into the current ramp
+        self.written = 0  # Register value last written, None to write the next setpoint regardless
+        self.writes = 0
+        self.failed = False  # The last write failed; wait for a new command or resend()
+        self.thread = None
+
+    def command(self, speed):
+        """ Ramp to moving speed register value speed """
+        target = signed_speed(speed)
+        with self.condition:
+            if target == self.target and not self.failed:
+                if self.ramp_started is not None or self.written == speed:
+                    return
+            self.target = target
+            self.plan()
+            self.wake()
+
+    def resend(self):
+        """ Write the current setpoint again on the next tick, e.g. once a lost servo is back """
+        with self.condition:
+            self.plan()
+            self.written = None
+            self.wake()
+
+    def plan(self):
+        """
+        Start a ramp to target from the latest setpoint, or from the speed
+        last written if the last write failed; call with the condition held
+        """
+        if self.failed and self.written is not None:
+            self.speed = float(signed_speed(self.written))
+        self.failed = False
+        self.ticks = 0
+        if self.speed != self.target:
+            self.ramp_from = self.speed
+            self.ramp_started = time.perf_counter()
+        else:
+            self.ramp_started = None
+
+    def wake(self):
+        """ Start the thread the first time it is needed, or wake it up; call with the condition held """
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        self.condition.notify()
+
+    def idle(self):
+        return self.failed or (self.ramp_started is None and self.written == register_speed(self.speed))
+
+    def ramping(self):
+        """ Whether a ramp is still under way """
+        with self.condition:
+            return self.ramp_started is not None
+
+    def braking_distance(self):
+        """ Travel, in speed units times seconds, of a ramp from the current setpoint down to a stop """
+        with self.condition:
+            speed = abs(self.speed)
+        return speed * ramp_time(speed, self.accel, self.jerk) / 2
+
+    def run(self):
+        """ Thread target that writes one setpoint per control tick while there is one to write """
+        while True:
+            with self.condition:
+                while self.idle():
+                    self.condition.wait()
+                deadline = None
+                if self.ramp_started is not None:
+                    deadline = self.ramp_started + (self.ticks + 1) / self.control_hz
+
+            if deadline is not None:
+                time.sleep(max(0.0, deadline - time.perf_counter()))
+
+            with self.condition:
+                if self.idle():
+                    continue
+                if self.ramp_started is not None:
+                    now = time.perf_counter()
+                    if now < self.ramp_started + (self.ticks + 1) / self.control_hz:
+                        continue  # Replanned while asleep
+                    # The latest tick due, skipping any missed rather than writing them back to back
+                    self.ticks = max(self.ticks + 1, int((now - self.ramp_started) * self.control_hz))
+                    elapsed = self.ticks / self.control_hz
+                    self.speed = ramp_speed(self.ramp_from, self.target, elapsed, self.accel, self.jerk)
+                    if self.speed == self.target:
+                        self.ramp_started = None
+                speed = register_speed(self.speed)
+                write = speed != self.written
+
+            if write:
+                written = self.freeloader.write_setpoint(speed)
+                with self.condition:
+                    if written:
+                        self.written = speed
+                        self.writes += 1
+                    else:
+                        self.failed = True
+
+
+def check(accel=MOTION_ACCEL, jerk=MOTION_JERK, control_hz=MOTION_CONTROL_HZ):
+    """
+    For each speed change of a pull, print how long each profile takes,
+    how many writes it makes and its largest step between setpoints, and
+    check that the setpoints stay within the acceleration limit and come
+    out the same every time. Returns True if every check passed.
+    """
+    changes = [("start pull", 0, 1016 | CLOCKWISE), ("stop pull", 1016 | CLOCKWISE, 0),
+               ("return", 0, 1020), ("reverse", 1016 | CLOCKWISE, 1020), ("creep nudge", 0, 3 | CLOCKWISE)]
+    passed = True
+    print("{:<12}{:<10}{:>8}{:>8}{:>12}".format("change", "profile", "ms", "writes", "max step"))
+    for name, start, end in changes:
+        for profile, profile_jerk in (("step", None), ("trapezoid", None), ("S-curve", jerk)):
+            if profile == "step":
+                setpoints = [(0.0, end)]
+            else:
+                setpoints = speed_profile(start, end, accel, profile_jerk, control_hz)
+                passed &= setpoints == speed_profile(start, end, accel, profile_jerk, control_hz)
+            speeds = [signed_speed(start)] + [signed_speed(speed) for t, speed in setpoints]
+            largest = max(abs(b - a) for a, b in zip(speeds, speeds[1:]))
+            if profile != "step":
+                # One tick's worth of acceleration, plus a unit for rounding
+                passed &= largest <= accel / control_hz + 1
+                passed &= setpoints[-1][1] == end
+            print("{:<12}{:<10}{:>8.0f}{:>8}{:>12}".format(
+                name, profile, setpoints[-1][0] * 1000, len(setpoints), largest))
+    print("all checks passed" if passed else "CHECKS FAILED")
+    return passed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Freeloader motion profiles.")
+    parser.add_argument("--check", action="store_true", help="compare and check the profiles of a pull")
+    parser.add_argument("--accel", type=float, default=MOTION_ACCEL)
+    parser.add_argument("--jerk", type=float, default=MOTION_JERK)
+    parser.add_argument("--control-hz", type=float, default=MOTION_CONTROL_HZ)
+    args = parser.parse_args()
+
+    if args.check:
+        if not check(args.accel, args.jerk, args.control_hz):
+            raise SystemExit(1)
+    else:
+        parser.print_help()
@@ -0,0 +1,284 @@
+"""
+freeloaderoverlay
+
+Archived runs to compare against the live one. A RunArchive indexes the
+runs saved in one folder, in any layout freeloaderimport reads as well as
+Parquet exports and .flrun archives, by their metadata (operator, sample,
+material code, lot), read from as little of each file as its format
+allows: the rows above the samples, the Parquet footer and time column,
+or the .flrun header and block index. It also keeps a
+decimated curve of each run, about OVERLAY_POINTS points, in a cache
+folder beside them. Freeloader.save_data builds the curve as it saves;
+older files get theirs the first time they are overlaid. A curve is only
+rebuilt if its file changes, so opening 50 overlays reads 50 small .npz
+files rather than 50 whole runs.
+
+Run with --benchmark to time opening overlays with a cold and a warm cache
+and drawing them against the same runs at full length.
+"""
+
+import argparse
+import csv
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+from freeloaderbuffers import TIMESTAMP_FORMAT
+from freeloadercalibration import convert_units
+from freeloaderimport import LEGACY_LAYOUTS, import_run, parse_timestamp, read_header
+from freeloaderplot import minmax_indices
+
+
+# Points kept per archived curve
+OVERLAY_POINTS = 2000
+
+# Most recent matching runs overlaid at once
+OVERLAY_RUNS = 20
+
+# Suffixes of the files indexed: the text layouts freeloaderimport reads,
+# Parquet exports (freeloaderexport) and run archives (freeloaderarchive)
+RUN_SUFFIXES = (".csv", ".txt", ".parquet", ".flrun")
+
+# Columns an overlay needs from a Parquet export or run archive
+OVERLAY_COLUMNS = ("time", "position", "load")
+
+# Cache folder, inside the archive folder, and its index file
+ARCHIVE_CACHE = ".freeloader_cache"
+CACHE_INDEX = "index.json"
+
+
+def run_format(filename):
+    """ Lower-case suffix of a run file, which decides how it is read """
+    return os.path.splitext(filename)[1].lower()
+
+
+def read_summary(filename):
+    """
+    Metadata, load unit and first sample time (epoch seconds, None if there
+    are no samples) of a saved run, without reading its samples where the
+    format allows. Raises ValueError if the file is not a saved run, and
+    ImportError if reading its format needs a package that is missing.
+    """
+    if run_format(filename) == ".flrun":
+        from freeloaderarchive import ArchiveReader
+        with ArchiveReader(filename) as reader:
+            span = reader.time_range()
+            return dict(reader.metadata), reader.load_unit, span[0] if span else None
+    if run_format(filename) == ".parquet":
+        from freeloaderexport import read_run as read_export
+        metadata, run = read_export(filename, ["time"])
+        return metadata, metadata.get("load_unit", "lb"), float(run["time"][0]) if len(run["time"]) else None
+
+    with open(filename, 'rb') as file:
+        metadata, layout, unit, columns = read_header(file)
+        first = file.readline().decode("utf-8").split(",")[0].strip()
+    return metadata, unit, parse_timestamp(first, LEGACY_LAYOUTS[layout][1]) if first else None
+
+
+def read_run(filename):
+    """
+    Read a saved run in any of RUN_SUFFIXES. Returns its metadata, the load
+    unit, and arrays of elapsed seconds, positions and loads. The calibrated
+    load column is used where the file has one, the raw weight otherwise.
+    """
+    if run_format(filename) == ".flrun":
+        from freeloaderarchive import read_run as read_columns
+    elif run_format(filename) == ".parquet":
+        from freeloaderexport import read_run as read_columns
+    else:
+        read_columns = None
+    if read_columns is not None:
+        metadata, run = read_columns(filename, columns=OVERLAY_COLUMNS)
+    else:
+        metadata, run = import_run(filename)
+    times = run["time"]
+    if len(times):
+        metadata["started"] = times[0]
+        times = times - times[0]
+    return metadata, metadata["load_unit"], times, run["position"], run["load"]
+
+
+class RunArchive:
+    """ Saved runs in directory, with their metadata and decimated curves cached """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.cache_directory = os.path.join(directory, ARCHIVE_CACHE)
+        self.index_file = os.path.join(self.cache_directory, CACHE_INDEX)
+        self.index = {}  # File name to its size, mtime, metadata and unit
+        if os.path.exists(self.index_file):
+            with open(self.index_file) as file:
+                self.index = json.load(file)
+
+    def save_index(self):
+        os.makedirs(self.cache_directory, exist_ok=True)
+        temporary = self.index_file + ".tmp"
+        with open(temporary, 'w') as file:
+            json.dump(self.index, file, indent=1)
+        os.replace(temporary, self.index_file)
+
+    def entry(self, name):
+        """ Index entry of one file, read from its header if it is new or has changed """
+        stat = os.stat(os.path.join(self.directory, name))
+        entry = self.index.get(name)
+        if entry is not None and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+            return entry
+
+        entry = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "metadata": None, "unit": None}
+        try:
+            metadata, entry["unit"], started = read_summary(os.path.join(self.directory, name))
+        except ImportError:
+            return entry  # Its format cannot be read here; not remembered, so it is tried again next time
+        except (ValueError, UnicodeDecodeError):
+            pass  # Not a saved run; remembered so it is not read again
+        else:
+            metadata["started"] = started if started is not None else stat.st_mtime
+            entry["metadata"] = metadata
+        self.index[name] = entry
+        self.clear_curve(name)
+        return entry
+
+    def runs(self, material=None, lot=None, limit=OVERLAY_RUNS):
+        """
+        File names of the newest limit runs matching material code and lot,
+        where given, newest first. Only the headers of new or changed files
+        are read.
+        """
+        names = [name for name in os.listdir(self.directory) if run_format(name) in RUN_SUFFIXES]
+        for name in set(self.index) - set(names):
+            del self.index[name]
+            self.clear_curve(name)
+
+        matches = []
+        for name in names:
+            metadata = self.entry(name)["metadata"]
+            if metadata is None:
+                continue
+            if material is not None and metadata.get("material") != material:
+                continue
+            if lot is not None and metadata.get("lot") != lot:
+                continue
+            matches.append((metadata["started"], name))
+        self.save_index()
+
+        matches.sort(reverse=True)
+        return [name for started, name in matches[:limit]]
+
+    def curve_file(self, name):
+        return os.path.join(self.cache_directory, name + ".npz")
+
+    def clear_curve(self, name):
+        if os.path.exists(self.curve_file(name)):
+            os.remove(self.curve_file(name))
+
+    def build_curve(self, name):
+        """ Read a whole run and cache its decimated curve. Returns the curve arrays. """
+        metadata, unit, elapsed, positions, loads = read_run(os.path.join(self.directory, name))
+        keep = minmax_indices(loads, OVERLAY_POINTS)
+        curve = {"elapsed": elapsed[keep], "positions": positions[keep], "loads": loads[keep]}
+        os.makedirs(self.cache_directory, exist_ok=True)
+        np.savez(self.curve_file(name), **curve)
+        return curve
+
+    def curve(self, name):
+        """ Decimated (elapsed seconds, positions, loads) of a run, from the cache where possible """
+        entry = self.entry(name)
+        if entry["metadata"] is None:
+            raise ValueError(f"{name} is not a saved run.")
+        try:
+            with np.load(self.curve_file(name)) as cached:
+                curve = {key: cached[key] for key in cached.files}
+        except OSError:
+            curve = self.build_curve(name)
+        return curve["elapsed"], curve["positions"], curve["loads"]
+
+    def overlays(self, names, unit):
+        """ (label, elapsed, positions, loads) of each run, with loads in unit, for RunPlot.set_overlays """
+        result = []
+        for name in names:
+            elapsed, positions, loads = self.curve(name)
+            metadata = self.index[name]["metadata"]
+            label = metadata.get("sample") or name
+            result.append((label, elapsed, positions, convert_units(loads, self.index[name]["unit"], unit)))
+        return result
+
+
+def cache_run(filename):
+    """ Index a just-saved run and build its curve so it is ready to overlay """
+    archive = RunArchive(os.path.dirname(os.path.abspath(filename)))
+    name = os.path.basename(filename)
+    if archive.entry(name)["metadata"] is not None:
+        archive.build_curve(name)
+    archive.save_index()
+
+
+def write_example_run(filename, samples, material, lot, started):
+    """ Write a simulated pull in the layout of Freeloader.save_data """
+    elapsed = np.arange(samples) * 0.01
+    positions = elapsed * 0.5
+    loads = np.where(elapsed < elapsed[-1] * 0.9, positions * 2, 0.1) + np.random.normal(0, 0.05, samples)
+    with open(filename, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["freeLoaderGUI_4_0"])
+        writer.writerow(["Operator Initials", "XX"])
+        writer.writerow(["Sample Name", os.path.basename(filename)])
+        writer.writerow(["Material Code", material])
+        writer.writerow(["Lot #", lot])
+        writer.writerow(["Selected Option", "Monofilament"])
+        writer.writerow(["Load Cell", "default"])
+        writer.writerow(["Tare Offset", 0.0])
+        writer.writerow(["Timestamp", "Position", "Weight", "Tensile Load (lb.)"])
+        writer.writerows((datetime.fromtimestamp(started + t).strftime(TIMESTAMP_FORMAT), p, l, l)
+                         for t, p, l in zip(elapsed.tolist(), positions.tolist(), loads.tolist()))
+
+
+def benchmark(runs=50, samples=20000):
+    """
+    Save runs simulated runs to a scratch folder, then time overlaying all
+    of them from a cold and a warm cache, and drawing the overlays against
+    drawing the same runs at full length.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from freeloaderplot import RunPlot
+
+    with tempfile.TemporaryDirectory() as directory:
+        for index in range(runs):
+            write_example_run(os.path.join(directory, f"run_{index:03d}.csv"), samples, "PET", "L1",
+                              1.7e9 + index * 3600)
+
+        for cache in ("cold", "warm"):
+            start = time.perf_counter()
+            archive = RunArchive(directory)
+            overlays = archive.overlays(archive.runs(lot="L1", limit=runs), "lb")
+            print("{} cache: {} overlays opened in {:.3f} s".format(cache, len(overlays), time.perf_counter() - start))
+
+        full = [(name,) + read_run(os.path.join(directory, name))[2:] for name in archive.runs(lot="L1", limit=runs)]
+        figure = Figure(figsize=(6, 4), dpi=100)
+        canvas = FigureCanvasAgg(figure)
+        plot = RunPlot(figure, "extension")
+        empty = np.array([])
+        for label, curves in (("decimated", overlays), ("full length", full)):
+            plot.set_overlays(curves)
+            start = time.perf_counter()
+            plot.update(empty, empty, empty, "Tensile Load (lb.)")
+            canvas.draw()
+            print("{:<12} {} overlays of {} points drawn in {:.3f} s".format(
+                label, len(curves), len(curves[0][1]), time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Freeloader archived run overlays.")
+    parser.add_argument("--benchmark", action="store_true", help="time opening and drawing overlays")
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--samples", type=int, default=20000, help="samples per simulated run")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.runs, args.samples)
+    else:
+        parser.print_help()
@@ -0,0 +1,221 @@
+"""
+freeloaderplot
+
+Views of a run for the FreeloaderGUI plot, drawn on a matplotlib Figure:
+
+    time        distance and load against elapsed time, each on its own y axis
+    extension   load against extension, as a tensile engineer reads a pull
+
+However long the run, each line is drawn from at most PLOT_POINTS samples.
+The run is cut into equal stretches of samples and the lowest and highest
+sample of each stretch are kept, so every peak, trough and break survives
+at screen resolution while drawing costs the same for 10k samples as for
+1M. The peak load marker is placed from the running maximum kept by
+Freeloader.add_measurement, so it never needs a scan of the run.
+
+Archived runs (see freeloaderoverlay) can be overlaid in either view as
+thin lines behind the live run. They arrive already decimated and their
+lines are only touched again when the view or the time unit changes.
+
+matplotlib is imported by the caller; this module only needs NumPy. Run
+with --benchmark to time each view on a simulated 1M sample run with the
+Agg backend.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+
+# View name to the title shown in the view selector and on the plot
+PLOT_VIEWS = {
+    "time": "Load and Distance vs Time",
+    "extension": "Load vs Extension",
+}
+
+# Most points drawn per line
+PLOT_POINTS = 4000
+
+POSITION_COLOUR = "tab:blue"
+LOAD_COLOUR = "tab:orange"
+PEAK_COLOUR = "tab:red"
+OVERLAY_COLOUR = "0.6"
+OVERLAY_WIDTH = 0.8
+
+# Elapsed time is shown in the largest of these units that still fits twice
+# into the longest run on the plot
+ELAPSED_UNITS = [(3600.0, "h"), (60.0, "min"), (1.0, "s")]
+
+
+def elapsed_units(span):
+    """ Scale in seconds and axis label for an elapsed time axis covering span seconds """
+    for scale, unit in ELAPSED_UNITS:
+        if span >= 2 * scale:
+            break
+    return scale, "Elapsed Time ({})".format(unit)
+
+
+def minmax_indices(values, points=PLOT_POINTS):
+    """
+    Indices, in order, of the samples of values to draw so that about
+    points remain: the lowest and highest of each equal stretch of
+    samples. NaN gap markers are only kept where a whole stretch is gaps.
+    """
+    count = len(values)
+    if count <= points:
+        return np.arange(count)
+
+    stretches = points // 2
+    size = count // stretches
+    used = stretches * size
+    blocks = values[:used].reshape(stretches, size)
+    gaps = np.isnan(blocks)
+    starts = np.arange(0, used, size)
+    low = starts + np.argmin(np.where(gaps, np.inf, blocks), axis=1)
+    high = starts + np.argmax(np.where(gaps, -np.inf, blocks), axis=1)
+
+    # The few samples left over make one more stretch, and the newest sample
+    # is always kept so the line reaches the present
+    tail = values[used:]
+    keep = [low, high, [count - 1]]
+    if len(tail) and not np.isnan(tail).all():
+        keep.append(used + np.array([np.nanargmin(tail), np.nanargmax(tail)]))
+    return np.unique(np.concatenate(keep))
+
+
+class RunPlot:
+    """ The plot of a run on figure, in one of the views in PLOT_VIEWS """
+
+    def __init__(self, figure, view="time"):
+        self.figure = figure
+        self.view = None
+        self.overlays = []  # (label, elapsed, positions, loads) of each archived run shown
+        self.set_view(view)
+
+    def set_view(self, view):
+        """ Rebuild the axes and lines for view; the next update() fills them in """
+        if view not in PLOT_VIEWS:
+            raise ValueError(f"Unknown plot view '{view}'.")
+        self.figure.clear()
+        self.view = view
+        self.axes = self.figure.add_subplot(111)
+        self.axes.set_title(PLOT_VIEWS[view])
+
+        if view == "time":
+            # Distance on the left axis and load on the right, each with its own scale
+            self.position_line, = self.axes.plot([], [], color=POSITION_COLOUR)
+            self.axes.set_ylabel('Distance (mm)', color=POSITION_COLOUR)
+            self.load_axes = self.axes.twinx()
+        else:
+            self.position_line = None
+            self.axes.set_xlabel('Extension (mm)')
+            self.load_axes = self.axes
+
+        self.load_line, = self.load_axes.plot([], [], color=LOAD_COLOUR)
+        self.peak_marker, = self.load_axes.plot([], [], "v", color=PEAK_COLOUR)
+        self.peak_text = self.load_axes.annotate("", (0, 0), xytext=(6, 6), textcoords="offset points",
+                                                 color=PEAK_COLOUR)
+        self.load_label = None
+        self.time_scale = None
+        self.overlay_lines = [self.load_axes.plot([], [], color=OVERLAY_COLOUR, linewidth=OVERLAY_WIDTH,
+                                                  zorder=1)[0] for _ in self.overlays]
+        self.place_overlays()
+
+    def set_overlays(self, overlays):
+        """
+        Show archived runs, each a (label, elapsed seconds, distance, load)
+        tuple of decimated arrays, in place of any shown before.
+        """
+        self.overlays = list(overlays)
+        self.set_view(self.view)
+
+    def place_overlays(self):
+        """ Set the overlay lines' data for the current view and time unit """
+        for line, (label, elapsed, positions, loads) in zip(self.overlay_lines, self.overlays):
+            if self.view == "time":
+                line.set_data(elapsed / (self.time_scale or 1.0), loads)
+            else:
+                line.set_data(positions, loads)
+
+    def update(self, elapsed, positions, loads, load_label, peak=None):
+        """
+        Redraw the live run from whole-run arrays of elapsed seconds,
+        distance and calibrated load, which may be empty. peak is the
+        (elapsed seconds, distance, load) of the highest load so far, or None.
+        """
+        # Pick the time unit from the longest run shown
+        span = max([elapsed[-1] if len(elapsed) else 0.0] + [overlay[1][-1] for overlay in self.overlays
+                                                             if len(overlay[1])])
+        scale, time_label = elapsed_units(span)
+        if scale != self.time_scale:
+            self.time_scale = scale
+            self.place_overlays()
+        elapsed = elapsed / scale
+
+        if load_label != self.load_label:
+            self.load_label = load_label
+            if self.view == "time":
+                self.load_axes.set_ylabel(load_label, color=LOAD_COLOUR)
+            else:
+                self.load_axes.set_ylabel(load_label)
+
+        keep = minmax_indices(loads)
+        if self.view == "time":
+            self.axes.set_xlabel(time_label)
+            self.load_line.set_data(elapsed[keep], loads[keep])
+            keep = minmax_indices(positions)
+            self.position_line.set_data(elapsed[keep], positions[keep])
+        else:
+            self.load_line.set_data(positions[keep], loads[keep])
+
+        if peak is not None:
+            peak_elapsed, peak_position, peak_load = peak
+            x = peak_elapsed / scale if self.view == "time" else peak_position
+            self.peak_marker.set_data([x], [peak_load])
+            self.peak_text.xy = (x, peak_load)
+            self.peak_text.set_text("Peak {:.3f}".format(peak_load))
+        else:
+            self.peak_marker.set_data([], [])
+            self.peak_text.set_text("")
+
+        for axes in {self.axes, self.load_axes}:
+            axes.relim()
+            axes.autoscale_view()
+
+
+def benchmark(samples=1000000, frames=5):
+    """
+    Draw a simulated pull of samples with each view using the Agg backend
+    and print the mean time to update and render a frame.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    elapsed = np.arange(samples) * 0.001
+    positions = elapsed * 0.5
+    loads = np.where(elapsed < elapsed[-1] * 0.9, positions * 2, 0.1) + np.random.normal(0, 0.05, samples)
+    peak = int(np.argmax(loads))
+
+    figure = Figure(figsize=(6, 4), dpi=100)
+    canvas = FigureCanvasAgg(figure)
+    for view in PLOT_VIEWS:
+        plot = RunPlot(figure, view)
+        start = time.perf_counter()
+        for _ in range(frames):
+            plot.update(elapsed, positions, loads, "Tensile Load (lb.)", (elapsed[peak], positions[peak], loads[peak]))
+            canvas.draw()
+        print("{:<10}{:>9.1f} ms per frame at {} samples".format(
+            view, (time.perf_counter() - start) / frames * 1000, samples))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Freeloader run plot views.")
+    parser.add_argument("--benchmark", action="store_true", help="time each view on a simulated run")
+    parser.add_argument("--samples", type=int, default=1000000)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.samples)
+    else:
+        parser.print_help()
@@ -0,0 +1,566 @@
+"""
+freeloaderrecipes
+
+Declarative test recipes and the step scheduler that runs them. A recipe
+is a JSON object with a name and a list of stages:
+
+    preload   pull at rate mm/s until the filtered load reaches load
+    ramp      move distance mm at rate mm/s (negative distances push back)
+    hold      stop the motor for duration seconds (stress relaxation)
+    creep     hold the load at load for duration seconds, driving the motor
+              at up to rate mm/s
+    cycle     run its own stages count times
+    return    move at rate mm/s back to where the test started
+
+Every stage may set sample_hz, its sampling rate, and stop, a dict of
+conditions that end the stage early: load_above, load_below, max_duration
+and break (the filtered load falling off its peak). With "action": "end"
+a stop condition ends the whole test instead of moving on to the next stage.
+
+Loads in a recipe are calibrated and tared, in the load cell calibration's
+display unit: preload and the load stop conditions compare the filtered
+load, creep and change sampling the latest reading's load.
+
+A stage's sampling is "fixed" by default. "log" spaces samples out from
+1/sample_hz by a factor of growth each time, up to max_interval seconds, so
+each stage is sampled densely just after it starts and sparsely once it has
+settled. "change" reads at sample_hz but only keeps a reading once the load
+has moved by change or the travel by change_position since the last one
+kept, or max_interval seconds have passed. A recipe with "long_run" set
+(true, or a dict of SegmentedRunBuffer settings) streams its samples to
+rolling segment files in LONG_RUN_DIRECTORY so multi-day runs keep memory
+bounded.
+
+RecipeRun samples on absolute deadlines measured from the start of each
+stage, so timing does not drift however many cycles run, and cycles are
+walked lazily so a fatigue test of thousands of cycles holds no more state
+than a single pass. Samples go to the Freeloader's RunBuffer, which spills
+to disk past its planned size.
+
+Travel is measured from the servo's present angle, unwrapped between
+samples, so the sample rate must keep the motor under half a turn per
+sample. Speed changes are ramped by the Freeloader's MotionController,
+so ramp and return stages end once the motor is within its braking
+distance of the target rather than stopping late and overshooting.
+
+Run with --simulate to try a recipe on simulated devices.
+"""
+
+import argparse
+import json
+import math
+import time
+import tracemalloc
+
+from freeloaderGUI_5_9 import DeviceDisconnectedError, FreeloaderError
+from freeloaderbuffers import LONG_RUN_WINDOW, plan_capacity
+from freeloadermotion import CLOCKWISE, MAX_SPEED_UNITS
+
+
+# Lead screw travel and MX wheel mode speed units; clockwise turning pulls the sample
+MM_PER_REVOLUTION = 104 / 40
+COUNTS_PER_REVOLUTION = 4096
+RPM_PER_SPEED_UNIT = 0.114
+PULL_ANGLE_SIGN = -1  # The present angle falls while pulling
+
+DEFAULT_SAMPLE_HZ = 5.0
+
+# Adaptive sampling defaults
+SAMPLING_MODES = ("fixed", "log", "change")
+LOG_GROWTH = 1.2
+MAX_SAMPLE_SPACING = 600.0
+CHANGE_LOAD = 0.01
+CHANGE_POSITION = 0.01
+
+# Longest single sleep, so a stop request is seen during sparse sampling
+MAX_SLEEP = 0.1
+
+# Where long runs write their segment files
+LONG_RUN_DIRECTORY = "long_runs"
+
+# Proportional gain of the creep stage, in mm/s per unit of load error
+CREEP_GAIN = 0.5
+
+# Duration assumed when sizing the run buffer for stages that run until a condition
+OPEN_STAGE_DURATION = 60.0
+
+# Largest run buffer a recipe asks for; longer runs spill to disk
+MAX_RECIPE_CAPACITY = 1 << 20
+
+EXAMPLE_RECIPE = {
+    "name": "Example cyclic test",
+    "stages": [
+        {"type": "preload", "load": 0.5, "rate": 0.5},
+        {"type": "cycle", "count": 3, "stages": [
+            {"type": "ramp", "distance": 2.0, "rate": 1.0, "stop": {"load_above": 20.0}},
+            {"type": "hold", "duration": 2.0, "sample_hz": 2},
+            {"type": "ramp", "distance": -2.0, "rate": 1.0},
+        ]},
+        {"type": "ramp", "distance": 50.0, "rate": 1.0, "stop": {"break": True, "action": "end"}},
+        {"type": "return", "rate": 2.0},
+    ],
+}
+
+
+class RecipeError(FreeloaderError):
+    """ Raised for recipes that cannot be run """
+    pass
+
+
+def speed_command(rate):
+    """ Moving speed register value for a rate in mm/s; positive rates pull """
+    units = min(MAX_SPEED_UNITS, round(abs(rate) / MM_PER_REVOLUTION * 60 / RPM_PER_SPEED_UNIT))
+    if rate > 0 and units:
+        return units | CLOCKWISE
+    return units
+
+
+class Stage:
+    """ One step of a recipe. Subclasses start their motion in begin and say when they are done. """
+
+    kind = None
+
+    def __init__(self, sample_hz=DEFAULT_SAMPLE_HZ, stop=None, name=None, sampling="fixed",
+                 growth=LOG_GROWTH, max_interval=MAX_SAMPLE_SPACING, change=CHANGE_LOAD,
+                 change_position=CHANGE_POSITION):
+        if sample_hz <= 0:
+            raise RecipeError(f"{self.kind} stage needs a positive sample_hz.")
+        if sampling not in SAMPLING_MODES:
+            raise RecipeError(f"Unknown sampling mode '{sampling}'.")
+        if growth < 1:
+            raise RecipeError("Log sampling growth must be at least 1.")
+        self.sample_hz = sample_hz
+        self.stop = dict(stop or {})
+        self.name = name or self.kind
+        self.sampling = sampling
+        self.growth = growth
+        self.max_interval = max(max_interval, 1 / sample_hz)
+        self.change = change
+        self.change_position = change_position
+
+    def begin(self, run):
+        """ Start the stage's motion """
+        pass
+
+    def finished(self, run):
+        """ True once the stage has reached its target """
+        return False
+
+    def duration(self):
+        """ Expected duration in seconds, used to size the run buffer """
+        return self.stop.get("max_duration", OPEN_STAGE_DURATION)
+
+    def time_limit(self):
+        """ Seconds after which the stage is over regardless, or None """
+        return self.stop.get("max_duration")
+
+    def expected_samples(self):
+        """ Samples the stage is expected to keep, used to size the run buffer """
+        duration = self.duration()
+        if self.sampling != "log":
+            return duration * self.sample_hz
+
+        # Intervals grow geometrically until they reach max_interval
+        interval = 1 / self.sample_hz
+        elapsed = samples = 0
+        while elapsed < duration and interval < self.max_interval:
+            elapsed += interval
+            interval *= self.growth
+            samples += 1
+        return samples + max(0.0, duration - elapsed) / self.max_interval
+
+
+class Preload(Stage):
+    kind = "preload"
+
+    def __init__(self, load, rate, **settings):
+        super().__init__(**settings)
+        self.load = load
+        self.rate = abs(rate)
+
+    def begin(self, run):
+        run.move(self.rate)
+
+    def finished(self, run):
+        return run.freeloader.filtered_weight >= self.load
+
+
+class Ramp(Stage):
+    kind = "ramp"
+
+    def __init__(self, distance, rate, **settings):
+        super().__init__(**settings)
+        if not rate:
+            raise RecipeError("ramp stage needs a non-zero rate.")
+        self.distance = distance
+        self.rate = math.copysign(abs(rate), distance)
+
+    def begin(self, run):
+        run.move(self.rate)
+
+    def finished(self, run):
+        return abs(run.position - run.stage_position) + run.braking_distance() >= abs(self.distance)
+
+    def duration(self):
+        return abs(self.distance / self.rate)
+
+
+class Hold(Stage):
+    kind = "hold"
+
+    def __init__(self, duration, **settings):
+        super().__init__(**settings)
+        self.hold_time = duration
+
+    def begin(self, run):
+        run.move(0)
+
+    def finished(self, run):
+        return run.stage_elapsed() >= self.hold_time
+
+    def duration(self):
+        return self.hold_time
+
+    def time_limit(self):
+        return min(self.hold_time, self.stop.get("max_duration", self.hold_time))
+
+
+class Creep(Hold):
+    """ Holds the load at a target by moving the motor in proportion to the load error """
+
+    kind = "creep"
+
+    def __init__(self, load, duration, rate=1.0, gain=CREEP_GAIN, **settings):
+        super().__init__(duration, **settings)
+        self.load = load
+        self.rate = abs(rate)
+        self.gain = gain
+
+    def begin(self, run):
+        self.adjust(run, force=True)
+
+    def adjust(self, run, force=False):
+        """ Change the motor speed to close the gap between the latest load and the target """
+        rate = max(-self.rate, min(self.rate, self.gain * (self.load - run.load)))
+        if force or speed_command(rate) != run.speed:
+            run.move(rate)
+
+    def finished(self, run):
+        if run.stage_elapsed() >= self.hold_time:
+            return True
+        self.adjust(run)
+        return False
+
+
+class Return(Stage):
+    kind = "return"
+
+    def __init__(self, rate, **settings):
+        super().__init__(**settings)
+        self.rate = abs(rate)
+        self.direction = 0
+
+    def begin(self, run):
+        # Already at the start: stop there, which also finishes the stage
+        self.direction = -1 if run.position > 0 else 1 if run.position < 0 else 0
+        run.move(self.direction * self.rate)
+
+    def finished(self, run):
+        return run.position * self.direction + run.braking_distance() >= 0
+
+
+class Cycle:
+    """ Repeats its stages count times. Not a stage itself; iter_stages walks into it. """
+
+    kind = "cycle"
+
+    def __init__(self, count, stages):
+        if count < 1:
+            raise RecipeError("cycle needs a count of at least 1.")
+        self.count = count
+        self.stages = stages
+
+    def duration_and_samples(self):
+        duration, samples = stages_duration_and_samples(self.stages)
+        return duration * self.count, samples * self.count
+
+
+STAGE_TYPES = {stage.kind: stage for stage in (Preload, Ramp, Hold, Creep, Return, Cycle)}
+
+
+def parse_stage(definition):
+    """ Build a Stage or Cycle from its JSON definition """
+    definition = dict(definition)
+    kind = definition.pop("type", None)
+    if kind not in STAGE_TYPES:
+        raise RecipeError(f"Unknown stage type '{kind}'.")
+    if kind == "cycle":
+        return Cycle(definition.get("count", 1), [parse_stage(stage) for stage in definition.get("stages", [])])
+    try:
+        return STAGE_TYPES[kind](**definition)
+    except TypeError as e:
+        raise RecipeError(f"Bad {kind} stage: {e}")
+
+
+def iter_stages(stages):
+    """ Yield every stage to run in order, walking into cycles lazily """
+    for stage in stages:
+        if isinstance(stage, Cycle):
+            for _ in range(stage.count):
+                yield from iter_stages(stage.stages)
+        else:
+            yield stage
+
+
+def stages_duration_and_samples(stages):
+    """ Expected duration in seconds and sample count of a list of stages """
+    duration = samples = 0.0
+    for stage in stages:
+        if isinstance(stage, Cycle):
+            cycle_duration, cycle_samples = stage.duration_and_samples()
+        else:
+            cycle_duration = stage.duration()
+            cycle_samples = stage.expected_samples()
+        duration += cycle_duration
+        samples += cycle_samples
+    return duration, samples
+
+
+class Recipe:
+    """ A named list of stages parsed from a JSON definition """
+
+    def __init__(self, definition):
+        if not definition.get("stages"):
+            raise RecipeError("A recipe needs at least one stage.")
+        self.definition = definition
+        self.name = definition.get("name", "Recipe")
+        self.stages = [parse_stage(stage) for stage in definition["stages"]]
+
+        long_run = definition.get("long_run")
+        self.long_run = None  # SegmentedRunBuffer settings other than its capacity
+        self.long_run_capacity = LONG_RUN_WINDOW
+        if long_run:
+            self.long_run = {"directory": LONG_RUN_DIRECTORY}
+            if isinstance(long_run, dict):
+                self.long_run.update(long_run)
+                self.long_run_capacity = self.long_run.pop("capacity", LONG_RUN_WINDOW)
+
+    @classmethod
+    def load(cls, filename):
+        """ Read a recipe from a JSON file """
+        try:
+            with open(filename) as file:
+                return cls(json.load(file))
+        except (OSError, ValueError) as e:
+            raise RecipeError(f"Failed to read recipe {filename}: {e}")
+
+    def capacity(self):
+        """ Run buffer size for the whole recipe, capped at MAX_RECIPE_CAPACITY """
+        if self.long_run is not None:
+            return self.long_run_capacity
+        samples = stages_duration_and_samples(self.stages)[1]
+        return min(MAX_RECIPE_CAPACITY, plan_capacity(samples, 1, 1))
+
+
+class RecipeRun:
+    """
+    Runs a recipe on a Freeloader, sampling each stage at its own rate on
+    deadlines counted from the stage start. Late ticks are skipped rather
+    than run back to back, and counted in overruns.
+    """
+
+    def __init__(self, freeloader, recipe):
+        self.freeloader = freeloader
+        self.recipe = recipe
+        self.stage = None
+        self.stage_start = 0.0
+        self.stage_position = 0.0
+        self.speed = 0
+        self.counts = 0  # Unwrapped present angle since the test started
+        self.last_angle = None
+        self.position = 0.0  # Travel in mm since the test started
+        self.weight = 0.0  # Latest raw reading, kept or not
+        self.load = 0.0  # Calibrated, tared load of the latest reading
+        self.last_kept = None  # (t, position, load) of the last sample stored
+        self.stages_run = 0
+        self.overruns = 0
+        self.max_lateness = 0.0
+
+    def move(self, rate):
+        """ Drive the motor at rate mm/s, positive to pull """
+        self.speed = speed_command(rate)
+        self.freeloader.command_speed(self.speed)
+
+    def braking_distance(self):
+        """ Travel in mm the motor covers ramping down from its present speed to a stop """
+        return self.freeloader.motion.braking_distance() * RPM_PER_SPEED_UNIT / 60 * MM_PER_REVOLUTION
+
+    def stage_elapsed(self):
+        """ Seconds since the current stage began """
+        return time.perf_counter() - self.stage_start
+
+    def read_position(self, deadline=None):
+        """ Update position from the servo angle, unwrapping across the 0/4095 boundary """
+        angle = self.freeloader.get_position(deadline)
+        if self.last_angle is not None:
+            delta = angle - self.last_angle
+            if delta > COUNTS_PER_REVOLUTION // 2:
+                delta -= COUNTS_PER_REVOLUTION
+            elif delta < -COUNTS_PER_REVOLUTION // 2:
+                delta += COUNTS_PER_REVOLUTION
+            self.counts += delta
+        self.last_angle = angle
+        self.position = self.counts * PULL_ANGLE_SIGN * MM_PER_REVOLUTION / COUNTS_PER_REVOLUTION
+
+    def sample(self, stage):
+        """
+        Take one reading and store it, unless the stage samples on change and
+        nothing has changed enough. Rides out a brief disconnect.
+        """
+        freeloader = self.freeloader
+        try:
+            t = time.time()
+            deadline = freeloader.sample_deadline()  # Shared by both reads
+            self.read_position(deadline)
+            self.weight = freeloader.get_weight(deadline)
+            freeloader.check_motion()
+            calibration = freeloader.calibration
+            self.load = calibration.load(self.weight) if calibration is not None else self.weight
+        except DeviceDisconnectedError:
+            freeloader.record_gap()
+            if not freeloader.wait_for_reconnect():
+                raise
+            self.last_angle = None
+            self.last_kept = None
+            freeloader.motion.resend()
+            return
+
+        if stage.sampling == "change" and self.last_kept is not None:
+            kept_t, kept_position, kept_load = self.last_kept
+            if (abs(self.load - kept_load) < stage.change
+                    and abs(self.position - kept_position) < stage.change_position
+                    and t - kept_t < stage.max_interval):
+                return
+        self.last_kept = (t, self.position, self.load)
+        freeloader.add_measurement(t, self.position, self.weight)
+
+    def wait_until(self, deadline):
+        """ Sleep until the perf_counter deadline, waking regularly to see a stop request """
+        while not self.freeloader.interrupt_flag:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, MAX_SLEEP))
+
+    def stopped(self, stage):
+        """ The action of the first stop condition met this tick, or None """
+        stop = stage.stop
+        if not stop:
+            return None
+        load = self.freeloader.filtered_weight
+        if (("load_above" in stop and load > stop["load_above"])
+                or ("load_below" in stop and load < stop["load_below"])
+                or ("max_duration" in stop and self.stage_elapsed() >= stop["max_duration"])
+                or (stop.get("break") and self.freeloader.sample_broken())):
+            return stop.get("action", "next")
+        return None
+
+    def run_stage(self, stage):
+        """ Run one stage. Returns False if the test should end. """
+        freeloader = self.freeloader
+        self.stage = stage
+        freeloader.recipe_stage = stage.name
+        freeloader.peak_weight = 0.0  # Break detection only looks at this stage
+        self.stage_start = time.perf_counter()
+        self.stage_position = self.position
+        self.last_kept = None  # Always keep the first sample of a stage
+        stage.begin(self)
+
+        limit = stage.time_limit()
+        end = self.stage_start + limit if limit is not None else math.inf
+        interval = 1 / stage.sample_hz
+        next_time = self.stage_start
+        while not freeloader.interrupt_flag:
+            self.sample(stage)
+            if stage.finished(self):
+                return True
+            action = self.stopped(stage)
+            if action is not None:
+                return action != "end"
+
+            next_time += interval
+            if stage.sampling == "log":
+                interval = min(interval * stage.growth, stage.max_interval)
+            lateness = time.perf_counter() - next_time
+            if lateness > 0:
+                # Skip the ticks already missed instead of bunching samples up
+                self.overruns += 1
+                self.max_lateness = max(self.max_lateness, lateness)
+                next_time += math.ceil(lateness / interval) * interval
+            # Sparse samples must not carry a timed stage past its end
+            self.wait_until(min(next_time, end))
+
+        return False
+
+    def run(self):
+        """ Thread target that runs every stage in order, then stops the motor """
+        try:
+            self.read_position()
+            self.counts = 0
+            self.position = 0.0
+            for stage in iter_stages(self.recipe.stages):
+                self.stages_run += 1
+                if not self.run_stage(stage):
+                    break
+        except FreeloaderError as e:
+            self.freeloader.report_error(str(e))
+        finally:
+            self.freeloader.recipe_stage = None
+            self.freeloader.measurements.flush()
+            self.freeloader.command_speed(0)
+
+
+def simulate(recipe, response_time=0.0):
+    """
+    Run a recipe on simulated devices and print its sample count, timing
+    overruns, elapsed against planned time and peak traced memory.
+    """
+    from freeloaderstations import SimulatedFreeloader
+
+    freeloader = SimulatedFreeloader(response_time)
+    freeloader.connect_dynamixel(None, None)
+    freeloader.connect_loadstar(None, None)
+    freeloader.report_error = print
+
+    planned, samples = stages_duration_and_samples(recipe.stages)
+    tracemalloc.start()
+    start = time.perf_counter()
+    freeloader.start_measurement(recipe.definition)
+    for thread in freeloader.acquisition_threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    run = freeloader.recipe_run
+    print(f"{recipe.name}: {run.stages_run} stages, {len(freeloader.measurements)} samples "
+          f"(about {samples:.0f} planned)")
+    print("elapsed {:.2f} s, planned {:.2f} s, {} overruns, worst {:.1f} ms late".format(
+        elapsed, planned, run.overruns, run.max_lateness * 1000))
+    print("peak traced memory {:.1f} MB".format(peak / 1e6))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Freeloader test recipes.")
+    parser.add_argument("recipe", nargs="?", help="recipe JSON file; the built-in example if omitted")
+    parser.add_argument("--simulate", action="store_true", help="run the recipe on simulated devices")
+    parser.add_argument("--response-time", type=float, default=0.0, help="simulated Loadstar reply time in seconds")
+    parser.add_argument("--example", action="store_true", help="print the example recipe as JSON")
+    args = parser.parse_args()
+
+    if args.example:
+        print(json.dumps(EXAMPLE_RECIPE, indent=2))
+    elif args.simulate:
+        simulate(Recipe.load(args.recipe) if args.recipe else Recipe(EXAMPLE_RECIPE), args.response_time)
+    else:
+        parser.print_help()
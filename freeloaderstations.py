@@ -0,0 +1,438 @@
+"""
+freeloaderstations
+
+Runs several Freeloader test stations from one process. Each station owns a
+Freeloader on its own pair of serial ports and acquires on its own threads.
+A single SharedWriter thread appends every station's samples to one CSV file,
+and StationGUI shows the stations as tabs.
+
+Run with --benchmark to measure, using simulated devices, how the total
+sample rate scales as stations are added. The simulated Loadstar replies at
+once by default, so the rates show the cost of acquisition itself rather
+than the wait for replies; --response-time adds a reply time.
+"""
+
+import argparse
+import csv
+import os
+import queue
+import tempfile
+import threading
+import time
+import tkinter as tk
+from datetime import datetime
+from tkinter import messagebox
+from tkinter.ttk import Button, Notebook
+
+from freeloaderGUI_5_9 import (
+    BAUDRATE,
+    LOADSTAR_BAUDRATE,
+    Freeloader,
+    FreeloaderError,
+    _load_matplotlib,
+)
+from freeloaderbridge import GuiBridge
+from freeloaderbuffers import format_timestamp
+
+
+# Name, Dynamixel port and Loadstar port of each station
+STATIONS = [
+    ("Station 1", "COM3", "COM2"),
+    ("Station 2", "COM5", "COM4"),
+    ("Station 3", "COM7", "COM6"),
+    ("Station 4", "COM9", "COM8"),
+]
+
+# How often the shared writer flushes to disk, in seconds
+WRITER_FLUSH_INTERVAL = 1.0
+
+# Loadstar reply time used by the simulated devices, in seconds
+SIMULATED_RESPONSE_TIME = 0.02
+
+# How often the GUI refreshes its labels and the visible plot, in milliseconds
+REFRESH_INTERVAL = 1000
+
+# Simulated sample stiffness in load per count of servo angle pulled
+SIMULATED_STIFFNESS = 0.01
+
+
+class Station:
+    """ One test rig: a named Freeloader bound to its own serial ports """
+
+    def __init__(self, name, dynamixel_port, loadstar_port, freeloader=None):
+        self.name = name
+        self.dynamixel_port = dynamixel_port
+        self.loadstar_port = loadstar_port
+        self.freeloader = freeloader if freeloader is not None else Freeloader()
+        self.status = "offline"
+        self.sample_count = 0
+        self.started_at = None
+        self.freeloader.sample_listeners.append(self.count_sample)
+
+    def count_sample(self, t, position, weight):
+        """ Sample listener that keeps the count used for the sample rate """
+        self.sample_count += 1
+
+    def connect(self):
+        """
+        Connect the station's Dynamixel and Loadstar, recording any failure
+        in status. The Dynamixel is disconnected again if the Loadstar fails,
+        so the station is left either fully connected or not at all.
+        """
+        try:
+            self.freeloader.connect_dynamixel(self.dynamixel_port, BAUDRATE)
+            self.freeloader.connect_loadstar(self.loadstar_port, LOADSTAR_BAUDRATE)
+        except FreeloaderError as e:
+            if self.freeloader.dyna_online:
+                self.freeloader.disconnect_dynamixel()
+            self.status = f"offline ({e})"
+        else:
+            self.status = "online"
+
+    def disconnect(self):
+        """ Disconnect whichever devices are connected """
+        if self.freeloader.dyna_online:
+            self.freeloader.disconnect_dynamixel()
+        self.freeloader.disconnect_loadstar()
+        self.status = "offline"
+
+    def start(self):
+        """ Start a measurement run on this station """
+        self.sample_count = 0
+        self.started_at = time.monotonic()
+        self.freeloader.start_measurement()
+        self.status = "running"
+
+    def stop(self):
+        """ Stop the measurement run on this station """
+        self.freeloader.stop_measurement()
+        self.status = "online"
+
+    def sample_rate(self):
+        """ Average samples per second since the run started """
+        if self.started_at is None:
+            return 0.0
+        elapsed = time.monotonic() - self.started_at
+        return self.sample_count / elapsed if elapsed > 0 else 0.0
+
+
+class SharedWriter:
+    """
+    Single writer thread for every station. Stations hand it rows through a
+    queue and it appends them, tagged with the station name, to one CSV file.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.queue = queue.Queue()
+        self.thread = None
+
+    def listener(self, station_name):
+        """ Return a sample listener that queues rows for station_name """
+        def put(t, position, weight):
+            self.queue.put((station_name, t, position, weight))
+        return put
+
+    def start(self):
+        """ Start the writer thread """
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """ Write out whatever is queued and stop the writer thread """
+        self.queue.put(None)
+        self.thread.join()
+
+    def run(self):
+        """ Thread target that drains the queue in batches until stop is called """
+        with open(self.filename, 'a', newline='') as file:
+            writer = csv.writer(file)
+            if file.tell() == 0:
+                writer.writerow(["Station", "Timestamp", "Position", "Weight"])
+
+            while True:
+                try:
+                    row = self.queue.get(timeout=WRITER_FLUSH_INTERVAL)
+                except queue.Empty:
+                    continue
+
+                # Write everything that has piled up before flushing once
+                rows = [row]
+                while True:
+                    try:
+                        rows.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                done = None in rows
+                writer.writerows((r[0], format_timestamp(r[1]), r[2], r[3]) for r in rows if r is not None)
+                file.flush()
+                if done:
+                    return
+
+
+class StationManager:
+    """ Owns every station and the shared writer they all report to """
+
+    def __init__(self, stations, writer=None):
+        self.stations = stations
+        self.writer = writer
+        if writer is not None:
+            for station in stations:
+                station.freeloader.sample_listeners.append(writer.listener(station.name))
+
+    def connect_all(self):
+        """ Connect all stations in parallel so one slow port does not hold up the rest """
+        threads = [threading.Thread(target=station.connect) for station in self.stations]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def disconnect_all(self):
+        """ Disconnect every station """
+        for station in self.stations:
+            station.disconnect()
+
+    def start_all(self):
+        """ Start a run on every online station """
+        for station in self.stations:
+            if station.status == "online":
+                station.start()
+
+    def stop_all(self):
+        """ Stop every running station """
+        for station in self.stations:
+            if station.status == "running":
+                station.stop()
+
+    def sample_rates(self):
+        """ Return a dict of station name to samples per second """
+        return {station.name: station.sample_rate() for station in self.stations}
+
+
+class StationGUI:
+    """ Tabbed window with one tab of controls and a live plot per station """
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.window = tk.Tk()
+        self.bridge = GuiBridge(self.window)
+        self.notebook = Notebook(self.window)
+        self.buttons_frame = tk.Frame(self.window)
+        self.tabs = []
+        self.matplotlib_classes = None
+
+        for station in manager.stations:
+            # Errors from a station's worker threads are shown from the Tk thread
+            station.freeloader.report_error = (
+                lambda message, name=station.name: self.bridge.call(messagebox.showerror, name, message))
+            frame = tk.Frame(self.notebook)
+            self.notebook.add(frame, text=station.name)
+            tab = {
+                "station": station,
+                "frame": frame,
+                "status": tk.Label(frame, text=station.status),
+                "rate": tk.Label(frame, text="0.0 samples/s"),
+                "start": Button(frame, text="Start", command=lambda s=station: self.start_station(s)),
+                "stop": Button(frame, text="Stop", command=station.stop),
+                "plot": None,
+                "line": None,
+                "canvas": None,
+                "drawn": 0,  # Samples shown by the last draw
+            }
+            self.tabs.append(tab)
+
+        self.start_all_button = Button(self.buttons_frame, text="Start All", command=self.start_all)
+        self.stop_all_button = Button(self.buttons_frame, text="Stop All", command=manager.stop_all)
+
+    def start_station(self, station):
+        """ Start one station, reporting why if it cannot """
+        if station.status != "online":
+            messagebox.showerror("Error", f"{station.name} is {station.status}.")
+            return
+        station.start()
+
+    def start_all(self):
+        """ Start every online station """
+        self.manager.start_all()
+
+    def load_plot_backend(self):
+        """ Background thread target that imports matplotlib """
+        self.matplotlib_classes = _load_matplotlib()
+
+    def build_plots(self):
+        """ Create a figure per tab once matplotlib is available. Runs on the Tk thread. """
+        if self.matplotlib_classes is None:
+            self.window.after(50, self.build_plots)
+            return
+
+        Figure, FigureCanvasTkAgg = self.matplotlib_classes
+        for tab in self.tabs:
+            figure = Figure(figsize=(6, 4), dpi=100)
+            tab["plot"] = figure.add_subplot(111)
+            tab["line"], = tab["plot"].plot([], [])
+            tab["plot"].set_xlabel('Distance (mm)')
+            tab["plot"].set_title(tab["station"].name)
+            tab["canvas"] = FigureCanvasTkAgg(figure, master=tab["frame"])
+            tab["canvas"].get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+
+    def refresh(self):
+        """
+        Update every tab's labels, and redraw the visible tab's plot if it
+        has new samples, updating its line in place rather than rebuilding
+        the axes
+        """
+        selected = self.notebook.index(self.notebook.select())
+        for index, tab in enumerate(self.tabs):
+            station = tab["station"]
+            tab["status"].config(text=station.status)
+            tab["rate"].config(text="{:.1f} samples/s".format(station.sample_rate()))
+
+            measurements = station.freeloader.measurements
+            if index == selected and tab["canvas"] is not None and len(measurements) != tab["drawn"]:
+                positions, loads = measurements.read("position", "filtered")
+                tab["line"].set_data(positions, loads)
+                tab["plot"].set_ylabel(station.freeloader.load_label())
+                tab["plot"].relim()
+                tab["plot"].autoscale_view()
+                tab["canvas"].draw_idle()
+                tab["drawn"] = len(measurements)
+
+        self.window.after(REFRESH_INTERVAL, self.refresh)
+
+    def start(self):
+        """ Method to start the GUI """
+        self.window.title("Freeloader Stations")
+        self.window.geometry("1280x800")
+
+        self.notebook.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+        for tab in self.tabs:
+            tab["status"].pack(side=tk.TOP, anchor=tk.W, padx=15)
+            tab["rate"].pack(side=tk.TOP, anchor=tk.W, padx=15)
+            tab["start"].pack(side=tk.TOP, anchor=tk.W, padx=15)
+            tab["stop"].pack(side=tk.TOP, anchor=tk.W, padx=15)
+
+        self.buttons_frame.pack(side=tk.BOTTOM, fill=tk.X, padx=25, pady=25)
+        self.start_all_button.pack(side=tk.LEFT, padx=15)
+        self.stop_all_button.pack(side=tk.LEFT, padx=15)
+
+        threading.Thread(target=self.load_plot_backend, daemon=True).start()
+        threading.Thread(target=self.manager.connect_all, daemon=True).start()
+        self.bridge.start()
+        self.window.after(50, self.build_plots)
+        self.refresh()
+
+        self.window.mainloop()
+
+
+class SimulatedFreeloader(Freeloader):
+    """ Freeloader whose devices are simulated in memory, used by the benchmark """
+
+    def __init__(self, response_time=SIMULATED_RESPONSE_TIME):
+        super().__init__()
+        self.response_time = response_time
+        self.loadstar_response_wait = self.sample_interval = response_time
+        self.simulated_speed = 0
+        self.simulated_angle = 0.0  # Unwrapped, in counts
+        self.simulated_at = time.monotonic()
+
+    def turn(self):
+        """ Advance the simulated servo angle to now at the current wheel mode speed """
+        now = time.monotonic()
+        counts_per_second = (self.simulated_speed & 1023) * 0.114 / 60 * 4096
+        direction = -1 if self.simulated_speed & 1024 else 1
+        self.simulated_angle += direction * counts_per_second * (now - self.simulated_at)
+        self.simulated_at = now
+
+    def connect_dynamixel(self, port, baudr):
+        self.dyna_online = True
+
+    def connect_loadstar(self, com_port, baudrate):
+        self.cell_online = True
+
+    def disconnect_dynamixel(self):
+        self.dyna_online = False
+
+    def disconnect_loadstar(self):
+        self.cell_online = False
+
+    def set_speed(self, speed):
+        self.turn()
+        self.simulated_speed = speed
+
+    def get_position(self, deadline=None):
+        self.turn()
+        return int(self.simulated_angle) % 4096
+
+    def get_weight(self, deadline=None):
+        time.sleep(self.response_time)  # Stand-in for the Loadstar reply time
+        self.turn()
+        return max(0.0, -self.simulated_angle * SIMULATED_STIFFNESS)
+
+
+def benchmark(station_counts=(1, 2, 4, 8), duration=5.0, response_time=0.0):
+    """
+    Run 1, 2, 4 and 8 simulated stations for duration seconds each, all
+    feeding one SharedWriter, and print the total and per-station sample
+    rates. With no response_time the simulated Loadstar replies at once, so
+    each station samples as fast as it can and the total shows how
+    acquisition scales; with the real reply time the rates only show the
+    sleeps. Returns a dict of station count to the list of per-station rates.
+    """
+    results = {}
+    print("stations  total Hz   mean Hz    min Hz  total vs 1 station")
+
+    for count in station_counts:
+        fd, filename = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+        writer = SharedWriter(filename)
+        stations = [Station(f"Station {i + 1}", None, None, SimulatedFreeloader(response_time))
+                    for i in range(count)]
+        manager = StationManager(stations, writer)
+
+        writer.start()
+        manager.connect_all()
+        manager.start_all()
+        time.sleep(duration)
+        rates = list(manager.sample_rates().values())
+        manager.stop_all()
+        for station in stations:
+            for thread in station.freeloader.acquisition_threads:
+                thread.join()
+        writer.stop()
+        os.remove(filename)
+
+        results[count] = rates
+        total = sum(rates)
+        baseline = sum(results[station_counts[0]])
+        print("{:8d}  {:8.0f}  {:8.0f}  {:8.0f}  {:18.1%}".format(
+            count, total, total / count, min(rates), total / baseline))
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run several Freeloader stations from one process.")
+    parser.add_argument("--benchmark", action="store_true", help="measure how sample rates scale with simulated stations")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per benchmark step")
+    parser.add_argument("--response-time", type=float, default=0.0,
+                        help="simulated Loadstar reply time in seconds for the benchmark")
+    parser.add_argument("--output", default=None, help="CSV file shared by all stations")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(duration=args.duration, response_time=args.response_time)
+    else:
+        output = args.output or "stations_{}.csv".format(datetime.now().strftime("%Y%m%d%H%M%S"))
+        writer = SharedWriter(output)
+        stations = [Station(name, dxl_port, cell_port) for name, dxl_port, cell_port in STATIONS]
+        manager = StationManager(stations, writer)
+
+        writer.start()
+        gui = StationGUI(manager)
+        gui.start()
+
+        manager.stop_all()
+        manager.disconnect_all()
+        writer.stop()
@@ -0,0 +1,305 @@
+"""
+freeloadertelemetry
+
+Compact binary live-telemetry stream for Freeloader samples. Each sample is
+a fixed 20-byte (t_ns, position, load, temperature) record, and records are
+batched into frames with a small header:
+
+    magic      2 bytes   b"FL"
+    version    1 byte
+    decimation 1 byte    every Nth sample is sent to this client
+    count      2 bytes   records in this frame
+    sequence   4 bytes   per-client frame counter, a jump means frames were lost
+    index      8 bytes   acquisition index of the first record
+
+A client connects over TCP, sends one byte with the decimation level it
+wants (1 to MAX_DECIMATION) and then reads frames. TelemetryClient is the reference client.
+Run with --benchmark for a loopback throughput test against JSON.
+"""
+
+import argparse
+import json
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+
+TELEMETRY_HOST = "127.0.0.1"
+TELEMETRY_PORT = 8766
+
+PROTOCOL_MAGIC = b"FL"
+PROTOCOL_VERSION = 1
+
+FRAME_HEADER = struct.Struct("<2sBBHIQ")
+FRAME_RECORD = struct.Struct("<qfff")
+
+# A frame is sent once it holds this many records or is this old, whichever comes first
+FRAME_MAX_RECORDS = 512
+FRAME_INTERVAL = 0.02
+
+# Frames buffered per client before new ones are dropped
+CLIENT_QUEUE_SIZE = 256
+
+# Largest decimation level the one-byte request and header field can carry
+MAX_DECIMATION = 255
+
+
+def pack_frame(sequence, index, decimation, records):
+    """ Pack records (t_ns, position, load, temperature) into one frame """
+    frame = bytearray(FRAME_HEADER.size + len(records) * FRAME_RECORD.size)
+    FRAME_HEADER.pack_into(frame, 0, PROTOCOL_MAGIC, PROTOCOL_VERSION, decimation, len(records), sequence, index)
+    offset = FRAME_HEADER.size
+    for record in records:
+        FRAME_RECORD.pack_into(frame, offset, *record)
+        offset += FRAME_RECORD.size
+    return bytes(frame)
+
+
+def read_exactly(connection, size):
+    """ Read size bytes from a socket, or return None if it closes first """
+    data = bytearray()
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
+
+
+class TelemetryClientHandler(socketserver.BaseRequestHandler):
+    """ Sends the frames queued for one client until it disconnects """
+
+    def handle(self):
+        decimation = read_exactly(self.request, 1)
+        if decimation is None:
+            return
+
+        client = {"decimation": max(1, decimation[0]), "queue": queue.Queue(CLIENT_QUEUE_SIZE), "sequence": 0}
+        self.server.telemetry.add_client(client)
+        try:
+            while True:
+                frame = client["queue"].get()
+                if frame is None:
+                    break
+                self.request.sendall(frame)
+        except OSError:
+            pass
+        finally:
+            self.server.telemetry.remove_client(client)
+
+
+class TelemetryServer:
+    """
+    Batches published samples into frames and sends them to every client
+    at that client's decimation level. A slow client only loses its own
+    frames, which it sees as a gap in the sequence numbers.
+    """
+
+    def __init__(self, host=TELEMETRY_HOST, port=TELEMETRY_PORT, freeloader=None):
+        self.freeloader = freeloader  # Supplies the servo temperature of each sample, if given
+        self.server = socketserver.ThreadingTCPServer((host, port), TelemetryClientHandler)
+        self.server.daemon_threads = True
+        self.server.telemetry = self
+        self.address = self.server.server_address
+        self.clients = []
+        self.lock = threading.Lock()
+        self.pending = []
+        self.pending_index = 0  # Acquisition index of pending[0]
+        self.wakeup = threading.Event()
+        self.running = False
+
+    def add_client(self, client):
+        with self.lock:
+            self.clients.append(client)
+
+    def remove_client(self, client):
+        with self.lock:
+            self.clients.remove(client)
+
+    def publish(self, t_ns, position, load, temperature):
+        """ Queue one sample for the next frame """
+        with self.lock:
+            self.pending.append((t_ns, position, load, temperature))
+            full = len(self.pending) >= FRAME_MAX_RECORDS
+        if full:
+            self.wakeup.set()
+
+    def listener(self, t, position, weight):
+        """
+        Freeloader sample listener that publishes each measurement, stamped
+        with the time it was taken. With a freeloader the load is calibrated
+        and tared, as in saved runs; without one it is the raw weight.
+        """
+        if self.freeloader is None:
+            self.publish(int(t * 1e9), position, weight, float("nan"))
+        else:
+            freeloader = self.freeloader
+            self.publish(int(t * 1e9), position, freeloader.calibrated_load(weight), freeloader.servo_temperature)
+
+    def start(self):
+        """ Start accepting clients and sending frames """
+        self.running = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def stop(self):
+        """ Stop sending frames and close every client """
+        self.running = False
+        self.wakeup.set()
+        self.server.shutdown()
+        self.server.server_close()
+        with self.lock:
+            for client in self.clients:
+                try:
+                    client["queue"].put_nowait(None)
+                except queue.Full:
+                    pass
+
+    def run(self):
+        """ Thread target that turns pending samples into frames """
+        while self.running:
+            self.wakeup.wait(FRAME_INTERVAL)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """ Send everything pending as one frame per client """
+        with self.lock:
+            records, index = self.pending, self.pending_index
+            self.pending = []
+            self.pending_index += len(records)
+            clients = list(self.clients)
+
+        if not records:
+            return
+
+        # Clients asking for the same decimation share one selection of records
+        selections = {}
+        for client in clients:
+            decimation = client["decimation"]
+            if decimation not in selections:
+                first = -index % decimation
+                selections[decimation] = (index + first, records[first::decimation])
+            first_index, selected = selections[decimation]
+
+            for start in range(0, len(selected), FRAME_MAX_RECORDS):
+                frame = pack_frame(client["sequence"], first_index + start * decimation, decimation,
+                                   selected[start:start + FRAME_MAX_RECORDS])
+                client["sequence"] = (client["sequence"] + 1) & 0xFFFFFFFF
+                try:
+                    client["queue"].put_nowait(frame)
+                except queue.Full:
+                    pass
+
+
+class TelemetryClient:
+    """
+    Reference client. Iterate over frames() to get (sequence, index, records)
+    tuples; lost_frames counts the frames the sequence numbers show were missed.
+    """
+
+    def __init__(self, host=TELEMETRY_HOST, port=TELEMETRY_PORT, decimation=1):
+        if not 1 <= decimation <= MAX_DECIMATION:
+            raise ValueError(f"Decimation must be from 1 to {MAX_DECIMATION}.")
+        self.connection = socket.create_connection((host, port))
+        self.connection.sendall(bytes([decimation]))
+        self.expected_sequence = None
+        self.lost_frames = 0
+
+    def frames(self):
+        """ Yield frames until the server closes the connection """
+        while True:
+            header = read_exactly(self.connection, FRAME_HEADER.size)
+            if header is None:
+                return
+            magic, version, decimation, count, sequence, index = FRAME_HEADER.unpack(header)
+            if magic != PROTOCOL_MAGIC or version != PROTOCOL_VERSION:
+                raise ValueError("Not a Freeloader telemetry stream.")
+
+            payload = read_exactly(self.connection, count * FRAME_RECORD.size)
+            if payload is None:
+                return
+
+            if self.expected_sequence is not None:
+                self.lost_frames += (sequence - self.expected_sequence) & 0xFFFFFFFF
+            self.expected_sequence = (sequence + 1) & 0xFFFFFFFF
+
+            yield sequence, index, list(FRAME_RECORD.iter_unpack(payload))
+
+    def close(self):
+        self.connection.close()
+
+
+def benchmark(records=1000000):
+    """
+    Push records samples through a loopback TelemetryServer as fast as
+    possible and print the throughput the reference client sees, next to
+    the size and encode rate of the same samples as one JSON object each.
+    """
+    server = TelemetryServer(port=0)
+    server.start()
+    client = TelemetryClient(*server.address)
+    time.sleep(0.1)  # Let the server register the client
+
+    received = [0]
+
+    def consume():
+        for sequence, index, frame_records in client.frames():
+            received[0] += len(frame_records)
+            if received[0] >= records:
+                break
+
+    consumer = threading.Thread(target=consume)
+    start = time.perf_counter()
+    consumer.start()
+    t_ns = time.time_ns()
+    for i in range(records):
+        server.publish(t_ns + i * 1000, i * 0.001, 1.5, 30.0)
+        if i % FRAME_MAX_RECORDS == 0:
+            time.sleep(0)  # Give the flusher a chance, as a real acquisition loop would
+    consumer.join(timeout=60)
+    elapsed = time.perf_counter() - start
+    server.stop()
+    client.close()
+
+    binary_bytes = received[0] * FRAME_RECORD.size + (received[0] / FRAME_MAX_RECORDS) * FRAME_HEADER.size
+    start = time.perf_counter()
+    json_bytes = sum(
+        len(json.dumps({"t_ns": t_ns + i * 1000, "position": i * 0.001, "load": 1.5, "temperature": 30.0})) + 1
+        for i in range(records)
+    )
+    json_elapsed = time.perf_counter() - start
+
+    print("binary: {} samples in {:.2f} s, {:.0f} samples/s, ~{:.1f} bytes/sample, {} frames lost".format(
+        received[0], elapsed, received[0] / elapsed, binary_bytes / max(received[0], 1), client.lost_frames))
+    print("json:   encode only {:.0f} samples/s, {:.1f} bytes/sample".format(
+        records / json_elapsed, json_bytes / records))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Freeloader binary telemetry tools.")
+    parser.add_argument("--benchmark", action="store_true", help="loopback throughput test")
+    parser.add_argument("--records", type=int, default=1000000, help="samples to send in the benchmark")
+    parser.add_argument("--host", default=TELEMETRY_HOST)
+    parser.add_argument("--port", type=int, default=TELEMETRY_PORT)
+    parser.add_argument("--decimation", type=int, default=1, help="decimation level to request as a client")
+    args = parser.parse_args()
+    if not 1 <= args.decimation <= MAX_DECIMATION:
+        parser.error(f"--decimation must be from 1 to {MAX_DECIMATION}")
+
+    if args.benchmark:
+        benchmark(args.records)
+    else:
+        # Act as a simple viewer of a running stream
+        client = TelemetryClient(args.host, args.port, args.decimation)
+        try:
+            for sequence, index, records in client.frames():
+                t_ns, position, load, temperature = records[-1]
+                print(f"frame {sequence}: {len(records)} samples from #{index}, last load {load:.3f}, lost {client.lost_frames}")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            client.close()
@@ -0,0 +1,167 @@
+"""
+freeloadertiming
+
+Low-overhead timing instrumentation for the Freeloader sample pipeline.
+Each instrumented stage feeds a TimingHistogram, an HDR-style histogram
+with logarithmic buckets split into 64 linear sub-buckets, so percentiles
+are accurate to about 1.5% from nanoseconds up to hours without storing
+individual samples. Timing is off until TIMINGS.enabled is set and can be
+switched at any time; while off, an instrumented call costs one attribute
+check.
+"""
+
+import csv
+import functools
+import threading
+import time
+
+
+# Sub-bucket resolution: values are kept to SUB_BUCKET_BITS significant bits
+SUB_BUCKET_BITS = 7
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+SUB_BUCKET_HALF = SUB_BUCKET_COUNT // 2
+
+# Largest magnitude tracked; 2**45 ns is about 9.7 hours
+MAX_VALUE_BITS = 45
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def bucket_index(value):
+    """ Histogram bucket holding a non-negative integer value """
+    if value < SUB_BUCKET_COUNT:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return shift * SUB_BUCKET_HALF + (value >> shift)
+
+
+def bucket_value(index):
+    """ Lowest value that falls in bucket index """
+    if index < SUB_BUCKET_COUNT:
+        return index
+    shift = index // SUB_BUCKET_HALF - 1
+    return (index - shift * SUB_BUCKET_HALF) << shift
+
+
+class TimingHistogram:
+    """ HDR-style histogram of durations in nanoseconds """
+
+    def __init__(self):
+        self.counts = [0] * bucket_index((1 << MAX_VALUE_BITS) - 1)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, value):
+        """ Add one duration in nanoseconds """
+        index = bucket_index(value)
+        if index >= len(self.counts):
+            index = len(self.counts) - 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        """ Duration in nanoseconds below which percent of the records fall """
+        if not self.count:
+            return 0
+        target = max(1, round(self.count * percent / 100))
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target:
+                return min(bucket_value(index), self.max)
+        return self.max
+
+    def mean(self):
+        """ Mean duration in nanoseconds """
+        return self.total / self.count if self.count else 0.0
+
+    def summary(self):
+        """ Count, mean, percentiles and max, with times in microseconds """
+        row = {"count": self.count, "mean_us": self.mean() / 1000}
+        for percent in PERCENTILES:
+            row[f"p{percent}_us"] = self.percentile(percent) / 1000
+        row["max_us"] = self.max / 1000
+        return row
+
+
+class Instrumentation:
+    """
+    Set of named stage histograms that can be switched on and off at runtime.
+    Use timed(stage) to wrap a function, or call record(stage, ns) directly
+    around a block timed with time.perf_counter_ns.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def record(self, stage, duration_ns):
+        """ Add a duration in nanoseconds to a stage's histogram """
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(stage, TimingHistogram())
+        histogram.record(duration_ns)
+
+    def timed(self, stage):
+        """ Decorator that records each call's duration under stage while enabled """
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                start = time.perf_counter_ns()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.record(stage, time.perf_counter_ns() - start)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        """ Forget everything recorded so far """
+        with self.lock:
+            self.histograms = {}
+
+    def summaries(self):
+        """ Return a dict of stage name to its histogram summary """
+        return {stage: histogram.summary() for stage, histogram in sorted(self.histograms.items())}
+
+    def overhead_ns(self, calls=10000):
+        """ Average cost in nanoseconds of timing one call, measured on a scratch histogram """
+        histogram = TimingHistogram()
+        start = time.perf_counter_ns()
+        for _ in range(calls):
+            begin = time.perf_counter_ns()
+            histogram.record(time.perf_counter_ns() - begin)
+        return (time.perf_counter_ns() - start) / calls
+
+    def dump(self, filename):
+        """ Write every stage's summary to a CSV file """
+        summaries = self.summaries()
+        columns = ["count", "mean_us"] + [f"p{percent}_us" for percent in PERCENTILES] + ["max_us"]
+        with open(filename, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(["Stage"] + columns)
+            for stage, row in summaries.items():
+                writer.writerow([stage] + [row[column] for column in columns])
+
+    def report(self):
+        """ Return the summaries as a fixed-width text table """
+        lines = ["{:<14}{:>9}{:>11}{:>11}{:>11}{:>11}".format("stage", "count", "mean us", "p50 us", "p99 us", "max us")]
+        for stage, row in self.summaries().items():
+            lines.append("{:<14}{:>9}{:>11.1f}{:>11.1f}{:>11.1f}{:>11.1f}".format(
+                stage, row["count"], row["mean_us"], row["p50_us"], row["p99_us"], row["max_us"]))
+        return "\n".join(lines)
+
+
+# Shared instance used by the Freeloader scripts
+TIMINGS = Instrumentation()